@@ -0,0 +1,256 @@
+import json
+from dataclasses import dataclass, field, asdict, fields, MISSING
+from typing import Any, Dict, List, Optional
+
+from config import RETURNING_PATIENT_DURATION
+from database import db
+from communication import comm_manager
+
+
+# Inputs
+
+@dataclass
+class PatientQuery:
+    first_name: str
+    last_name: str
+
+
+@dataclass
+class NewPatient:
+    first_name: str
+    last_name: str
+    date_of_birth: str = ''
+    phone: str = ''
+    email: str = ''
+    insurance_carrier: str = ''
+    member_id: str = ''
+    group_number: str = ''
+
+
+@dataclass
+class SlotQuery:
+    doctor_name: str
+    date: str
+    duration: int = RETURNING_PATIENT_DURATION
+
+
+@dataclass
+class AppointmentRequest:
+    patient_id: Optional[str]
+    doctor_name: str
+    appointment_date: str
+    appointment_time: str
+    duration: int = RETURNING_PATIENT_DURATION
+    insurance_carrier: str = ''
+    member_id: str = ''
+    group_number: str = ''
+
+
+@dataclass
+class NotificationRequest:
+    doctor_name: str
+    appointment_date: str
+    appointment_time: str
+    duration: int
+    first_name: str
+    last_name: str
+    phone: str
+    email: str
+
+    def appointment_data(self) -> Dict[str, Any]:
+        """The appointment fields the communication templates read"""
+        return {'doctor_name': self.doctor_name, 'appointment_date': self.appointment_date,
+                'appointment_time': self.appointment_time, 'duration': self.duration}
+
+    def patient_data(self) -> Dict[str, Any]:
+        """The patient fields the communication templates read"""
+        return {'first_name': self.first_name, 'last_name': self.last_name, 'phone': self.phone, 'email': self.email}
+
+
+# Outputs; every tool reports failures in error instead of raising
+
+@dataclass
+class PatientSearchResult:
+    found: bool = False
+    patient_id: Optional[str] = None
+    is_new_patient: Optional[bool] = None
+    phone: Optional[str] = None
+    email: Optional[str] = None
+    insurance_carrier: Optional[str] = None
+    member_id: Optional[str] = None
+    group_number: Optional[str] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class NewPatientResult:
+    success: bool = False
+    patient_id: Optional[str] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class SlotsResult:
+    slots: List[Dict[str, Any]] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+@dataclass
+class BookingResult:
+    success: bool = False
+    appointment_id: Optional[str] = None
+    error: Optional[str] = None
+    # The slot was booked or held by someone else between showing it and booking it
+    slot_taken: bool = False
+
+
+@dataclass
+class NotificationResult:
+    email_sent: bool = False
+    sms_sent: bool = False
+    error: Optional[str] = None
+
+
+def _text(value):
+    """A cell value as a plain string, empty for missing values"""
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    return str(value)
+
+
+# Tools
+
+def search_patient(query: PatientQuery) -> PatientSearchResult:
+    """Search for existing patient in the database"""
+    try:
+        patients = db.find_patient(first_name=query.first_name, last_name=query.last_name)
+        if len(patients) == 0:
+            return PatientSearchResult(found=False)
+        patient = patients.iloc[0]
+        return PatientSearchResult(
+            found=True,
+            patient_id=patient['patient_id'],
+            is_new_patient=str(patient.get('is_new_patient')).lower() == 'true',
+            phone=_text(patient.get('phone', patient.get('cell_phone'))),
+            email=_text(patient.get('email')),
+            insurance_carrier=_text(patient.get('insurance_carrier', patient.get('primary_insurance_company'))),
+            member_id=_text(patient.get('member_id', patient.get('primary_member_id'))),
+            group_number=_text(patient.get('group_number', patient.get('primary_group_number')))
+        )
+    except Exception as e:
+        return PatientSearchResult(error=str(e))
+
+
+def add_new_patient(patient: NewPatient) -> NewPatientResult:
+    """Add a new patient to the database"""
+    try:
+        return NewPatientResult(success=True, patient_id=db.add_patient(asdict(patient)))
+    except Exception as e:
+        return NewPatientResult(error=str(e))
+
+
+def get_available_slots(query: SlotQuery, availability=None) -> SlotsResult:
+    """Get start times for a doctor on a specific date where a visit of duration minutes fits"""
+    try:
+        # A conversation's AvailabilityCache answers repeated lookups; without one the database is asked
+        source = availability or db
+        return SlotsResult(slots=source.get_available_slots(query.doctor_name, query.date, query.duration))
+    except Exception as e:
+        return SlotsResult(error=str(e))
+
+
+def book_appointment(request: AppointmentRequest) -> BookingResult:
+    """Book an appointment in the database"""
+    try:
+        appointment_id = db.book_appointment(asdict(request))
+        if appointment_id is None:
+            return BookingResult(error="That time slot is no longer available", slot_taken=True)
+        return BookingResult(success=True, appointment_id=appointment_id)
+    except Exception as e:
+        return BookingResult(error=str(e))
+
+
+def send_confirmation(request: NotificationRequest) -> NotificationResult:
+    """Send appointment confirmation email and SMS"""
+    try:
+        email_sent, sms_sent = comm_manager.send_appointment_confirmation(request.appointment_data(),
+                                                                         request.patient_data())
+        return NotificationResult(email_sent=email_sent, sms_sent=sms_sent)
+    except Exception as e:
+        return NotificationResult(error=str(e))
+
+
+def send_intake_form(request: NotificationRequest) -> NotificationResult:
+    """Send intake form to patient"""
+    try:
+        success = comm_manager.send_intake_form(request.appointment_data(), request.patient_data())
+        return NotificationResult(email_sent=bool(success))
+    except Exception as e:
+        return NotificationResult(error=str(e))
+
+
+# Async tools for the notifications, which wait on SMTP and Twilio. The database tools above stay
+# synchronous: they work on in-memory frames that are not safe to share across threads
+
+async def asend_confirmation(request: NotificationRequest) -> NotificationResult:
+    """Send appointment confirmation email and SMS concurrently"""
+    try:
+        email_sent, sms_sent = await comm_manager.asend_appointment_confirmation(request.appointment_data(),
+                                                                                request.patient_data())
+        return NotificationResult(email_sent=email_sent, sms_sent=sms_sent)
+    except Exception as e:
+        return NotificationResult(error=str(e))
+
+
+async def asend_intake_form(request: NotificationRequest) -> NotificationResult:
+    """Send intake form to patient"""
+    try:
+        success = await comm_manager.asend_intake_form(request.appointment_data(), request.patient_data())
+        return NotificationResult(email_sent=bool(success))
+    except Exception as e:
+        return NotificationResult(error=str(e))
+
+
+# Tool function -> its input dataclass
+TOOLS = {
+    search_patient: PatientQuery,
+    add_new_patient: NewPatient,
+    get_available_slots: SlotQuery,
+    book_appointment: AppointmentRequest,
+    send_confirmation: NotificationRequest,
+    send_intake_form: NotificationRequest,
+}
+
+
+# Adapters for LLM tool calling; in-process callers use the functions above directly
+
+def json_tool(function, input_type):
+    """Wrap a tool to take keyword arguments or a JSON object string and return a JSON string"""
+    def call(arguments=None, **kwargs):
+        if isinstance(arguments, str):
+            arguments = json.loads(arguments)
+        return json.dumps(asdict(function(input_type(**(arguments or {}), **kwargs))), default=str)
+
+    call.__name__ = function.__name__
+    call.__doc__ = function.__doc__
+    return call
+
+
+def langchain_tools():
+    """The tools as LangChain StructuredTools, with argument schemas taken from the input dataclasses"""
+    from langchain_core.tools import StructuredTool
+    from pydantic import create_model
+
+    structured_tools = []
+    for function, input_type in TOOLS.items():
+        schema = create_model(
+            input_type.__name__,
+            **{item.name: (item.type, ... if item.default is MISSING else item.default) for item in fields(input_type)}
+        )
+        structured_tools.append(StructuredTool.from_function(
+            func=json_tool(function, input_type),
+            name=function.__name__,
+            description=function.__doc__,
+            args_schema=schema
+        ))
+    return structured_tools
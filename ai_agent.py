@@ -1,112 +1,57 @@
-import re
-from datetime import datetime, timedelta
-from typing import Dict, List, Any
+import asyncio
+import inspect
+import time
+from datetime import datetime
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional, Tuple
 from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END
-from langchain.tools import tool
+from langgraph.config import get_stream_writer
+from langchain_core.runnables import RunnableConfig
 from langchain.schema import HumanMessage, AIMessage
-import json
 
-from config import OPENAI_API_KEY, DOCTORS, NEW_PATIENT_DURATION, RETURNING_PATIENT_DURATION
+from config import OPENAI_API_KEY, DOCTORS, NEW_PATIENT_DURATION, RETURNING_PATIENT_DURATION, PROMPT_TOKEN_BUDGET
 from database import db
-from communication import comm_manager
+from duplicate_detector import get_patient_matcher
+from nlu import extract_patient_info, parse_date, first_number, doctor_resolver
+from session_manager import SessionManager
+from llm_cache import CachedChatModel
+from streaming import unsent
+from conversation_memory import window, slot_summary, build_prompt
+from availability_cache import AvailabilityCache
+from intent_classifier import intent_router
+from agent_tools import (PatientQuery, NewPatient, SlotQuery, AppointmentRequest, NotificationRequest, NotificationResult,
+                         search_patient, add_new_patient, get_available_slots, book_appointment, send_confirmation,
+                         send_intake_form, asend_confirmation, asend_intake_form, langchain_tools)
 
-# Initialize LLM
-llm = ChatOpenAI(
+# Initialize LLM; repeated prompts are answered from the response cache
+llm = CachedChatModel(ChatOpenAI(
     api_key=OPENAI_API_KEY,
     model="gpt-3.5-turbo",
     temperature=0.1
-)
+))
+# Without a real key every turn stays with the deterministic handlers
+LLM_CONFIGURED = bool(OPENAI_API_KEY) and OPENAI_API_KEY != "your-openai-api-key-here"
+
+ESCALATION_PROMPT = ("You are the scheduling assistant of HealthFirst Medical Center. The patient wrote something the "
+                     "booking steps could not interpret. Answer briefly, then ask again for what the current step needs.")
 
 # Define state structure
+@dataclass
 class AgentState:
-    def __init__(self):
-        self.messages = []
-        self.current_step = "greeting"
-        self.patient_info = {}
-        self.appointment_info = {}
-        self.available_slots = []
-        self.insurance_info = {}
-        self.confirmation_sent = False
-        self.intake_form_sent = False
-        self.error_message = None
-
-# Tools for the AI agent
-@tool
-def search_patient(first_name: str, last_name: str) -> str:
-    """Search for existing patient in the database"""
-    try:
-        patients = db.find_patient(first_name=first_name, last_name=last_name)
-        if len(patients) > 0:
-            patient = patients.iloc[0]
-            return json.dumps({
-                "found": True,
-                "patient_id": patient['patient_id'],
-                "is_new_patient": patient['is_new_patient'],
-                "phone": patient['phone'],
-                "email": patient['email'],
-                "insurance_carrier": patient['insurance_carrier'],
-                "member_id": patient['member_id'],
-                "group_number": patient['group_number']
-            })
-        else:
-            return json.dumps({"found": False})
-    except Exception as e:
-        return json.dumps({"error": str(e)})
-
-@tool
-def add_new_patient(patient_data: str) -> str:
-    """Add a new patient to the database"""
-    try:
-        data = json.loads(patient_data)
-        patient_id = db.add_patient(data)
-        return json.dumps({"success": True, "patient_id": patient_id})
-    except Exception as e:
-        return json.dumps({"error": str(e)})
-
-@tool
-def get_available_slots(doctor_name: str, date: str) -> str:
-    """Get available time slots for a doctor on a specific date"""
-    try:
-        slots = db.get_available_slots(doctor_name, date)
-        return json.dumps({"slots": slots})
-    except Exception as e:
-        return json.dumps({"error": str(e)})
-
-@tool
-def book_appointment(appointment_data: str) -> str:
-    """Book an appointment in the database"""
-    try:
-        data = json.loads(appointment_data)
-        appointment_id = db.book_appointment(data)
-        return json.dumps({"success": True, "appointment_id": appointment_id})
-    except Exception as e:
-        return json.dumps({"error": str(e)})
+    messages: List[Any] = field(default_factory=list)
+    current_step: str = "greeting"
+    patient_info: Dict[str, Any] = field(default_factory=dict)
+    appointment_info: Dict[str, Any] = field(default_factory=dict)
+    available_slots: List[Dict[str, Any]] = field(default_factory=list)
+    insurance_info: Dict[str, Any] = field(default_factory=dict)
+    confirmation_sent: bool = False
+    intake_form_sent: bool = False
+    error_message: Optional[str] = None
 
-@tool
-def send_confirmation(appointment_data: str, patient_data: str) -> str:
-    """Send appointment confirmation email and SMS"""
-    try:
-        app_data = json.loads(appointment_data)
-        pat_data = json.loads(patient_data)
-        email_sent, sms_sent = comm_manager.send_appointment_confirmation(app_data, pat_data)
-        return json.dumps({"email_sent": email_sent, "sms_sent": sms_sent})
-    except Exception as e:
-        return json.dumps({"error": str(e)})
-
-@tool
-def send_intake_form(appointment_data: str, patient_data: str) -> str:
-    """Send intake form to patient"""
-    try:
-        app_data = json.loads(appointment_data)
-        pat_data = json.loads(patient_data)
-        success = comm_manager.send_intake_form(app_data, pat_data)
-        return json.dumps({"success": success})
-    except Exception as e:
-        return json.dumps({"error": str(e)})
-
-# Create tool executor
-tools = [search_patient, add_new_patient, get_available_slots, book_appointment, send_confirmation, send_intake_form]
+# Tools for the AI agent: nodes call the typed functions in process;
+# the LLM-facing versions take and return JSON
+tools = langchain_tools()
 
 # Define the conversation flow
 def greeting_node(state: AgentState) -> AgentState:
@@ -136,42 +81,34 @@ def collect_patient_info_node(state: AgentState) -> AgentState:
     messages = state.messages
     last_message = messages[-1] if messages else None
     
-    if isinstance(last_message, HumanMessage):
+    if isinstance(last_message, HumanMessage) and state.current_step == "confirm_identity":
         user_input = last_message.content.lower()
+        patient_id = state.patient_info.pop('possible_match_id', None)
+        # Compare what the patient gave with the stored record; the record itself is never shown
+        given = extract_patient_info(user_input, bare_name=False)
         
-        # Extract patient information using regex patterns
-        name_pattern = r"my name is (\w+) (\w+)|i'm (\w+) (\w+)|i am (\w+) (\w+)"
-        dob_pattern = r"(\d{1,2})[/-](\d{1,2})[/-](\d{4})"
-        phone_pattern = r"(\d{3})[-.]?(\d{3})[-.]?(\d{4})"
-        email_pattern = r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"
-        
-        # Extract information
-        name_match = re.search(name_pattern, user_input)
-        dob_match = re.search(dob_pattern, user_input)
-        phone_match = re.search(phone_pattern, user_input)
-        email_match = re.search(email_pattern, user_input)
-        
-        if name_match:
-            groups = name_match.groups()
-            if groups[0] and groups[1]:
-                state.patient_info['first_name'] = groups[0]
-                state.patient_info['last_name'] = groups[1]
-            elif groups[2] and groups[3]:
-                state.patient_info['first_name'] = groups[2]
-                state.patient_info['last_name'] = groups[3]
-            elif groups[4] and groups[5]:
-                state.patient_info['first_name'] = groups[4]
-                state.patient_info['last_name'] = groups[5]
+        if patient_id and get_patient_matcher().confirms_identity(patient_id, given.get('date_of_birth'), given.get('phone')):
+            # Use the existing record instead of registering a duplicate
+            state.patient_info['patient_id'] = patient_id
+            state.patient_info['is_new_patient'] = False
+            response = f"Welcome back, {state.patient_info['first_name']}! I've linked you to your existing record.\n\n"
+        else:
+            response = f"Thank you, {state.patient_info['first_name']}! I'll register you as a new patient.\n\n"
         
-        if dob_match:
-            month, day, year = dob_match.groups()
-            state.patient_info['date_of_birth'] = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
+        response += "Now I need to know which doctor you'd like to see. Here are our available doctors:\n"
+        for doctor_name, doctor_info in DOCTORS.items():
+            response += f"• {doctor_name} - {doctor_info['specialty']} ({doctor_info['location']})\n"
+        response += "\nWhich doctor would you prefer to see?"
         
-        if phone_match:
-            state.patient_info['phone'] = f"+1-{phone_match.group(1)}-{phone_match.group(2)}-{phone_match.group(3)}"
+        state.current_step = "select_doctor"
+        state.messages.append(AIMessage(content=response))
+        return state
+    
+    if isinstance(last_message, HumanMessage):
+        user_input = last_message.content.lower()
         
-        if email_match:
-            state.patient_info['email'] = email_match.group(0)
+        # Extract patient information in one scan; a bare "first last" is not taken as a name here
+        state.patient_info.update(extract_patient_info(user_input, bare_name=False))
         
         # Check if we have all required information
         required_fields = ['first_name', 'last_name', 'date_of_birth', 'phone', 'email']
@@ -188,35 +125,54 @@ def collect_patient_info_node(state: AgentState) -> AgentState:
             response += f"\nI still need: {', '.join(missing_fields).replace('_', ' ').title()}"
         else:
             # Search for existing patient
-            search_result = json.loads(search_patient(
+            search_result = search_patient(PatientQuery(
                 first_name=state.patient_info['first_name'],
                 last_name=state.patient_info['last_name']
             ))
             
-            if search_result.get('found'):
+            if search_result.found:
                 # Existing patient
-                state.patient_info['patient_id'] = search_result['patient_id']
-                state.patient_info['is_new_patient'] = search_result['is_new_patient']
-                state.patient_info['insurance_carrier'] = search_result['insurance_carrier']
-                state.patient_info['member_id'] = search_result['member_id']
-                state.patient_info['group_number'] = search_result['group_number']
+                state.patient_info['patient_id'] = search_result.patient_id
+                state.patient_info['is_new_patient'] = search_result.is_new_patient
+                state.patient_info['insurance_carrier'] = search_result.insurance_carrier
+                state.patient_info['member_id'] = search_result.member_id
+                state.patient_info['group_number'] = search_result.group_number
                 
                 response = f"Welcome back, {state.patient_info['first_name']}! I found your existing record. "
-                response += f"You're scheduled to see Dr. {search_result.get('doctor_name', 'TBD')} on {search_result.get('appointment_date', 'TBD')}.\n\n"
+                response += f"You're scheduled to see Dr. TBD on TBD.\n\n"
                 response += "What would you like to do?\n1. Schedule a new appointment\n2. Modify existing appointment\n3. Cancel appointment"
                 
                 state.current_step = "existing_patient_options"
             else:
-                # New patient
-                response = f"Thank you, {state.patient_info['first_name']}! I don't see you in our system, so I'll register you as a new patient.\n\n"
-                response += "Now I need to know which doctor you'd like to see. Here are our available doctors:\n"
-                
-                for doctor_name, doctor_info in DOCTORS.items():
-                    response += f"• {doctor_name} - {doctor_info['specialty']} ({doctor_info['location']})\n"
+                # No exact match - check for a likely typo of an existing record
+                possible_matches = get_patient_matcher().find_possible_matches(
+                    first_name=state.patient_info['first_name'],
+                    last_name=state.patient_info['last_name'],
+                    date_of_birth=state.patient_info['date_of_birth'],
+                    phone=state.patient_info['phone'],
+                    email=state.patient_info['email']
+                )
                 
-                response += "\nWhich doctor would you prefer to see?"
-                
-                state.current_step = "select_doctor"
+                if possible_matches:
+                    # Another patient's details must not be shown, so the patient proves the match instead
+                    state.patient_info['possible_match_id'] = possible_matches[0]['patient_id']
+                    
+                    response = ("I couldn't find an exact match for that name, but you may already have a record with us. "
+                                "To confirm it's you, please reply with the date of birth (MM/DD/YYYY) or phone number "
+                                "we have on file for you, or say 'no' to register as a new patient.")
+                    
+                    state.current_step = "confirm_identity"
+                else:
+                    # New patient
+                    response = f"Thank you, {state.patient_info['first_name']}! I don't see you in our system, so I'll register you as a new patient.\n\n"
+                    response += "Now I need to know which doctor you'd like to see. Here are our available doctors:\n"
+                    
+                    for doctor_name, doctor_info in DOCTORS.items():
+                        response += f"• {doctor_name} - {doctor_info['specialty']} ({doctor_info['location']})\n"
+                    
+                    response += "\nWhich doctor would you prefer to see?"
+                    
+                    state.current_step = "select_doctor"
         
         state.messages.append(AIMessage(content=response))
     
@@ -230,12 +186,8 @@ def select_doctor_node(state: AgentState) -> AgentState:
     if isinstance(last_message, HumanMessage):
         user_input = last_message.content.lower()
         
-        # Match doctor name
-        selected_doctor = None
-        for doctor_name in DOCTORS.keys():
-            if doctor_name.lower() in user_input or any(word in user_input for word in doctor_name.lower().split()):
-                selected_doctor = doctor_name
-                break
+        # Match doctor names, specialties and aliases like "heart doctor"
+        selected_doctor, candidates = doctor_resolver.match(user_input)
         
         if selected_doctor:
             state.appointment_info['doctor_name'] = selected_doctor
@@ -245,6 +197,10 @@ def select_doctor_node(state: AgentState) -> AgentState:
             response += "When would you like to schedule your appointment? Please provide a date (MM/DD/YYYY format) or you can say 'earliest available'."
             
             state.current_step = "select_date"
+        elif candidates:
+            response = "More than one of our doctors matches that. Which one would you like to see?\n"
+            for doctor_name in candidates:
+                response += f"• {doctor_name} - {DOCTORS[doctor_name]['specialty']}\n"
         else:
             response = "I didn't recognize that doctor's name. Please choose from our available doctors:\n"
             for doctor_name, doctor_info in DOCTORS.items():
@@ -254,7 +210,17 @@ def select_doctor_node(state: AgentState) -> AgentState:
     
     return state
 
-def select_date_node(state: AgentState) -> AgentState:
+def _visit_duration(state: AgentState) -> int:
+    """Minutes to reserve: new patients get a longer first visit"""
+    if state.patient_info.get('is_new_patient', True):
+        return NEW_PATIENT_DURATION
+    return RETURNING_PATIENT_DURATION
+
+def _availability(config: Optional[RunnableConfig]):
+    """The conversation's availability cache passed in the run config, if any"""
+    return ((config or {}).get("configurable") or {}).get("availability")
+
+def select_date_node(state: AgentState, config: Optional[RunnableConfig] = None) -> AgentState:
     """Handle date selection"""
     messages = state.messages
     last_message = messages[-1] if messages else None
@@ -263,12 +229,9 @@ def select_date_node(state: AgentState) -> AgentState:
         user_input = last_message.content.lower()
         
         # Extract date
-        date_pattern = r"(\d{1,2})[/-](\d{1,2})[/-](\d{4})"
-        date_match = re.search(date_pattern, user_input)
+        selected_date = parse_date(user_input)
         
-        if date_match:
-            month, day, year = date_match.groups()
-            selected_date = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
+        if selected_date:
             
             # Check if date is valid and in the future
             try:
@@ -281,13 +244,14 @@ def select_date_node(state: AgentState) -> AgentState:
                 state.appointment_info['appointment_date'] = selected_date
                 
                 # Get available slots
-                slots_result = json.loads(get_available_slots(
+                slots_result = get_available_slots(SlotQuery(
                     doctor_name=state.appointment_info['doctor_name'],
-                    date=selected_date
-                ))
+                    date=selected_date,
+                    duration=_visit_duration(state)
+                ), _availability(config))
                 
-                if slots_result.get('slots'):
-                    state.available_slots = slots_result['slots']
+                if slots_result.slots:
+                    state.available_slots = slots_result.slots
                     
                     response = f"Great! Here are the available time slots for {selected_date}:\n"
                     for i, slot in enumerate(state.available_slots, 1):
@@ -304,28 +268,25 @@ def select_date_node(state: AgentState) -> AgentState:
                 response = "I couldn't understand that date format. Please use MM/DD/YYYY format."
                 state.current_step = "select_date"
         elif "earliest" in user_input or "soonest" in user_input:
-            # Find earliest available date
-            today = datetime.now()
-            for i in range(30):  # Check next 30 days
-                check_date = (today + timedelta(days=i)).strftime('%Y-%m-%d')
-                slots_result = json.loads(get_available_slots(
-                    doctor_name=state.appointment_info['doctor_name'],
-                    date=check_date
-                ))
-                if slots_result.get('slots'):
-                    state.appointment_info['appointment_date'] = check_date
-                    state.available_slots = slots_result['slots']
-                    
-                    response = f"The earliest available appointment with Dr. {state.appointment_info['doctor_name']} is on {check_date}.\n\n"
-                    response += "Available time slots:\n"
-                    for i, slot in enumerate(state.available_slots, 1):
-                        response += f"{i}. {slot['time_slot']} ({slot['location']})\n"
-                    
-                    response += "\nWhich time slot would you prefer?"
-                    state.current_step = "select_time"
-                    break
+            # Find the earliest date where the whole visit fits
+            check_date, slots = db.find_earliest_slots(
+                doctor_name=state.appointment_info['doctor_name'],
+                duration=_visit_duration(state),
+                days=30  # Check next 30 days
+            )
+            if slots:
+                state.appointment_info['appointment_date'] = check_date
+                state.available_slots = slots
+                
+                response = f"The earliest available appointment with Dr. {state.appointment_info['doctor_name']} is on {check_date}.\n\n"
+                response += "Available time slots:\n"
+                for i, slot in enumerate(state.available_slots, 1):
+                    response += f"{i}. {slot['time_slot']} ({slot['location']})\n"
+                
+                response += "\nWhich time slot would you prefer?"
+                state.current_step = "select_time"
             else:
-                response = "I'm sorry, but Dr. {state.appointment_info['doctor_name']} doesn't have any available appointments in the next 30 days."
+                response = f"I'm sorry, but Dr. {state.appointment_info['doctor_name']} doesn't have any available appointments in the next 30 days."
         else:
             response = "I didn't understand that date. Please provide a date in MM/DD/YYYY format or say 'earliest available'."
         
@@ -345,9 +306,9 @@ def select_time_node(state: AgentState) -> AgentState:
         selected_slot = None
         
         # Check for number selection
-        number_match = re.search(r"(\d+)", user_input)
-        if number_match:
-            slot_index = int(number_match.group(1)) - 1
+        number = first_number(user_input)
+        if number is not None:
+            slot_index = number - 1
             if 0 <= slot_index < len(state.available_slots):
                 selected_slot = state.available_slots[slot_index]
         
@@ -363,10 +324,7 @@ def select_time_node(state: AgentState) -> AgentState:
             state.appointment_info['location'] = selected_slot['location']
             
             # Determine appointment duration
-            if state.patient_info.get('is_new_patient', True):
-                state.appointment_info['duration'] = NEW_PATIENT_DURATION
-            else:
-                state.appointment_info['duration'] = RETURNING_PATIENT_DURATION
+            state.appointment_info['duration'] = _visit_duration(state)
             
             response = f"Perfect! I've selected {selected_slot['time_slot']} for your appointment.\n\n"
             response += f"Appointment Summary:\n"
@@ -376,7 +334,11 @@ def select_time_node(state: AgentState) -> AgentState:
             response += f"• Duration: {state.appointment_info['duration']} minutes\n"
             response += f"• Location: {state.appointment_info['location']}\n\n"
             
-            response += "Now I need to collect your insurance information. What is your insurance carrier?"
+            if all(key in state.insurance_info for key in ('insurance_carrier', 'member_id', 'group_number')):
+                # Back here after the first pick was taken; the insurance details are already collected
+                response += "I still have your insurance details. Reply 'yes' to book this time."
+            else:
+                response += "Now I need to collect your insurance information. What is your insurance carrier?"
             state.current_step = "collect_insurance"
         else:
             response = "I didn't understand your time selection. Please choose a number from the list or specify the time."
@@ -385,6 +347,13 @@ def select_time_node(state: AgentState) -> AgentState:
     
     return state
 
+def _say(fragment: str):
+    """Stream the start of a response before the work that finishes it; a no-op outside a streamed run"""
+    try:
+        get_stream_writer()(fragment)
+    except RuntimeError:
+        pass
+
 def collect_insurance_node(state: AgentState) -> AgentState:
     """Collect insurance information"""
     messages = state.messages
@@ -394,7 +363,7 @@ def collect_insurance_node(state: AgentState) -> AgentState:
         user_input = last_message.content.lower()
         
         # Extract insurance information
-        if 'insurance' not in state.insurance_info:
+        if 'insurance_carrier' not in state.insurance_info:
             state.insurance_info['insurance_carrier'] = user_input.strip()
             
             response = "Thank you! What is your member ID number?"
@@ -404,159 +373,384 @@ def collect_insurance_node(state: AgentState) -> AgentState:
             
             response = "Great! What is your group number?"
             state.current_step = "collect_insurance"
-        elif 'group_number' not in state.insurance_info:
-            state.insurance_info['group_number'] = user_input.strip()
+        else:
+            state.insurance_info.setdefault('group_number', user_input.strip())
             
             # Complete appointment booking
             response = "Excellent! I have all the information I need. Let me book your appointment now.\n\n"
+            _say(response)
             
             # Prepare appointment data
-            appointment_data = {
-                'patient_id': state.patient_info.get('patient_id'),
-                'doctor_name': state.appointment_info['doctor_name'],
-                'appointment_date': state.appointment_info['appointment_date'],
-                'appointment_time': state.appointment_info['appointment_time'],
-                'duration': state.appointment_info['duration'],
-                'insurance_carrier': state.insurance_info['insurance_carrier'],
-                'member_id': state.insurance_info['member_id'],
-                'group_number': state.insurance_info['group_number']
-            }
+            appointment_request = AppointmentRequest(
+                patient_id=state.patient_info.get('patient_id'),
+                doctor_name=state.appointment_info['doctor_name'],
+                appointment_date=state.appointment_info['appointment_date'],
+                appointment_time=state.appointment_info['appointment_time'],
+                duration=state.appointment_info['duration'],
+                insurance_carrier=state.insurance_info['insurance_carrier'],
+                member_id=state.insurance_info['member_id'],
+                group_number=state.insurance_info['group_number']
+            )
             
             # If new patient, add to database first
             if not state.patient_info.get('patient_id'):
-                patient_data = {
-                    'first_name': state.patient_info['first_name'],
-                    'last_name': state.patient_info['last_name'],
-                    'date_of_birth': state.patient_info['date_of_birth'],
-                    'phone': state.patient_info['phone'],
-                    'email': state.patient_info['email'],
-                    'insurance_carrier': state.insurance_info['insurance_carrier'],
-                    'member_id': state.insurance_info['member_id'],
-                    'group_number': state.insurance_info['group_number']
-                }
-                
-                add_result = json.loads(add_new_patient(json.dumps(patient_data)))
-                if add_result.get('success'):
-                    appointment_data['patient_id'] = add_result['patient_id']
-                    state.patient_info['patient_id'] = add_result['patient_id']
+                add_result = add_new_patient(NewPatient(
+                    first_name=state.patient_info['first_name'],
+                    last_name=state.patient_info['last_name'],
+                    date_of_birth=state.patient_info['date_of_birth'],
+                    phone=state.patient_info['phone'],
+                    email=state.patient_info['email'],
+                    insurance_carrier=state.insurance_info['insurance_carrier'],
+                    member_id=state.insurance_info['member_id'],
+                    group_number=state.insurance_info['group_number']
+                ))
+                if add_result.success:
+                    appointment_request.patient_id = add_result.patient_id
+                    state.patient_info['patient_id'] = add_result.patient_id
             
             # Book appointment
-            book_result = json.loads(book_appointment(json.dumps(appointment_data)))
-            if book_result.get('success'):
-                appointment_data['appointment_id'] = book_result['appointment_id']
-                
+            book_result = book_appointment(appointment_request)
+            if book_result.success:
                 response += f"✅ Your appointment has been successfully booked!\n\n"
-                response += f"Appointment ID: {book_result['appointment_id']}\n"
-                response += f"Doctor: Dr. {appointment_data['doctor_name']}\n"
-                response += f"Date: {appointment_data['appointment_date']}\n"
-                response += f"Time: {appointment_data['appointment_time']}\n"
-                response += f"Duration: {appointment_data['duration']} minutes\n"
+                response += f"Appointment ID: {book_result.appointment_id}\n"
+                response += f"Doctor: Dr. {appointment_request.doctor_name}\n"
+                response += f"Date: {appointment_request.appointment_date}\n"
+                response += f"Time: {appointment_request.appointment_time}\n"
+                response += f"Duration: {appointment_request.duration} minutes\n"
                 response += f"Location: {state.appointment_info['location']}\n\n"
                 
                 response += "I'll now send you a confirmation email and SMS with all the details. "
                 response += "You'll also receive a pre-appointment intake form to complete before your visit.\n\n"
                 response += "Is there anything else I can help you with?"
                 
+                state.appointment_info['appointment_id'] = book_result.appointment_id
                 state.current_step = "confirmation"
                 state.confirmation_sent = True
+            elif book_result.slot_taken:
+                response += (f"I'm sorry, the {appointment_request.appointment_time} slot was just taken by another patient. "
+                             "Please provide another date and I'll show you what is still open.")
+                state.appointment_info.pop('appointment_time', None)
+                state.current_step = "select_date"
             else:
-                response = f"I'm sorry, but there was an error booking your appointment: {book_result.get('error', 'Unknown error')}. "
+                response += f"I'm sorry, but there was an error booking your appointment: {book_result.error or 'Unknown error'}. "
                 response += "Please try again or contact our office directly."
-                state.error_message = book_result.get('error')
+                state.error_message = book_result.error
         
         state.messages.append(AIMessage(content=response))
     
     return state
 
+def _notification(state: AgentState) -> NotificationRequest:
+    """Notification details of the booked appointment"""
+    return NotificationRequest(
+        doctor_name=state.appointment_info['doctor_name'],
+        appointment_date=state.appointment_info['appointment_date'],
+        appointment_time=state.appointment_info['appointment_time'],
+        duration=state.appointment_info['duration'],
+        first_name=state.patient_info['first_name'],
+        last_name=state.patient_info['last_name'],
+        phone=state.patient_info['phone'],
+        email=state.patient_info['email']
+    )
+
+def _destinations(state: AgentState, confirmation: NotificationResult) -> List[str]:
+    """Where the confirmation went, as shown to the patient"""
+    destinations = []
+    if confirmation.email_sent:
+        destinations.append(state.patient_info.get('email'))
+    if confirmation.sms_sent:
+        destinations.append(state.patient_info.get('phone'))
+    return destinations
+
+def _record_delivery(state: AgentState, confirmation: NotificationResult,
+                     intake_form: NotificationResult) -> Tuple[bool, Optional[str]]:
+    """Whether the confirmation reached the patient, and the error when it did not"""
+    error = confirmation.error or intake_form.error
+    if error is None and not (confirmation.email_sent or confirmation.sms_sent):
+        error = "Neither the confirmation email nor the SMS was sent"
+    if error is not None:
+        print(f"Error sending communications: {error}")
+        return False, error
+    # Something reached the patient; don't send it again on the next turn
+    state.intake_form_sent = True
+    return True, None
+
+def _confirmation_message(state: AgentState, sent: bool, error: Optional[str] = None,
+                          destinations: Optional[List[str]] = None, intake_form_sent: bool = False) -> AIMessage:
+    """Reply after the confirmation was sent, could not be sent, or went out on an earlier turn"""
+    if error is not None:
+        return AIMessage(content="Your appointment is booked, but I couldn't send the confirmation messages right now. "
+                                 "Our office will send them shortly.")
+    if not sent:
+        return AIMessage(content="You're all set! Your appointment is confirmed. Is there anything else I can help you with?")
+    response = f"📧 Confirmation sent to {' and '.join(destinations)}"
+    if intake_form_sent:
+        response += ", along with the patient intake form"
+    return AIMessage(content=response + ".")
+
+def _confirm(state: AgentState, confirmation: NotificationResult, intake_form: NotificationResult) -> AgentState:
+    """Record what the notifications delivered and tell the patient"""
+    sent, error = _record_delivery(state, confirmation, intake_form)
+    state.messages.append(_confirmation_message(state, sent, error, _destinations(state, confirmation),
+                                                intake_form.email_sent))
+    return state
+
 def confirmation_node(state: AgentState) -> AgentState:
     """Handle post-booking confirmation and communications"""
-    if state.confirmation_sent and not state.intake_form_sent:
-        # Send confirmation and intake form
-        try:
-            # Send confirmation
-            appointment_data = {
-                'doctor_name': state.appointment_info['doctor_name'],
-                'appointment_date': state.appointment_info['appointment_date'],
-                'appointment_time': state.appointment_info['appointment_time'],
-                'duration': state.appointment_info['duration']
-            }
-            
-            patient_data = {
-                'first_name': state.patient_info['first_name'],
-                'last_name': state.patient_info['last_name'],
-                'phone': state.patient_info['phone'],
-                'email': state.patient_info['email']
-            }
-            
-            # Send confirmation
-            send_confirmation(json.dumps(appointment_data), json.dumps(patient_data))
-            
-            # Send intake form
-            send_intake_form(json.dumps(appointment_data), json.dumps(patient_data))
-            
-            state.intake_form_sent = True
-            
-        except Exception as e:
-            print(f"Error sending communications: {str(e)}")
+    if not state.confirmation_sent or state.intake_form_sent:
+        state.messages.append(_confirmation_message(state, False))
+        return state
+    
+    # Send confirmation and intake form; the tools report failures in their results
+    notification = _notification(state)
+    return _confirm(state, send_confirmation(notification), send_intake_form(notification))
+
+async def aconfirmation_node(state: AgentState) -> AgentState:
+    """Handle post-booking confirmation, sending the email, SMS and intake form concurrently"""
+    if not state.confirmation_sent or state.intake_form_sent:
+        state.messages.append(_confirmation_message(state, False))
+        return state
+    
+    notification = _notification(state)
+    confirmation, intake_form = await asyncio.gather(asend_confirmation(notification), asend_intake_form(notification))
+    return _confirm(state, confirmation, intake_form)
+
+def _on_loop(node):
+    """Async node that runs a synchronous node on the event loop itself"""
+    # LangGraph would otherwise run it on a worker thread, and the database is not thread-safe
+    takes_config = 'config' in inspect.signature(node).parameters
+    
+    async def run(state: AgentState, config: RunnableConfig) -> AgentState:
+        return node(state, config) if takes_config else node(state)
     
+    run.__name__ = node.__name__
+    return run
+
+def _escalation_prompt(state: AgentState) -> List[Any]:
+    """Prompt asking the LLM about the latest message in the context of the current step"""
+    summary = slot_summary(state.patient_info, state.appointment_info, state.insurance_info)
+    return build_prompt(f"{ESCALATION_PROMPT}\nCurrent step: {state.current_step.replace('_', ' ')}.",
+                        summary, state.messages)
+
+def _step_reply(state: AgentState, config: Optional[RunnableConfig]) -> AgentState:
+    """Let the step's own handler answer when the LLM cannot"""
+    node = WORKFLOW_NODES[STEP_NODES.get(state.current_step, "collect_patient_info")]
+    return node(state, config) if 'config' in inspect.signature(node).parameters else node(state)
+
+def llm_reply_node(state: AgentState, config: RunnableConfig = None) -> AgentState:
+    """Answer ambiguous free text with the LLM, leaving the conversation on the same step"""
+    prompt = _escalation_prompt(state)
+    started = time.perf_counter()
+    try:
+        tokens = []
+        # The prompt carries the patient's details and messages, so the response is cached in memory only
+        for token in llm.stream(prompt, persist=False):
+            _say(token)
+            tokens.append(token)
+        response = "".join(tokens)
+    except Exception as e:
+        print(f"Error asking the LLM: {str(e)}")
+        return _step_reply(state, config)
+    intent_router.record_llm_call(time.perf_counter() - started)
+    
+    state.messages.append(AIMessage(content=response))
     return state
 
+async def allm_reply_node(state: AgentState, config: RunnableConfig = None) -> AgentState:
+    """Answer ambiguous free text with the LLM on a worker thread, so other conversations keep the event loop"""
+    prompt = _escalation_prompt(state)
+    started = time.perf_counter()
+    try:
+        response = await asyncio.get_running_loop().run_in_executor(None, lambda: "".join(llm.stream(prompt, persist=False)))
+    except Exception as e:
+        print(f"Error asking the LLM: {str(e)}")
+        # Back on the loop, where the database may be used
+        return _step_reply(state, config)
+    intent_router.record_llm_call(time.perf_counter() - started)
+    
+    _say(response)
+    state.messages.append(AIMessage(content=response))
+    return state
+
+# Nodes of the workflow by name
+WORKFLOW_NODES = {
+    "greeting": greeting_node,
+    "collect_patient_info": collect_patient_info_node,
+    "select_doctor": select_doctor_node,
+    "select_date": select_date_node,
+    "select_time": select_time_node,
+    "collect_insurance": collect_insurance_node,
+    "confirmation": confirmation_node,
+    "llm_reply": llm_reply_node,
+}
+
+# Node that handles the next message in each conversation step
+STEP_NODES = {
+    "greeting": "collect_patient_info",
+    "collecting_patient_info": "collect_patient_info",
+    "confirm_identity": "collect_patient_info",
+    "existing_patient_options": "select_doctor",
+    "select_doctor": "select_doctor",
+    "select_date": "select_date",
+    "select_time": "select_time",
+    "collect_insurance": "collect_insurance",
+    "confirmation": "confirmation",
+}
+
+def route_step(state: AgentState) -> str:
+    """Name of the one node that should handle the current message"""
+    if not state.messages or not isinstance(state.messages[-1], HumanMessage):
+        return "greeting"
+    # Turns the local classifier recognizes go straight to the step's handler; only ambiguous free text costs an LLM call
+    _, local = intent_router.route(state.current_step, state.messages[-1].content)
+    if not local and LLM_CONFIGURED:
+        return "llm_reply"
+    return STEP_NODES.get(state.current_step, "collect_patient_info")
+
+def after_booking(state: AgentState) -> str:
+    """Send the confirmation in the same turn as the booking; otherwise the turn is over"""
+    if state.confirmation_sent and not state.intake_form_sent:
+        return "confirmation"
+    return END
+
 # Create the workflow graph
-def create_workflow():
-    """Create the LangGraph workflow"""
+def create_workflow(nodes=None):
+    """Create the LangGraph workflow: each turn is routed straight to the node for its step"""
+    nodes = nodes or WORKFLOW_NODES
     workflow = StateGraph(AgentState)
     
-    # Add nodes
-    workflow.add_node("greeting", greeting_node)
-    workflow.add_node("collect_patient_info", collect_patient_info_node)
-    workflow.add_node("select_doctor", select_doctor_node)
-    workflow.add_node("select_date", select_date_node)
-    workflow.add_node("select_time", select_time_node)
-    workflow.add_node("collect_insurance", collect_insurance_node)
-    workflow.add_node("confirmation", confirmation_node)
-    
-    # Add edges
-    workflow.add_edge("greeting", "collect_patient_info")
-    workflow.add_edge("collect_patient_info", "select_doctor")
-    workflow.add_edge("select_doctor", "select_date")
-    workflow.add_edge("select_date", "select_time")
-    workflow.add_edge("select_time", "collect_insurance")
-    workflow.add_edge("collect_insurance", "confirmation")
-    workflow.add_edge("confirmation", END)
+    # Add nodes; each handles one turn and ends it, except that a booking goes on to send its confirmation
+    for name, node in nodes.items():
+        workflow.add_node(name, node)
+        if name == "collect_insurance":
+            workflow.add_conditional_edges(name, after_booking, {"confirmation": "confirmation", END: END})
+        else:
+            workflow.add_edge(name, END)
     
-    # Set entry point
-    workflow.set_entry_point("greeting")
+    # Dispatch on the conversation step instead of walking the whole chain
+    workflow.set_conditional_entry_point(route_step, {name: name for name in nodes})
     
     return workflow.compile()
 
 # Create the workflow instance
 workflow = create_workflow()
 
+# Async nodes for aprocess_message: sends and LLM calls are awaited off the loop, everything else runs on it
+ASYNC_WORKFLOW_NODES = {name: _on_loop(node) for name, node in WORKFLOW_NODES.items()}
+ASYNC_WORKFLOW_NODES["confirmation"] = aconfirmation_node
+ASYNC_WORKFLOW_NODES["llm_reply"] = allm_reply_node
+
+async_workflow = create_workflow(ASYNC_WORKFLOW_NODES)
+
+# Agent state per chat session, so concurrent patients never share one
+sessions = SessionManager(AgentState)
+
 class MedicalSchedulingAgent:
-    def __init__(self):
-        """Initialize the medical scheduling agent"""
+    def __init__(self, session_id=None):
+        """Initialize the medical scheduling agent, optionally bound to a chat session"""
         self.workflow = workflow
-        self.state = AgentState()
+        self.session_id = session_id
+        self.state = AgentState() if session_id is None else sessions.get(session_id)
+        # Availability lookups memoized for this conversation, handed to the nodes in the run config
+        self.availability = AvailabilityCache()
+        self.run_config = {"configurable": {"availability": self.availability}}
+    
+    def get_state(self) -> AgentState:
+        """The conversation state, e.g. to store it elsewhere"""
+        return self.state
+    
+    def load_state(self, state: AgentState):
+        """Continue a conversation from a stored state"""
+        self.state = state
     
     def process_message(self, user_message: str) -> str:
         """Process a user message and return the agent's response"""
+        try:
+            return self._process_message(user_message)
+        finally:
+            if self.session_id is not None:
+                sessions.put(self.session_id, self.state)
+    
+    def _process_message(self, user_message: str) -> str:
+        """Run the workflow on a message"""
         try:
             # Add user message to state
             self.state.messages.append(HumanMessage(content=user_message))
             
-            # Run the workflow
-            result = self.workflow.invoke(self.state)
+            # Run the workflow; it returns the updated state as a dict
+            self._update_state(self.workflow.invoke(self.state, self.run_config))
+            
+            return self._last_response()
+            
+        except Exception as e:
+            return f"I encountered an error: {str(e)}. Please try again or contact our office directly."
+    
+    def process_message_stream(self, user_message: str):
+        """Process a user message, yielding the response in fragments as soon as each is ready"""
+        sent = ""
+        try:
+            self.state.messages.append(HumanMessage(content=user_message))
             
-            # Get the last AI message
-            if result.messages:
-                last_message = result.messages[-1]
-                if isinstance(last_message, AIMessage):
-                    return last_message.content
+            # Custom chunks are fragments nodes send ahead of slow work; the last values chunk is the new state
+            values = None
+            for mode, chunk in self.workflow.stream(self.state, self.run_config, stream_mode=["custom", "values"]):
+                if mode == "custom":
+                    sent += chunk
+                    yield chunk
+                else:
+                    values = chunk
+            self._update_state(values)
+            response = self._last_response()
             
-            return "I'm sorry, I didn't understand that. Could you please rephrase?"
+        except Exception as e:
+            response = f"I encountered an error: {str(e)}. Please try again or contact our office directly."
+        finally:
+            if self.session_id is not None:
+                sessions.put(self.session_id, self.state)
+        
+        yield from unsent(response, sent)
+    
+    async def aprocess_message(self, user_message: str) -> str:
+        """Process a user message on the running event loop and return the agent's response"""
+        try:
+            return await self._aprocess_message(user_message)
+        finally:
+            if self.session_id is not None:
+                sessions.put(self.session_id, self.state)
+    
+    async def _aprocess_message(self, user_message: str) -> str:
+        """Run the async workflow on a message"""
+        try:
+            self.state.messages.append(HumanMessage(content=user_message))
+            self._update_state(await async_workflow.ainvoke(self.state, self.run_config))
+            return self._last_response()
             
         except Exception as e:
             return f"I encountered an error: {str(e)}. Please try again or contact our office directly."
+    
+    def _update_state(self, values: Dict[str, Any]):
+        """Take the state a workflow run returned, keeping only the recent messages"""
+        self.state = AgentState(**values)
+        # Everything collected so far lives in the info fields, so older messages are not needed
+        window(self.state.messages)
+    
+    def prompt_messages(self, system_prompt: str, token_budget: int = PROMPT_TOKEN_BUDGET) -> List[Any]:
+        """Messages for an LLM call about this conversation: the collected details plus the latest turns that fit"""
+        summary = slot_summary(self.state.patient_info, self.state.appointment_info, self.state.insurance_info)
+        return build_prompt(system_prompt, summary, self.state.messages, token_budget)
+    
+    def _last_response(self) -> str:
+        """Content of the agent's messages since the user's last one"""
+        # A turn can end with several AI messages, e.g. the booking and then its confirmation
+        replies = []
+        for message in reversed(self.state.messages):
+            if not isinstance(message, AIMessage):
+                break
+            replies.append(message.content)
+        if replies:
+            return "\n\n".join(reversed(replies))
+        
+        return "I'm sorry, I didn't understand that. Could you please rephrase?"
 
 # Global agent instance
 agent = MedicalSchedulingAgent()
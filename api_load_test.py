@@ -0,0 +1,206 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import aiohttp
+
+from load_generator import DOCTOR_REQUESTS, DOCTOR_WEIGHTS, arrival_offsets, build_scripts
+from replay import _percentile
+
+# Like load_generator, config is only imported once the data directory is chosen
+
+
+class Recorder:
+    def __init__(self):
+        """Latency and status of every request, grouped by endpoint"""
+        self.latencies = defaultdict(list)
+        self.statuses = Counter()
+        self.outcomes = Counter()
+
+    async def request(self, http, method, url, endpoint, **kwargs):
+        """Send a request, recording how long it took and its status; returns (status, JSON body)"""
+        started = time.perf_counter()
+        try:
+            async with http.request(method, url, **kwargs) as response:
+                body = await response.json() if response.content_type == 'application/json' else None
+                status = response.status
+        except aiohttp.ClientError as e:
+            body, status = {'error': str(e)}, 'connection_error'
+        self.latencies[endpoint].append(time.perf_counter() - started)
+        self.statuses[f"{endpoint} {status}"] += 1
+        return status, body
+
+    def report(self, wall):
+        """Throughput, status counts and latency percentiles per endpoint"""
+        requests = sum(len(latencies) for latencies in self.latencies.values())
+        return {
+            'requests': requests,
+            'seconds': round(wall, 3),
+            'requests_per_second': round(requests / wall, 1) if wall else 0.0,
+            'outcomes': dict(self.outcomes),
+            'statuses': dict(sorted(self.statuses.items())),
+            'latency_ms': {endpoint: {'p50': round(_percentile(latencies, 50) * 1000, 2),
+                                      'p95': round(_percentile(latencies, 95) * 1000, 2),
+                                      'p99': round(_percentile(latencies, 99) * 1000, 2)}
+                           for endpoint, latencies in sorted(self.latencies.items())}
+        }
+
+
+async def converse(http, base_url, recorder, number, script):
+    """Send a script's turns to one session in order"""
+    session_url = f"{base_url}/sessions/load-{number}"
+    body = {}
+    for message in script['turns']:
+        status, body = await recorder.request(http, 'POST', f"{session_url}/messages", 'message', json={'message': message})
+        if status != 200:
+            recorder.outcomes['conversation_errors'] += 1
+            return
+    recorder.outcomes['conversations'] += 1
+    appointment_id = (body or {}).get('appointment_id')
+    recorder.outcomes['conversations_booked'] += bool(appointment_id)
+    if appointment_id and script['cancel']:
+        status, _ = await recorder.request(http, 'DELETE', f"{base_url}/appointments/{appointment_id}", 'cancel')
+        recorder.outcomes['cancelled'] += status == 200
+    await recorder.request(http, 'DELETE', session_url, 'end_session')
+
+
+async def book_directly(http, base_url, recorder, rng, patient_id, days, cancel_share):
+    """Search a popular doctor's slots, book the first one and sometimes cancel it, as a booking widget would"""
+    doctor = rng.choices(DOCTOR_REQUESTS, weights=DOCTOR_WEIGHTS)[0].replace('dr. ', '')
+    date = datetime.now() + timedelta(days=rng.randint(1, days))
+    while date.weekday() >= 5:
+        date += timedelta(days=1)
+    status, body = await recorder.request(http, 'GET', f"{base_url}/slots", 'slots',
+                                          params={'doctor': doctor, 'date': date.strftime('%Y-%m-%d')})
+    if status != 200 or not body['slots']:
+        recorder.outcomes['direct_no_slots'] += 1
+        return
+    status, body = await recorder.request(http, 'POST', f"{base_url}/appointments", 'book', json={
+        'patient_id': patient_id, 'doctor_name': body['doctor_name'], 'appointment_date': body['date'],
+        'appointment_time': body['slots'][0]['time_slot'], 'duration': body['duration']})
+    if status == 409:
+        recorder.outcomes['direct_conflicts'] += 1
+        return
+    if status != 201:
+        recorder.outcomes['direct_errors'] += 1
+        return
+    recorder.outcomes['direct_booked'] += 1
+    if rng.random() < cancel_share:
+        status, _ = await recorder.request(http, 'DELETE', f"{base_url}/appointments/{body['appointment_id']}", 'cancel')
+        recorder.outcomes['cancelled'] += status == 200
+
+
+async def run(base_url, scripts, patient_ids, args):
+    """Start conversations and direct bookings at the arrival rate over a pool of keep-alive connections"""
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    # A direct booking arrives in place of a conversation at the configured share
+    jobs = [('direct' if rng.random() < args.direct_share and patient_ids else 'conversation', number)
+            for number in range(len(scripts))]
+    connector = aiohttp.TCPConnector(limit=args.connections, keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=120)) as http:
+        status, _ = await recorder.request(http, 'GET', f"{base_url}/health", 'health')
+        if status != 200:
+            raise RuntimeError(f"Booking API at {base_url} is not answering: {status}")
+
+        tasks = []
+        started = time.perf_counter()
+        for (kind, number), offset in zip(jobs, arrival_offsets(len(jobs), args.rate, args.seed)):
+            await asyncio.sleep(max(0.0, started + offset - time.perf_counter()))
+            if kind == 'direct':
+                job = book_directly(http, base_url, recorder, rng, rng.choice(patient_ids), args.days, args.cancel_share)
+            else:
+                job = converse(http, base_url, recorder, number, scripts[number])
+            tasks.append(asyncio.create_task(job))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - started
+    return recorder.report(wall)
+
+
+@contextlib.contextmanager
+def serve(port, data_dir):
+    """Run the booking API in a child process against a data directory until the block ends"""
+    server = subprocess.Popen([sys.executable, 'booking_api.py', '--port', str(port), '--stand-in-messaging-ms', '20'],
+                              env={**os.environ, 'DATA_DIR': data_dir},
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        yield
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def wait_until_up(base_url, timeout=60):
+    """Wait for a freshly started server to answer its health check"""
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as http:
+        while time.monotonic() < deadline:
+            with contextlib.suppress(aiohttp.ClientError):
+                async with http.get(f"{base_url}/health") as response:
+                    if response.status == 200:
+                        return
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Booking API at {base_url} did not start within {timeout} seconds")
+
+
+def main():
+    """Load-test the booking API with conversations and direct bookings, printing a JSON report"""
+    parser = argparse.ArgumentParser(description="Load-test the booking HTTP API")
+    parser.add_argument('--url', help="API to test; by default one is started on --port with fresh sample data")
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--conversations', type=int, default=200, help="conversations and direct bookings in total")
+    parser.add_argument('--rate', type=float, default=20.0, help="arrivals per second")
+    parser.add_argument('--direct-share', type=float, default=0.3, help="share of arrivals using the scheduling endpoints")
+    parser.add_argument('--connections', type=int, default=50, help="keep-alive connections in the client pool")
+    parser.add_argument('--new-share', type=float, default=0.4)
+    parser.add_argument('--cancel-share', type=float, default=0.1)
+    parser.add_argument('--days', type=int, default=14)
+    parser.add_argument('--seed', type=int, default=11)
+    parser.add_argument('--data-dir', help="data directory of the API; returning patients and direct bookings come from it")
+    parser.add_argument('--output', help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or (None if args.url else tempfile.mkdtemp(prefix="api-load-"))
+    if data_dir:
+        os.environ['DATA_DIR'] = data_dir
+    with open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):
+        random.seed(args.seed)
+        from data_generator import create_sample_data, generate_patient_data
+        returning = []
+        if data_dir:
+            if not args.data_dir:
+                create_sample_data()
+            from database import db
+            returning = db.patients_df.to_dict('records')
+        scripts = build_scripts(args.conversations, returning, generate_patient_data(args.conversations).to_dict('records'),
+                                'ai', args.seed, args.new_share if returning else 1.0, cancel_share=args.cancel_share,
+                                days=args.days)
+    patient_ids = [patient['patient_id'] for patient in returning]
+
+    base_url = (args.url or f"http://127.0.0.1:{args.port}").rstrip('/')
+    with contextlib.nullcontext() if args.url else serve(args.port, data_dir):
+        if not args.url:
+            asyncio.run(wait_until_up(base_url))
+        results = asyncio.run(run(base_url, scripts, patient_ids, args))
+
+    report = {'url': base_url, 'rate': args.rate, 'connections': args.connections, 'direct_share': args.direct_share,
+              'seed': args.seed, 'data_dir': data_dir, **results}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from config import PENDING_HOLD_TTL_MINUTES, CANCELLED_RETENTION_DAYS
+from database import db
+
+
+def _parse_timestamps(values):
+    """Parse date or date-time strings; unparseable values become NaT"""
+    return pd.to_datetime(values, errors='coerce', format='mixed')
+
+
+class AppointmentCompactor:
+    def __init__(self, database, pending_ttl_minutes=PENDING_HOLD_TTL_MINUTES,
+                 cancelled_retention_days=CANCELLED_RETENTION_DAYS):
+        """Initialize the compaction job for a database"""
+        self.database = database
+        self.pending_ttl = timedelta(minutes=pending_ttl_minutes)
+        self.cancelled_retention = timedelta(days=cancelled_retention_days)
+        self.last_metrics = None
+        self.totals = {
+            'runs': 0,
+            'expired_pending': 0,
+            'slots_freed': 0,
+            'archived_rows': 0
+        }
+
+    def find_stale_pending(self, now):
+        """IDs of pending appointments whose hold has run out, or without a hold and older than the hold TTL"""
+        appointments = self.database.appointments_df
+        pending = appointments[appointments['status'] == 'pending']
+        created = _parse_timestamps(pending['created_date'])
+        stale = []
+        for appointment_id, created_at in zip(pending['appointment_id'], created):
+            # A hold knows its own expiry, e.g. the longer one of a waitlist offer
+            hold = self.database.slot_holds.get_hold(appointment_id)
+            if hold is not None:
+                if hold.expires_at <= now:
+                    stale.append(appointment_id)
+            elif created_at < now - self.pending_ttl:
+                stale.append(appointment_id)
+        return stale
+
+    def find_archivable(self, now):
+        """IDs of expired appointments and of cancellations past the retention window"""
+        appointments = self.database.appointments_df
+        expired = appointments[appointments['status'] == 'expired']
+
+        cancelled = appointments[appointments['status'] == 'cancelled']
+        if 'cancelled_date' in cancelled.columns:
+            # Rows cancelled before the cancellation time was recorded fall back to their creation time
+            cancelled_at = _parse_timestamps(cancelled['cancelled_date']).fillna(
+                _parse_timestamps(cancelled['created_date'])
+            )
+        else:
+            cancelled_at = _parse_timestamps(cancelled['created_date'])
+        past_retention = cancelled[cancelled_at < now - self.cancelled_retention]
+
+        return expired['appointment_id'].tolist() + past_retention['appointment_id'].tolist()
+
+    def run(self, now=None):
+        """Expire stale pending holds, archive dead rows and return metrics on rows reclaimed"""
+        started = time.perf_counter()
+        now = now or datetime.now()
+        rows_before = len(self.database.appointments_df)
+        self.database.sweep_expired_holds()
+
+        expired_count, slots_freed = self.database.expire_appointments(self.find_stale_pending(now))
+        archived_count = self.database.archive_appointments(self.find_archivable(now))
+
+        metrics = {
+            'run_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'rows_before': rows_before,
+            'rows_after': len(self.database.appointments_df),
+            'expired_pending': expired_count,
+            'slots_freed': slots_freed,
+            'archived_rows': archived_count,
+            'duration_seconds': round(time.perf_counter() - started, 3)
+        }
+
+        self.last_metrics = metrics
+        self.totals['runs'] += 1
+        self.totals['expired_pending'] += expired_count
+        self.totals['slots_freed'] += slots_freed
+        self.totals['archived_rows'] += archived_count
+
+        print(f"Appointment compaction: expired {expired_count} pending, archived {archived_count}, "
+              f"{metrics['rows_before']} -> {metrics['rows_after']} rows")
+        return metrics
+
+    def get_metrics(self):
+        """Metrics of the last run and running totals since startup"""
+        return {'last_run': self.last_metrics, 'totals': dict(self.totals)}
+
+
+# Global compaction job instance
+compactor = AppointmentCompactor(db)
+
+if __name__ == "__main__":
+    print(compactor.run())
@@ -0,0 +1,75 @@
+from collections import Counter
+
+from config import NEW_PATIENT_DURATION
+
+
+def visit_type(duration):
+    """'new' for new-patient length visits, 'returning' otherwise"""
+    try:
+        return 'new' if int(duration) >= NEW_PATIENT_DURATION else 'returning'
+    except (TypeError, ValueError):
+        return 'returning'
+
+
+class AppointmentStats:
+    def __init__(self):
+        """Initialize empty appointment counters"""
+        self._reset()
+
+    def _reset(self):
+        """Forget every counted appointment"""
+        # appointment_id -> (status, visit type), so events carrying only IDs can be counted
+        self._appointments = {}
+        self.status_counts = Counter()
+        self.visit_type_counts = Counter()
+
+    def build(self, appointments_df):
+        """Count every appointment in a table, replacing the current counts"""
+        self._reset()
+        for appointment_id, status, duration in zip(appointments_df['appointment_id'], appointments_df['status'],
+                                                    appointments_df['duration']):
+            self._set(appointment_id, status, visit_type(duration))
+
+    def _set(self, appointment_id, status, kind=None):
+        """Move an appointment to a status, keeping the counters in step"""
+        previous = self._appointments.get(appointment_id)
+        if previous:
+            self.status_counts[previous[0]] -= 1
+            self.visit_type_counts[previous[1]] -= 1
+            kind = kind or previous[1]
+        kind = kind or 'returning'
+        self._appointments[appointment_id] = (status, kind)
+        self.status_counts[status] += 1
+        self.visit_type_counts[kind] += 1
+
+    def _remove(self, appointment_id):
+        """Stop counting an appointment"""
+        previous = self._appointments.pop(appointment_id, None)
+        if previous:
+            self.status_counts[previous[0]] -= 1
+            self.visit_type_counts[previous[1]] -= 1
+
+    def on_event(self, event, payload):
+        """Apply one database mutation to the counters"""
+        if event == 'appointment_created':
+            self._set(payload['appointment_id'], payload['status'], visit_type(payload.get('duration')))
+        elif event == 'appointment_confirmed':
+            self._set(payload['appointment_id'], 'confirmed')
+        elif event == 'appointment_cancelled':
+            self._set(payload['appointment_id'], 'cancelled')
+        elif event == 'appointments_expired':
+            for appointment_id in payload['appointment_ids']:
+                self._set(appointment_id, 'expired')
+        elif event == 'appointments_archived':
+            for appointment_id in payload['appointment_ids']:
+                self._remove(appointment_id)
+
+    def summary(self):
+        """Counts by status and by visit type, plus the total"""
+        return {
+            'total_appointments': len(self._appointments),
+            'status_counts': {status: count for status, count in self.status_counts.items() if count},
+            'new_patient_appointments': self.visit_type_counts['new'],
+            'returning_patient_appointments': self.visit_type_counts['returning']
+        }
+
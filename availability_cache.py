@@ -0,0 +1,85 @@
+from collections import defaultdict
+from datetime import datetime
+
+from config import RETURNING_PATIENT_DURATION
+from database import db
+
+
+def _day(date):
+    """'YYYY-MM-DD' from a date string or timestamp"""
+    return str(date)[:10]
+
+
+class AvailabilityVersions:
+    def __init__(self, database):
+        """Count changes per (doctor, date) from the database's events"""
+        self.database = database
+        # (doctor, date) -> number of changes seen; a cached lookup is current while its number is unchanged
+        self.versions = defaultdict(int)
+        # Bumped by changes that touch every day, such as archiving or extending the schedule
+        self.generation = 0
+        database.subscribe(self.on_event)
+
+    def current(self, doctor_name, date):
+        """Version of a doctor's day"""
+        return self.generation, self.versions.get((doctor_name, date), 0)
+
+    def _bump(self, doctor_name, date):
+        """Record a change to a doctor's day"""
+        self.versions[(doctor_name, _day(date))] += 1
+
+    def on_event(self, event, payload):
+        """Bump the days a database mutation can have opened or closed slots on"""
+        if event in ('appointment_created', 'appointment_confirmed', 'appointment_cancelled'):
+            self._bump(payload['doctor_name'], payload['appointment_date'])
+        elif event == 'appointment_rescheduled':
+            self._bump(payload['appointment']['doctor_name'], payload['appointment']['appointment_date'])
+            self._bump(payload['previous']['doctor_name'], payload['previous']['appointment_date'])
+        elif event == 'appointments_expired':
+            appointments = self.database.appointments_df
+            expired = appointments[appointments['appointment_id'].isin(payload['appointment_ids'])]
+            for doctor_name, date in zip(expired['doctor_name'], expired['appointment_date']):
+                self._bump(doctor_name, date)
+        elif event == 'schedule_exception_added':
+            self._bump(payload['doctor_name'], payload['date'])
+        elif event in ('schedule_extended', 'schedule_archived'):
+            self.generation += 1
+
+
+class AvailabilityCache:
+    def __init__(self, database=db, versions=None):
+        """Availability lookups memoized for one conversation"""
+        self.database = database
+        self.versions = versions or availability_versions
+        # (doctor, date, duration) -> (version when computed, first hold lapse that day or None, slots)
+        self._slots = {}
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def get_available_slots(self, doctor_name, date, duration=RETURNING_PATIENT_DURATION):
+        """Start times where a visit fits, recomputed only when the day changed since the last lookup"""
+        if self.database.in_transaction:
+            # Uncommitted changes emit no events until commit, and a rollback none at all: neither trust nor keep
+            # a lookup made now
+            self.stats['misses'] += 1
+            return self.database.get_available_slots(doctor_name, date, duration)
+
+        key = (doctor_name, date, duration)
+        version = self.versions.current(doctor_name, date)
+        cached = self._slots.get(key)
+        if cached is not None and cached[0] == version and (cached[1] is None or datetime.now() < cached[1]):
+            self.stats['hits'] += 1
+            return list(cached[2])
+
+        self.stats['misses'] += 1
+        slots = self.database.get_available_slots(doctor_name, date, duration)
+        # A lapsing hold reopens its slots before any sweep emits an event, so the lookup is only good until then
+        self._slots[key] = (version, self.database.slot_holds.next_expiry(doctor_name, date), slots)
+        return list(slots)
+
+    def clear(self):
+        """Forget every memoized lookup"""
+        self._slots.clear()
+
+
+# Global availability versions instance
+availability_versions = AvailabilityVersions(db)
@@ -0,0 +1,138 @@
+import sys
+import time
+from datetime import datetime, timedelta
+
+from config import DOCTORS, EQUIVALENT_SPECIALTIES
+from communication import comm_manager
+from database import db
+
+
+def _date_range(start_date, end_date):
+    """Every 'YYYY-MM-DD' date from start_date to end_date inclusive"""
+    current = datetime.strptime(start_date, '%Y-%m-%d')
+    last = datetime.strptime(end_date, '%Y-%m-%d')
+    while current <= last:
+        yield current.strftime('%Y-%m-%d')
+        current += timedelta(days=1)
+
+
+class BatchRescheduler:
+    def __init__(self, database, search_days=30):
+        """Initialize the bulk rescheduler for a database"""
+        self.database = database
+        self.search_days = search_days
+
+    def candidate_doctors(self, doctor_name):
+        """The doctor followed by every doctor of the same or an equivalent specialty"""
+        specialty = DOCTORS.get(doctor_name, {}).get('specialty')
+        specialties = {specialty, *EQUIVALENT_SPECIALTIES.get(specialty, [])}
+        return [doctor_name] + [
+            name for name, info in DOCTORS.items() if name != doctor_name and info['specialty'] in specialties
+        ]
+
+    def affected_appointments(self, doctor_name, start_date, end_date):
+        """Confirmed and pending appointments of a doctor between two dates, earliest first"""
+        appointments = self.database.appointments_df
+        dates = appointments['appointment_date'].astype(str).str[:10]
+        mask = (appointments['doctor_name'] == doctor_name) & (dates >= start_date) & (dates <= end_date) & \
+               appointments['status'].isin(['confirmed', 'pending'])
+        affected = appointments[mask].assign(appointment_date=dates[mask])
+        return affected.sort_values(['appointment_date', 'appointment_time'])
+
+    def _earliest_slot(self, candidates, duration, search_from):
+        """Earliest (date, time, doctor) among the candidates where the visit fits"""
+        start_date = search_from.strftime('%Y-%m-%d')
+        end_date = (search_from + timedelta(days=self.search_days - 1)).strftime('%Y-%m-%d')
+
+        # One vectorized pass over the bitmaps answers most candidates
+        fits = self.database.schedule_index.first_fit(duration, candidates, start_date, end_date)
+        options = []
+        for rank, doctor_name in enumerate(candidates):
+            fit = fits[doctor_name]
+            if fit and self.database.slot_fits(doctor_name, fit['date'], fit['time_slot'], duration):
+                options.append((fit['date'], fit['time_slot'], rank, doctor_name))
+                continue
+            # Held by a pending appointment, or only free past the materialized days
+            date, slots = self.database.find_earliest_slots(doctor_name, duration, days=self.search_days,
+                                                            start_date=search_from)
+            if date:
+                options.append((date, slots[0]['time_slot'], rank, doctor_name))
+
+        if not options:
+            return None
+        date, time_slot, _, doctor_name = min(options)
+        return doctor_name, date, time_slot
+
+    def run(self, doctor_name, start_date, end_date, reason=None, notify=True):
+        """Close a doctor's days and greedily move each affected appointment to the earliest fitting slot"""
+        started = time.perf_counter()
+        affected = self.affected_appointments(doctor_name, start_date, end_date)
+        candidates = self.candidate_doctors(doctor_name)
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+        moved = []
+        unplaced = []
+        with self.database.transaction():
+            for date in _date_range(start_date, end_date):
+                self.database.add_schedule_exception(doctor_name, date, 'closed')
+
+            # Pending holds on the closed days cannot be confirmed any more; their patients are asked to call like the
+            # unplaced ones
+            pending = affected[affected['status'] == 'pending']
+            expired_count, _ = self.database.expire_appointments(pending['appointment_id'].tolist())
+            expired = pending.to_dict('records') if expired_count else []
+
+            # Earliest appointments choose first, and each booking is visible to the next search
+            for appointment in affected[affected['status'] == 'confirmed'].to_dict('records'):
+                search_from = max(datetime.strptime(appointment['appointment_date'], '%Y-%m-%d'), today)
+                slot = self._earliest_slot(candidates, int(appointment['duration']), search_from)
+                if slot and self.database.move_appointment(appointment['appointment_id'], *slot):
+                    moved.append((appointment, slot))
+                else:
+                    unplaced.append(appointment)
+
+        # Patients hear about the moves only once they are committed; those left without a slot are asked to call
+        emails_sent, sms_sent = 0, 0
+        if notify and (moved or unplaced or expired):
+            notices = []
+            for appointment, (new_doctor, new_date, new_time) in moved:
+                patient = self.database.get_patient(appointment['patient_id'])
+                if patient:
+                    appointment_data = dict(appointment, doctor_name=new_doctor, appointment_date=new_date,
+                                            appointment_time=new_time)
+                    notices.append((appointment_data, patient, appointment))
+            unplaced_notices = []
+            for appointment in unplaced + expired:
+                patient = self.database.get_patient(appointment['patient_id'])
+                if patient:
+                    unplaced_notices.append((appointment, patient))
+            emails_sent, sms_sent = comm_manager.send_reschedule_notices(notices, reason, unplaced_notices)
+
+        metrics = {
+            'doctor_name': doctor_name,
+            'start_date': start_date,
+            'end_date': end_date,
+            'moved': [
+                {'appointment_id': appointment['appointment_id'], 'doctor_name': new_doctor,
+                 'appointment_date': new_date, 'appointment_time': new_time}
+                for appointment, (new_doctor, new_date, new_time) in moved
+            ],
+            'unplaced': [appointment['appointment_id'] for appointment in unplaced],
+            'expired_pending': expired_count,
+            'emails_sent': emails_sent,
+            'sms_sent': sms_sent,
+            'duration_seconds': round(time.perf_counter() - started, 3)
+        }
+        print(f"Batch reschedule for {doctor_name} {start_date}..{end_date}: moved {len(moved)}, "
+              f"unplaced {len(unplaced)}, expired {expired_count} pending")
+        return metrics
+
+
+# Global batch rescheduler instance
+batch_rescheduler = BatchRescheduler(db)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Usage: python batch_rescheduler.py \"Dr. Name\" START_DATE END_DATE [reason]")
+        sys.exit(1)
+    print(batch_rescheduler.run(sys.argv[1], sys.argv[2], sys.argv[3], reason=" ".join(sys.argv[4:]) or None))
@@ -0,0 +1,375 @@
+import asyncio
+import contextlib
+import io
+import json
+import re
+import sys
+import time
+
+from nlu import extract_patient_info, parse_date
+
+SAMPLE_MESSAGES = [
+    "my name is john smith, born 01/15/1990, phone 555-123-4567, email john.smith@email.com",
+    "i'm maria garcia 3/7/1985 5559876543 maria.garcia@example.org",
+    "jane doe",
+    "my phone is 555.222.3333 and my email is jane@doe.com",
+    "i am robert brown and i was born on 12-31-1975",
+    "can i come in on 2030-01-07 please",
+    "i would like to schedule for 02/14/30",
+    "yes that's me",
+]
+
+
+def _legacy_patient_info(text):
+    """The per-message extraction the agents did before the nlu module, for comparison"""
+    name_pattern = r"my name is (\w+) (\w+)|i'm (\w+) (\w+)|i am (\w+) (\w+)|^(\w+) (\w+)"
+    dob_pattern = r"(\d{1,2})[/-](\d{1,2})[/-](\d{4})"
+    phone_pattern = r"(\d{10})|(\d{3})[-.]?(\d{3})[-.]?(\d{4})"
+    email_pattern = r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"
+    return (re.search(name_pattern, text), re.search(dob_pattern, text),
+            re.search(phone_pattern, text), re.search(email_pattern, text))
+
+
+def _messages_per_second(extract, messages, rounds):
+    """Messages handled per second by one extraction function on one core"""
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for message in messages:
+            extract(message)
+    return rounds * len(messages) / (time.perf_counter() - started)
+
+
+def bench_nlu(rounds=20000):
+    """Messages per second per core for patient-detail and date extraction"""
+    return {
+        'legacy_patient_info': round(_messages_per_second(_legacy_patient_info, SAMPLE_MESSAGES, rounds)),
+        'patient_info': round(_messages_per_second(extract_patient_info, SAMPLE_MESSAGES, rounds)),
+        'parse_date': round(_messages_per_second(parse_date, SAMPLE_MESSAGES, rounds)),
+    }
+
+
+def bench_agent_patient_info(rounds=5000):
+    """Messages per second per core through SimpleMedicalAgent's patient-details step"""
+    from simple_agent import SimpleMedicalAgent
+
+    agent = SimpleMedicalAgent()
+    # Details without an email keep the agent asking, so no database lookups are timed
+    message = "My name is John Smith, born 01/15/1990, phone 555-123-4567"
+    started = time.perf_counter()
+    for _ in range(rounds):
+        agent.conversation_state["step"] = "collecting_patient_info"
+        agent.conversation_state["patient_info"] = {}
+        agent.process_message(message)
+    return {'messages_per_second': round(rounds / (time.perf_counter() - started))}
+
+
+def _linear_workflow(nodes):
+    """The original workflow: every turn walks greeting -> ... -> confirmation"""
+    from langgraph.graph import StateGraph, END
+    from ai_agent import AgentState
+
+    graph = StateGraph(AgentState)
+    names = list(nodes)
+    for name, node in nodes.items():
+        graph.add_node(name, node)
+    for name, next_name in zip(names, names[1:]):
+        graph.add_edge(name, next_name)
+    graph.add_edge(names[-1], END)
+    graph.set_entry_point(names[0])
+    return graph.compile()
+
+
+def bench_agent_workflow(rounds=300):
+    """Per-turn latency and node executions of the step-routed workflow against the linear chain"""
+    from langchain.schema import HumanMessage
+    from ai_agent import AgentState, WORKFLOW_NODES, create_workflow
+
+    executed = []
+
+    def counted(name, node):
+        def run(state):
+            executed.append(name)
+            return node(state)
+        return run
+
+    nodes = {name: counted(name, node) for name, node in WORKFLOW_NODES.items()}
+    turns = [
+        ("collecting_patient_info", "my name is john smith"),
+        ("select_doctor", "dr. johnson please"),
+    ]
+
+    results = {}
+    for label, workflow in (('linear', _linear_workflow(nodes)), ('routed', create_workflow(nodes))):
+        executed.clear()
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for step, message in turns:
+                workflow.invoke(AgentState(current_step=step, messages=[HumanMessage(content=message)]))
+        elapsed = time.perf_counter() - started
+        results[label] = {
+            'ms_per_turn': round(elapsed * 1000 / (rounds * len(turns)), 3),
+            'nodes_per_turn': round(len(executed) / (rounds * len(turns)), 2)
+        }
+    return results
+
+
+def bench_tool_calls(rounds=20000):
+    """Calls per second of a node-side tool call, typed in process against the JSON round trip"""
+    from agent_tools import SlotsResult, SlotQuery, json_tool
+
+    # A stand-in tool so the database lookup does not dominate the timing
+    def get_slots(query):
+        return SlotsResult(slots=[{'time_slot': '09:00', 'location': 'Main Campus'}] * 8)
+
+    json_get_slots = json_tool(get_slots, SlotQuery)
+
+    def typed_call():
+        return get_slots(SlotQuery(doctor_name='Dr. Sarah Johnson', date='2030-01-07', duration=30)).slots
+
+    def json_call():
+        arguments = json.dumps({'doctor_name': 'Dr. Sarah Johnson', 'date': '2030-01-07', 'duration': 30})
+        return json.loads(json_get_slots(arguments))['slots']
+
+    results = {}
+    for label, call in (('json', json_call), ('typed', typed_call)):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            call()
+        results[label] = round(rounds / (time.perf_counter() - started))
+    return results
+
+
+def bench_llm_cache(rounds=200, latency=0.005):
+    """Milliseconds per LLM call for a repeated prompt, uncached against cached, with a simulated model latency"""
+    from llm_cache import LLMResponseCache, CachedChatModel, FakeChatModel
+
+    prompts = ["Hello!", "hello", "Which doctors do you have?", "which doctors do you have", "What are your hours?"]
+    model = FakeChatModel(latency=latency)
+    cached = CachedChatModel(model, LLMResponseCache(db_path=None))
+
+    results = {}
+    for label, chat in (('uncached', model), ('cached', cached)):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for prompt in prompts:
+                chat.invoke(prompt)
+        results[label] = round((time.perf_counter() - started) * 1000 / (rounds * len(prompts)), 4)
+    results['hit_rate'] = cached.cache.get_metrics()['hit_rate']
+    return results
+
+
+def _confirmation_agents(count):
+    """Agents whose next message triggers the post-booking email, SMS and intake form"""
+    from ai_agent import AgentState, MedicalSchedulingAgent
+
+    agents = []
+    for number in range(count):
+        agent = MedicalSchedulingAgent()
+        agent.load_state(AgentState(
+            current_step="confirmation",
+            confirmation_sent=True,
+            patient_info={'first_name': 'Load', 'last_name': f'Test{number}', 'phone': '+1-555-000-0000',
+                          'email': f'load{number}@example.com'},
+            appointment_info={'doctor_name': 'Dr. Sarah Johnson', 'appointment_date': '2030-01-07',
+                              'appointment_time': '09:00', 'duration': 30}
+        ))
+        agents.append(agent)
+    return agents
+
+
+def bench_async_agent(conversations=200, sync_conversations=20, latency=0.02):
+    """Conversations per second finishing their post-booking notifications, sync one by one against async on one loop"""
+    from replay import stand_in_messaging
+
+    async def run_concurrently(agents):
+        return await asyncio.gather(*(agent.aprocess_message("thanks") for agent in agents))
+
+    results = {}
+    with stand_in_messaging(latency):
+        with contextlib.redirect_stdout(io.StringIO()):
+            agents = _confirmation_agents(sync_conversations)
+            started = time.perf_counter()
+            for agent in agents:
+                agent.process_message("thanks")
+            results['sync'] = round(sync_conversations / (time.perf_counter() - started), 1)
+
+            agents = _confirmation_agents(conversations)
+            started = time.perf_counter()
+            asyncio.run(run_concurrently(agents))
+            results['async'] = round(conversations / (time.perf_counter() - started), 1)
+        results['all_sent'] = all(agent.get_state().intake_form_sent for agent in agents)
+    return results
+
+
+def _time_to_first_chunk(respond):
+    """Seconds until respond() yields its first chunk, and until the response is complete"""
+    started = time.perf_counter()
+    first = None
+    for _ in respond():
+        if first is None:
+            first = time.perf_counter() - started
+    return first, time.perf_counter() - started
+
+
+def _booking_turn_agents():
+    """One agent of each kind whose next message books an appointment"""
+    from simple_agent import SimpleMedicalAgent
+    from ai_agent import AgentState, MedicalSchedulingAgent
+
+    patient_info = {'patient_id': 'P0001', 'first_name': 'Load', 'last_name': 'Test', 'phone': '+1-555-000-0000',
+                    'email': 'load@example.com'}
+    appointment_info = {'doctor_name': 'Dr. Sarah Johnson', 'appointment_date': '2030-01-07',
+                        'appointment_time': '09:00', 'duration': 30, 'location': 'Main Campus'}
+    insurance_info = {'insurance_carrier': 'aetna', 'member_id': 'm1'}
+
+    simple_agent = SimpleMedicalAgent()
+    simple_agent.load_state({'step': 'collect_insurance', 'patient_info': dict(patient_info),
+                             'appointment_info': dict(appointment_info), 'available_slots': [],
+                             'insurance_info': dict(insurance_info)})
+    ai_agent = MedicalSchedulingAgent()
+    ai_agent.load_state(AgentState(current_step='collect_insurance', patient_info=dict(patient_info),
+                                   appointment_info=dict(appointment_info), insurance_info=dict(insurance_info)))
+    return {'simple_agent': simple_agent, 'ai_agent': ai_agent}
+
+
+def bench_streaming(rounds=10, latency=0.2):
+    """Milliseconds to the first chunk and to the whole response, whole-string replies against streamed ones"""
+    from database import db
+    from llm_cache import LLMResponseCache, CachedChatModel, FakeChatModel
+    from replay import stand_in_messaging
+
+    # A stand-in for the booking write, at the latency of saving the appointment files, so no data is touched
+    original_book = db.book_appointment
+    db.book_appointment = lambda appointment_data: time.sleep(latency) or "A9999"
+
+    def ms(seconds):
+        return round(seconds * 1000 / rounds, 1)
+
+    results = {}
+    try:
+        # The booking turn sends its confirmation too; keep that off the network
+        with stand_in_messaging(0), contextlib.redirect_stdout(io.StringIO()):
+            for label in ('simple_agent', 'ai_agent'):
+                whole = streamed = first = 0.0
+                for _ in range(rounds):
+                    agent = _booking_turn_agents()[label]
+                    whole += _time_to_first_chunk(lambda: [agent.process_message("g1")])[1]
+                    agent = _booking_turn_agents()[label]
+                    first_chunk, total = _time_to_first_chunk(lambda: agent.process_message_stream("g1"))
+                    first += first_chunk
+                    streamed += total
+                results[label] = {'whole_ms': ms(whole), 'first_chunk_ms': ms(first), 'streamed_total_ms': ms(streamed)}
+    finally:
+        db.book_appointment = original_book
+
+    # LLM tokens: a model taking 50 ms to start and 20 ms a word
+    model = CachedChatModel(FakeChatModel(latency=0.05, token_latency=0.02), LLMResponseCache(db_path=None))
+    whole = first = 0.0
+    for number in range(rounds):
+        whole += _time_to_first_chunk(lambda: [model.invoke(f"prompt {number}")])[1]
+        first += _time_to_first_chunk(lambda: model.stream(f"streamed prompt {number}"))[0]
+    results['llm'] = {'whole_ms': ms(whole), 'first_chunk_ms': ms(first)}
+    return results
+
+
+def bench_conversation_memory(lengths=(10, 100, 1000), rounds=200):
+    """Prompt tokens and microseconds per prompt build at several conversation lengths, full history against memory"""
+    from langchain.schema import HumanMessage, AIMessage, SystemMessage
+    from conversation_memory import window, slot_summary, build_prompt, estimate_tokens
+
+    system_prompt = "You are the scheduling assistant of HealthFirst Medical Center."
+    summary = slot_summary({'first_name': 'John', 'last_name': 'Smith', 'email': 'john.smith@email.com'},
+                           {'doctor_name': 'Dr. Sarah Johnson', 'appointment_date': '2030-01-07'})
+
+    results = {}
+    for length in lengths:
+        messages = []
+        for turn in range(length):
+            messages.append(HumanMessage(content=f"Could I see Dr. Johnson on 01/{turn % 28 + 1:02d}/2030 please?"))
+            messages.append(AIMessage(content="Here are the available slots: " + ", ".join(["09:00", "09:30", "10:00"] * 5)))
+
+        def full_history():
+            return [SystemMessage(content=system_prompt)] + messages
+
+        windowed = window(list(messages))
+
+        def with_memory():
+            return build_prompt(system_prompt, summary, windowed)
+
+        row = {}
+        for label, build in (('full', full_history), ('memory', with_memory)):
+            started = time.perf_counter()
+            for _ in range(rounds):
+                prompt = build()
+            row[f'{label}_tokens'] = sum(estimate_tokens(message.content) for message in prompt)
+            row[f'{label}_us'] = round((time.perf_counter() - started) * 1e6 / rounds, 1)
+        results[length] = row
+    return results
+
+
+def bench_availability_cache(rounds=2000):
+    """Microseconds per repeated availability lookup for one doctor and day, database against the session cache"""
+    from datetime import datetime, timedelta
+    from database import db
+    from availability_cache import AvailabilityCache
+
+    doctor_name = 'Dr. Sarah Johnson'
+    date = (datetime.now() + timedelta(days=1)).strftime('%Y-%m-%d')
+    cache = AvailabilityCache()
+
+    results = {}
+    for label, lookup in (('database', db.get_available_slots), ('cached', cache.get_available_slots)):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            lookup(doctor_name, date, 30)
+        results[label] = round((time.perf_counter() - started) * 1e6 / rounds, 2)
+    results['hits'] = cache.stats['hits']
+    return results
+
+
+def bench_intent_classifier(conversations=20, rounds=2000):
+    """Microseconds to classify a message, and the share of replayed booking turns served without the LLM"""
+    from intent_classifier import intent_router
+    from replay import stand_in_messaging, synthetic_conversations, _new_agent
+
+    started = time.perf_counter()
+    for _ in range(rounds // len(SAMPLE_MESSAGES) + 1):
+        for message in SAMPLE_MESSAGES:
+            intent_router.classifier.predict(message)
+    classify_us = (time.perf_counter() - started) * 1e6 / ((rounds // len(SAMPLE_MESSAGES) + 1) * len(SAMPLE_MESSAGES))
+
+    intent_router.reset_metrics()
+    with stand_in_messaging(0), contextlib.redirect_stdout(io.StringIO()):
+        for conversation in synthetic_conversations(conversations):
+            if conversation['agent'] == 'ai':
+                agent = _new_agent('ai')
+                for message in conversation['turns']:
+                    agent.process_message(message)
+    metrics = intent_router.get_metrics()
+    return {'classify_us': round(classify_us, 1), 'turns': metrics['turns'], 'local_fraction': metrics['local_fraction'],
+            'escalated': metrics['escalated'], 'latency_saved_ms': metrics['latency_saved_ms']}
+
+
+BENCHMARKS = {
+    'nlu': bench_nlu,
+    'agent_patient_info': bench_agent_patient_info,
+    'agent_workflow': bench_agent_workflow,
+    'tool_calls': bench_tool_calls,
+    'llm_cache': bench_llm_cache,
+    'async_agent': bench_async_agent,
+    'streaming': bench_streaming,
+    'conversation_memory': bench_conversation_memory,
+    'availability_cache': bench_availability_cache,
+    'intent_classifier': bench_intent_classifier,
+}
+
+
+def main():
+    """Run the benchmarks named on the command line, or all of them"""
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"{name}: {BENCHMARKS[name]()}")
+
+
+if __name__ == "__main__":
+    main()
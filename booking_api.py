@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import contextlib
+import weakref
+from datetime import datetime
+
+from aiohttp import web
+
+from config import API_HOST, API_PORT, API_KEEPALIVE_SECONDS, DOCTORS, RETURNING_PATIENT_DURATION
+from database import db
+from nlu import doctor_resolver
+from ai_agent import MedicalSchedulingAgent, sessions
+from agent_tools import AppointmentRequest, SlotQuery, get_available_slots, book_appointment
+
+
+def _error(status, message, **details):
+    """JSON error response"""
+    return web.json_response({'error': message, **details}, status=status)
+
+
+async def _json_body(request):
+    """Request body as a dict, or None when it is not a JSON object"""
+    try:
+        body = await request.json()
+    except Exception:
+        return None
+    return body if isinstance(body, dict) else None
+
+
+def _doctor(name):
+    """Full doctor name for a name or part of one, and the candidates when it is ambiguous"""
+    if name in DOCTORS:
+        return name, []
+    return doctor_resolver.match(name)
+
+
+def _session_lock(request, session_id):
+    """Lock serializing the turns of one session; held only while some request uses it"""
+    locks = request.app['session_locks']
+    lock = locks.get(session_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        locks[session_id] = lock
+    return lock
+
+
+async def health(request):
+    """Liveness check with the number of chat sessions in memory"""
+    return web.json_response({'status': 'ok', 'sessions': len(sessions)})
+
+
+async def post_message(request):
+    """Run one turn of a session's booking conversation"""
+    session_id = request.match_info['session_id']
+    body = await _json_body(request)
+    if body is None or not isinstance(body.get('message'), str) or not body['message'].strip():
+        return _error(400, "Body must be a JSON object with a non-empty 'message'")
+
+    # Turns of one conversation must not interleave; other sessions carry on meanwhile
+    lock = _session_lock(request, session_id)
+    async with lock:
+        agent = MedicalSchedulingAgent(session_id=session_id)
+        response = await agent.aprocess_message(body['message'])
+        state = agent.get_state()
+
+    return web.json_response({
+        'session_id': session_id,
+        'response': response,
+        'step': state.current_step,
+        'appointment_id': state.appointment_info.get('appointment_id')
+    })
+
+
+async def delete_session(request):
+    """Forget a session's conversation"""
+    sessions.drop(request.match_info['session_id'])
+    return web.Response(status=204)
+
+
+async def get_slots(request):
+    """Open start times for a doctor on a date, or on the earliest date with room when no date is given"""
+    doctor_name, candidates = _doctor(request.query.get('doctor', ''))
+    if doctor_name is None:
+        return _error(404, "Unknown or ambiguous doctor", candidates=candidates)
+    try:
+        duration = int(request.query.get('duration', RETURNING_PATIENT_DURATION))
+    except ValueError:
+        return _error(400, "duration must be a number of minutes")
+
+    date = request.query.get('date')
+    if date is None:
+        date, slots = db.find_earliest_slots(doctor_name, duration)
+        return web.json_response({'doctor_name': doctor_name, 'date': date, 'duration': duration, 'slots': slots or []})
+
+    try:
+        datetime.strptime(date, '%Y-%m-%d')
+    except ValueError:
+        return _error(400, "date must be YYYY-MM-DD")
+    result = get_available_slots(SlotQuery(doctor_name=doctor_name, date=date, duration=duration))
+    if result.error:
+        return _error(500, result.error)
+    return web.json_response({'doctor_name': doctor_name, 'date': date, 'duration': duration, 'slots': result.slots})
+
+
+async def post_appointment(request):
+    """Book a slot for a registered patient; 409 when someone else got it first"""
+    body = await _json_body(request)
+    required = ('patient_id', 'doctor_name', 'appointment_date', 'appointment_time')
+    if body is None or any(not body.get(key) for key in required):
+        return _error(400, "Body must be a JSON object with " + ", ".join(required))
+
+    doctor_name, candidates = _doctor(body['doctor_name'])
+    if doctor_name is None:
+        return _error(404, "Unknown or ambiguous doctor", candidates=candidates)
+    if db.get_patient(body['patient_id']) is None:
+        return _error(404, f"Unknown patient {body['patient_id']}")
+    try:
+        datetime.strptime(body['appointment_date'], '%Y-%m-%d')
+        datetime.strptime(body['appointment_time'], '%H:%M')
+        duration = int(body.get('duration', RETURNING_PATIENT_DURATION))
+    except (TypeError, ValueError):
+        return _error(400, "appointment_date must be YYYY-MM-DD, appointment_time HH:MM and duration a number of minutes")
+
+    result = book_appointment(AppointmentRequest(
+        patient_id=body['patient_id'],
+        doctor_name=doctor_name,
+        appointment_date=body['appointment_date'],
+        appointment_time=body['appointment_time'],
+        duration=duration,
+        insurance_carrier=body.get('insurance_carrier', ''),
+        member_id=body.get('member_id', ''),
+        group_number=body.get('group_number', '')
+    ))
+    if result.slot_taken:
+        return _error(409, result.error)
+    if not result.success:
+        return _error(500, result.error or "Booking failed")
+    return web.json_response({'appointment_id': result.appointment_id, 'doctor_name': doctor_name,
+                              'appointment_date': body['appointment_date'],
+                              'appointment_time': body['appointment_time'], 'duration': duration}, status=201)
+
+
+async def delete_appointment(request):
+    """Cancel an appointment and free its slots"""
+    appointment_id = request.match_info['appointment_id']
+    appointments = db.appointments_df[db.appointments_df['appointment_id'] == appointment_id]
+    if appointments.empty:
+        return _error(404, f"Unknown appointment {appointment_id}")
+    if appointments.iloc[0]['status'] == 'cancelled':
+        return _error(409, f"Appointment {appointment_id} is already cancelled")
+    if not db.cancel_appointment(appointment_id):
+        return _error(500, f"Could not cancel appointment {appointment_id}")
+    return web.json_response({'appointment_id': appointment_id, 'status': 'cancelled'})
+
+
+def create_app():
+    """The booking API application"""
+    app = web.Application()
+    # session id -> asyncio.Lock; an entry disappears once no request holds its lock
+    app['session_locks'] = weakref.WeakValueDictionary()
+    app.add_routes([
+        web.get('/health', health),
+        web.post('/sessions/{session_id}/messages', post_message),
+        web.delete('/sessions/{session_id}', delete_session),
+        web.get('/slots', get_slots),
+        web.post('/appointments', post_appointment),
+        web.delete('/appointments/{appointment_id}', delete_appointment),
+    ])
+    return app
+
+
+def main():
+    """Serve the booking API"""
+    parser = argparse.ArgumentParser(description="HTTP API for booking conversations and direct scheduling")
+    parser.add_argument('--host', default=API_HOST)
+    parser.add_argument('--port', type=int, default=API_PORT)
+    parser.add_argument('--keepalive', type=float, default=API_KEEPALIVE_SECONDS,
+                        help="seconds an idle keep-alive connection stays open")
+    parser.add_argument('--stand-in-messaging-ms', type=float,
+                        help="answer email and SMS with local stand-ins taking this long, e.g. for load tests")
+    args = parser.parse_args()
+
+    messaging = contextlib.nullcontext()
+    if args.stand_in_messaging_ms is not None:
+        from replay import stand_in_messaging
+        messaging = stand_in_messaging(args.stand_in_messaging_ms / 1000)
+
+    # One process on purpose: the database and chat sessions live in its memory, so a second worker process would
+    # book against its own copy of the schedule. Concurrency comes from the event loop and the notification threads.
+    with messaging:
+        web.run_app(create_app(), host=args.host, port=args.port, keepalive_timeout=args.keepalive, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
+import asyncio
 import smtplib
+from concurrent.futures import ThreadPoolExecutor
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
@@ -10,7 +12,7 @@ from config import (
     EMAIL_HOST, EMAIL_PORT, EMAIL_USER, EMAIL_PASSWORD,
     TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_PHONE_NUMBER,
     CLINIC_NAME, CLINIC_ADDRESS, CLINIC_PHONE, CLINIC_EMAIL,
-    INTAKE_FORM_PATH
+    INTAKE_FORM_PATH, NOTIFICATION_WORKERS
 )
 
 class CommunicationManager:
@@ -23,6 +25,9 @@ class CommunicationManager:
         self.clinic_phone = CLINIC_PHONE
         self.clinic_email = CLINIC_EMAIL
         
+        # Blocking sends made by the async methods run here, so they never starve the event loop's default executor
+        self.executor = ThreadPoolExecutor(max_workers=NOTIFICATION_WORKERS, thread_name_prefix="notify")
+        
         # Initialize Twilio client for SMS
         try:
             self.twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
@@ -68,6 +73,40 @@ class CommunicationManager:
             print(f"Error sending email to {to_email}: {str(e)}")
             return False
     
+    async def _in_worker(self, function, *args):
+        """Await a blocking send on the notification threads"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+    
+    def send_emails(self, messages):
+        """Send many (to_email, subject, body) emails over one SMTP session; returns the number sent"""
+        if not messages:
+            return 0
+        
+        try:
+            server = smtplib.SMTP(EMAIL_HOST, EMAIL_PORT)
+            server.starttls()
+            server.login(self.email_user, self.email_password)
+        except Exception as e:
+            print(f"Error connecting to email server for {len(messages)} emails: {str(e)}")
+            return 0
+        
+        sent = 0
+        for to_email, subject, body in messages:
+            try:
+                msg = MIMEMultipart()
+                msg['From'] = self.email_user
+                msg['To'] = to_email
+                msg['Subject'] = subject
+                msg.attach(MIMEText(body, 'html'))
+                server.sendmail(self.email_user, to_email, msg.as_string())
+                sent += 1
+            except Exception as e:
+                print(f"Error sending email to {to_email}: {str(e)}")
+        
+        server.quit()
+        print(f"Batch email: {sent} of {len(messages)} sent")
+        return sent
+    
     def send_sms(self, to_phone, message):
         """Send SMS using Twilio"""
         if not self.twilio_client:
@@ -87,8 +126,17 @@ class CommunicationManager:
             print(f"Error sending SMS to {to_phone}: {str(e)}")
             return False
     
-    def send_appointment_confirmation(self, appointment_data, patient_data):
-        """Send appointment confirmation email and SMS"""
+    def send_sms_messages(self, messages):
+        """Send many (to_phone, message) texts at once on the notification threads; returns the number sent"""
+        if not messages:
+            return 0
+        
+        sent = sum(self.executor.map(lambda item: bool(self.send_sms(*item)), messages))
+        print(f"Batch SMS: {sent} of {len(messages)} sent")
+        return sent
+    
+    def confirmation_messages(self, appointment_data, patient_data):
+        """Subject, HTML body and SMS text of an appointment confirmation"""
         
         # Email confirmation
         subject = f"Appointment Confirmation - {self.clinic_name}"
@@ -143,8 +191,6 @@ class CommunicationManager:
         </html>
         """
         
-        email_sent = self.send_email(patient_data['email'], subject, body)
-        
         # SMS confirmation
         sms_message = f"""
         {self.clinic_name} - Appointment Confirmed
@@ -155,12 +201,26 @@ class CommunicationManager:
         Call {self.clinic_phone} for changes
         """
         
+        return subject, body, sms_message
+    
+    def send_appointment_confirmation(self, appointment_data, patient_data):
+        """Send appointment confirmation email and SMS"""
+        subject, body, sms_message = self.confirmation_messages(appointment_data, patient_data)
+        email_sent = self.send_email(patient_data['email'], subject, body)
         sms_sent = self.send_sms(patient_data['phone'], sms_message)
-        
         return email_sent, sms_sent
     
-    def send_intake_form(self, appointment_data, patient_data):
-        """Send intake form to patient"""
+    async def asend_appointment_confirmation(self, appointment_data, patient_data):
+        """Send appointment confirmation email and SMS concurrently"""
+        subject, body, sms_message = self.confirmation_messages(appointment_data, patient_data)
+        email_sent, sms_sent = await asyncio.gather(
+            self._in_worker(self.send_email, patient_data['email'], subject, body),
+            self._in_worker(self.send_sms, patient_data['phone'], sms_message)
+        )
+        return email_sent, sms_sent
+    
+    def intake_form_message(self, appointment_data, patient_data):
+        """Subject and HTML body of the intake form email"""
         
         subject = f"Pre-Appointment Forms - {self.clinic_name}"
         
@@ -193,8 +253,18 @@ class CommunicationManager:
         </html>
         """
         
+        return subject, body
+    
+    def send_intake_form(self, appointment_data, patient_data):
+        """Send intake form to patient"""
+        subject, body = self.intake_form_message(appointment_data, patient_data)
         return self.send_email(patient_data['email'], subject, body, INTAKE_FORM_PATH)
     
+    async def asend_intake_form(self, appointment_data, patient_data):
+        """Send intake form to patient without blocking the event loop"""
+        subject, body = self.intake_form_message(appointment_data, patient_data)
+        return await self._in_worker(self.send_email, patient_data['email'], subject, body, INTAKE_FORM_PATH)
+    
     def send_reminder(self, appointment_data, patient_data, reminder_number):
         """Send appointment reminder"""
         
@@ -391,5 +461,156 @@ class CommunicationManager:
         
         return email_sent, sms_sent
 
+    def send_waitlist_offer(self, appointment_data, patient_data, expires_at=None):
+        """Offer a freed slot to a waitlisted patient by email and SMS"""
+        
+        subject = f"An Earlier Appointment Is Available - {self.clinic_name}"
+        hold_until = expires_at.strftime('%I:%M %p on %B %d') if expires_at else "a limited time"
+        
+        body = f"""
+        <html>
+        <body>
+            <h2>Appointment Available</h2>
+            <p>Dear {patient_data['first_name']} {patient_data['last_name']},</p>
+            
+            <p>A slot matching your waitlist request has opened up, and we are holding it for you:</p>
+            
+            <table style="border-collapse: collapse; width: 100%;">
+                <tr>
+                    <td style="padding: 8px; border: 1px solid #ddd;"><strong>Doctor:</strong></td>
+                    <td style="padding: 8px; border: 1px solid #ddd;">{appointment_data['doctor_name']}</td>
+                </tr>
+                <tr>
+                    <td style="padding: 8px; border: 1px solid #ddd;"><strong>Date:</strong></td>
+                    <td style="padding: 8px; border: 1px solid #ddd;">{appointment_data['appointment_date']}</td>
+                </tr>
+                <tr>
+                    <td style="padding: 8px; border: 1px solid #ddd;"><strong>Time:</strong></td>
+                    <td style="padding: 8px; border: 1px solid #ddd;">{appointment_data['appointment_time']}</td>
+                </tr>
+            </table>
+            
+            <p>The slot is held until {hold_until}. To accept it, please call us at {self.clinic_phone} or reply to this email.</p>
+            
+            <p>Best regards,<br>
+            {self.clinic_name}<br>
+            {self.clinic_phone}<br>
+            {self.clinic_email}</p>
+        </body>
+        </html>
+        """
+        
+        email_sent = self.send_email(patient_data['email'], subject, body)
+        
+        sms_message = f"""
+        {self.clinic_name} - Waitlist Slot Available
+        Dr. {appointment_data['doctor_name']}
+        {appointment_data['appointment_date']} at {appointment_data['appointment_time']}
+        Held until {hold_until}. Call {self.clinic_phone} to accept
+        """
+        
+        sms_sent = self.send_sms(patient_data['phone'], sms_message)
+        
+        return email_sent, sms_sent
+
+    def send_reschedule_notices(self, notices, reason=None, unplaced=()):
+        """Tell patients their appointments moved, or to call in when no new time was found, in one batch per channel"""
+        # notices are (appointment_data, patient_data, previous) tuples, unplaced are (appointment_data, patient_data) pairs
+        
+        emails = []
+        texts = []
+        for appointment_data, patient_data, previous in notices:
+            subject = f"Appointment Rescheduled - {self.clinic_name}"
+            
+            body = f"""
+            <html>
+            <body>
+                <h2>Appointment Rescheduled</h2>
+                <p>Dear {patient_data['first_name']} {patient_data['last_name']},</p>
+                
+                <p>Your appointment with {previous['doctor_name']} on {previous['appointment_date']} at {previous['appointment_time']} has been moved:</p>
+                
+                <table style="border-collapse: collapse; width: 100%;">
+                    <tr>
+                        <td style="padding: 8px; border: 1px solid #ddd;"><strong>Doctor:</strong></td>
+                        <td style="padding: 8px; border: 1px solid #ddd;">{appointment_data['doctor_name']}</td>
+                    </tr>
+                    <tr>
+                        <td style="padding: 8px; border: 1px solid #ddd;"><strong>Date:</strong></td>
+                        <td style="padding: 8px; border: 1px solid #ddd;">{appointment_data['appointment_date']}</td>
+                    </tr>
+                    <tr>
+                        <td style="padding: 8px; border: 1px solid #ddd;"><strong>Time:</strong></td>
+                        <td style="padding: 8px; border: 1px solid #ddd;">{appointment_data['appointment_time']}</td>
+                    </tr>
+                </table>
+                """
+            
+            if reason:
+                body += f"<p><strong>Reason:</strong> {reason}</p>"
+            
+            body += f"""
+                <p>If the new time does not work for you, please call {self.clinic_phone} or reply to this email.</p>
+                
+                <p>We apologize for any inconvenience.</p>
+                
+                <p>Best regards,<br>
+                {self.clinic_name}<br>
+                {self.clinic_phone}<br>
+                {self.clinic_email}</p>
+            </body>
+            </html>
+            """
+            emails.append((patient_data['email'], subject, body))
+            
+            sms_message = f"""
+            {self.clinic_name} - Appointment Rescheduled
+            {appointment_data['doctor_name']}
+            {appointment_data['appointment_date']} at {appointment_data['appointment_time']}
+            Call {self.clinic_phone} if this does not work for you
+            """
+            texts.append((patient_data['phone'], sms_message))
+        
+        for appointment_data, patient_data in unplaced:
+            subject = f"Please Call Us to Reschedule - {self.clinic_name}"
+            
+            body = f"""
+            <html>
+            <body>
+                <h2>Appointment Needs Rescheduling</h2>
+                <p>Dear {patient_data['first_name']} {patient_data['last_name']},</p>
+                
+                <p>Your appointment with {appointment_data['doctor_name']} on {appointment_data['appointment_date']} at {appointment_data['appointment_time']} can no longer take place, and we could not find a new time for you.</p>
+                """
+            
+            if reason:
+                body += f"<p><strong>Reason:</strong> {reason}</p>"
+            
+            body += f"""
+                <p>Please call {self.clinic_phone} or reply to this email so we can book a time that works for you.</p>
+                
+                <p>We apologize for any inconvenience.</p>
+                
+                <p>Best regards,<br>
+                {self.clinic_name}<br>
+                {self.clinic_phone}<br>
+                {self.clinic_email}</p>
+            </body>
+            </html>
+            """
+            emails.append((patient_data['email'], subject, body))
+            
+            sms_message = f"""
+            {self.clinic_name} - Appointment Cannot Take Place
+            {appointment_data['appointment_date']} at {appointment_data['appointment_time']}
+            Call {self.clinic_phone} to reschedule
+            """
+            texts.append((patient_data['phone'], sms_message))
+        
+        emails_sent = self.send_emails(emails)
+        sms_sent = self.send_sms_messages(texts)
+        
+        return emails_sent, sms_sent
+
 # Global communication manager instance
 comm_manager = CommunicationManager()
@@ -23,6 +23,37 @@ WORKING_HOURS = {
 }
 BREAK_TIME = "12:00-13:00"  # Lunch break
 
+# Appointment Retention
+PENDING_HOLD_TTL_MINUTES = 60  # pending appointments without a completed intake form expire after this
+CANCELLED_RETENTION_DAYS = 30  # cancelled appointments move to the archive after this
+SCHEDULE_HORIZON_DAYS = 30  # days of schedule kept materialized ahead of today
+WAITLIST_OFFER_TTL_MINUTES = 120  # a slot offered to a waitlisted patient is held this long
+
+# Chat Sessions
+SESSION_MAX_SESSIONS = 1000  # conversations kept in memory before the least recently used are spilled
+SESSION_IDLE_TTL_MINUTES = 30  # conversations idle this long are forgotten
+SESSION_MAX_MEMORY_MB = 64  # memory cap for all conversation states together
+
+# Conversation Memory
+CONVERSATION_MAX_TURNS = 20  # exchanges kept word for word; older ones survive only in the slot summary
+PROMPT_TOKEN_BUDGET = 2000  # tokens an LLM prompt built from a conversation may use
+
+# Notifications
+NOTIFICATION_WORKERS = 64  # threads the async agent uses to wait on SMTP and Twilio
+
+# Intent Classifier
+INTENT_CONFIDENCE_THRESHOLD = 0.6  # turns classified less surely than this are ambiguous free text for the LLM
+LLM_ESTIMATED_LATENCY_MS = 800  # LLM turn time assumed when reporting the latency saved, until escalations are timed
+
+# Booking API
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8080"))
+API_KEEPALIVE_SECONDS = 75  # idle keep-alive connections are closed after this long
+
+# LLM Response Cache
+LLM_CACHE_MAX_ENTRIES = 512  # responses kept in memory; older ones stay on disk
+LLM_CACHE_TTL_MINUTES = 24 * 60  # cached responses older than this are asked again
+
 # Clinic Information
 CLINIC_NAME = "HealthFirst Medical Center"
 CLINIC_ADDRESS = "123 Medical Drive, Healthcare City, HC 12345"
@@ -53,12 +84,33 @@ DOCTORS = {
     }
 }
 
+# Everyday words patients use for each specialty, e.g. "heart doctor"
+SPECIALTY_ALIASES = {
+    "Cardiology": ["heart", "cardiac", "cardiologist", "cardio"],
+    "Orthopedics": ["bone", "bones", "joint", "joints", "orthopedic", "orthopedist", "ortho", "knee"],
+    "Pediatrics": ["child", "children", "kid", "kids", "pediatric", "pediatrician", "baby"],
+    "Neurology": ["brain", "nerve", "nerves", "neurologist", "neuro", "migraine", "headaches"]
+}
+
+# Specialties whose doctors can take each other's patients when rescheduling in bulk. None of the clinic's specialties
+# stand in for each other, so bulk rescheduling moves patients to other doctors of the same specialty only
+EQUIVALENT_SPECIALTIES = {
+    # "Cardiology": ["Internal Medicine"],
+}
+
 # File Paths
-DATA_DIR = "data"
+DATA_DIR = os.getenv("DATA_DIR", "data")  # set before the first import to run against another directory, e.g. a replay
 PATIENT_DB_FILE = os.path.join(DATA_DIR, "patients.csv")
 SCHEDULE_FILE = os.path.join(DATA_DIR, "doctor_schedules.xlsx")
 APPOINTMENTS_FILE = os.path.join(DATA_DIR, "appointments.xlsx")
+APPOINTMENTS_ARCHIVE_FILE = os.path.join(DATA_DIR, "appointments_archive.xlsx")
+WAITLIST_FILE = os.path.join(DATA_DIR, "waitlist.csv")
+SCHEDULE_ARCHIVE_FILE = os.path.join(DATA_DIR, "doctor_schedules_archive.xlsx")
+SCHEDULE_EXCEPTIONS_FILE = os.path.join(DATA_DIR, "schedule_exceptions.csv")  # vacations, blocked slots, extra clinics
+SESSION_SPILL_DIR = os.path.join(DATA_DIR, "sessions")  # conversations evicted from memory; None to drop them
+LLM_CACHE_FILE = os.path.join(DATA_DIR, "llm_cache.sqlite")  # on-disk tier of the LLM response cache; None for memory only
 INTAKE_FORM_PATH = "New Patient Intake Form.pdf"
+INTENT_MODEL_FILE = "intent_model.json"  # weights of the local intent classifier; python intent_classifier.py rebuilds it
 
 # Reminder Settings
 REMINDER_SCHEDULE = {
@@ -0,0 +1,63 @@
+from collections import deque
+
+from langchain.schema import SystemMessage
+
+from config import CONVERSATION_MAX_TURNS, PROMPT_TOKEN_BUDGET
+
+# Rough size of a token in English text; close enough to budget prompts without a tokenizer
+CHARS_PER_TOKEN = 4
+
+# Slots shown in the summary: heading, state field and the keys worth repeating to a model
+SUMMARY_SLOTS = [
+    ("Patient", "patient_info", ['first_name', 'last_name', 'date_of_birth', 'phone', 'email', 'patient_id']),
+    ("Appointment", "appointment_info", ['doctor_name', 'appointment_date', 'appointment_time', 'duration', 'location']),
+    ("Insurance", "insurance_info", ['insurance_carrier', 'member_id', 'group_number']),
+]
+
+
+def recent_turns(max_turns=CONVERSATION_MAX_TURNS):
+    """Ring buffer holding the messages of the last max_turns exchanges"""
+    return deque(maxlen=2 * max_turns)
+
+
+def window(messages, max_turns=CONVERSATION_MAX_TURNS):
+    """Drop all but the messages of the last max_turns exchanges from a list, in place"""
+    excess = len(messages) - 2 * max_turns
+    if excess > 0:
+        del messages[:excess]
+    return messages
+
+
+def estimate_tokens(text):
+    """Approximate number of tokens in a text"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def slot_summary(patient_info=None, appointment_info=None, insurance_info=None):
+    """The details collected so far as a few short lines, however long the conversation"""
+    slots = {'patient_info': patient_info or {}, 'appointment_info': appointment_info or {},
+             'insurance_info': insurance_info or {}}
+    lines = []
+    for heading, slot, keys in SUMMARY_SLOTS:
+        known = [f"{key.replace('_', ' ')}: {slots[slot][key]}" for key in keys if slots[slot].get(key)]
+        if known:
+            lines.append(f"{heading} - " + "; ".join(known))
+    return "\n".join(lines)
+
+
+def build_prompt(system_prompt, summary, messages, token_budget=PROMPT_TOKEN_BUDGET):
+    """System prompt with the slot summary, then as many of the latest messages as fit the token budget"""
+    content = system_prompt
+    if summary:
+        content += "\n\nWhat we know so far:\n" + summary
+    system = SystemMessage(content=content)
+
+    budget = token_budget - estimate_tokens(content)
+    kept = []
+    for message in reversed(messages):
+        cost = estimate_tokens(message.content)
+        if cost > budget:
+            break
+        kept.append(message)
+        budget -= cost
+    return [system] + kept[::-1]
@@ -3,7 +3,9 @@ import random
 import string
 from datetime import datetime, timedelta
 import os
-from config import DATA_DIR, PATIENT_DB_FILE, SCHEDULE_FILE, DOCTORS, INSURANCE_CARRIERS
+from config import DATA_DIR, PATIENT_DB_FILE, SCHEDULE_FILE, SCHEDULE_EXCEPTIONS_FILE, INSURANCE_CARRIERS
+from schedule_index import SCHEDULE_COLUMNS
+from schedule_templates import VirtualSchedule
 
 def generate_patient_data(num_patients=50):
     """Generate synthetic patient data"""
@@ -97,51 +99,20 @@ def generate_doctor_schedules():
     # Create directory if it doesn't exist
     os.makedirs(DATA_DIR, exist_ok=True)
     
-    schedules = []
-    
-    # Generate schedules for next 30 days
+    # Materialize the next 30 days from the doctors' weekly templates
+    schedule = VirtualSchedule()
+    schedule.load_exceptions(SCHEDULE_EXCEPTIONS_FILE)
     start_date = datetime.now()
     
+    schedules = []
     for day_offset in range(30):
-        current_date = start_date + timedelta(days=day_offset)
-        day_name = current_date.strftime('%A')
-        date_str = current_date.strftime('%Y-%m-%d')
-        
-        for doctor_name, doctor_info in DOCTORS.items():
-            if day_name in doctor_info['available_days']:
-                # Generate time slots (9 AM to 5 PM, excluding lunch break)
-                time_slots = []
-                
-                # Morning slots (9 AM to 12 PM)
-                for hour in range(9, 12):
-                    for minute in [0, 30]:
-                        time_slots.append(f"{hour:02d}:{minute:02d}")
-                
-                # Afternoon slots (1 PM to 5 PM)
-                for hour in range(13, 17):
-                    for minute in [0, 30]:
-                        time_slots.append(f"{hour:02d}:{minute:02d}")
-                
-                # Add some random unavailability (10% chance)
-                available_slots = []
-                for slot in time_slots:
-                    if random.random() > 0.1:  # 90% availability
-                        available_slots.append(slot)
-                
-                for slot in available_slots:
-                    schedule_entry = {
-                        'doctor_name': doctor_name,
-                        'specialty': doctor_info['specialty'],
-                        'location': doctor_info['location'],
-                        'date': date_str,
-                        'day_of_week': day_name,
-                        'time_slot': slot,
-                        'is_available': True,
-                        'appointment_id': None
-                    }
-                    schedules.append(schedule_entry)
+        date_str = (start_date + timedelta(days=day_offset)).strftime('%Y-%m-%d')
+        for schedule_entry in schedule.day_rows(date_str):
+            # Add some random unavailability (10% chance)
+            if random.random() > 0.1:  # 90% availability
+                schedules.append(schedule_entry)
     
-    return pd.DataFrame(schedules)
+    return pd.DataFrame(schedules, columns=SCHEDULE_COLUMNS)
 
 def create_sample_data():
     """Create all sample data files"""
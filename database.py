@@ -1,7 +1,15 @@
 import pandas as pd
+import copy
 import os
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from config import PATIENT_DB_FILE, SCHEDULE_FILE, APPOINTMENTS_FILE, DATA_DIR
+from config import (PATIENT_DB_FILE, SCHEDULE_FILE, APPOINTMENTS_FILE, APPOINTMENTS_ARCHIVE_FILE, DATA_DIR,
+                    SCHEDULE_ARCHIVE_FILE, SCHEDULE_EXCEPTIONS_FILE, NEW_PATIENT_DURATION, RETURNING_PATIENT_DURATION)
+from patient_search import PatientSearchIndex
+from slot_holds import SlotHoldManager
+from schedule_index import ScheduleIndex, covered_times
+from schedule_templates import VirtualSchedule
+from appointment_stats import AppointmentStats
 
 class MedicalDatabase:
     def __init__(self):
@@ -9,6 +17,21 @@ class MedicalDatabase:
         self.patients_file = PATIENT_DB_FILE
         self.schedules_file = SCHEDULE_FILE
         self.appointments_file = APPOINTMENTS_FILE
+        self.appointments_archive_file = APPOINTMENTS_ARCHIVE_FILE
+        self.schedule_archive_file = SCHEDULE_ARCHIVE_FILE
+        self.schedule_exceptions_file = SCHEDULE_EXCEPTIONS_FILE
+        
+        # Callbacks notified after every mutation, e.g. in-memory indexes
+        self._listeners = []
+        # Events held back while a transaction is open; None outside transactions
+        self._pending_events = None
+        
+        # Dashboard counters kept current from the mutation events
+        self.appointment_stats = AppointmentStats()
+        self.subscribe(self.appointment_stats.on_event)
+        
+        # Temporary reservations for pending appointments awaiting the intake form
+        self.slot_holds = SlotHoldManager()
         
         # Create data directory if it doesn't exist
         os.makedirs(DATA_DIR, exist_ok=True)
@@ -16,6 +39,27 @@ class MedicalDatabase:
         # Initialize dataframes
         self._load_data()
     
+    def subscribe(self, listener):
+        """Register a callback invoked as listener(event, payload) after each mutation"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+    
+    def unsubscribe(self, listener):
+        """Remove a previously registered mutation callback"""
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+    
+    def _emit(self, event, payload=None):
+        """Notify listeners of a mutation; a failing listener never breaks the write"""
+        if self._pending_events is not None:
+            self._pending_events.append((event, payload))
+            return
+        for listener in list(self._listeners):
+            try:
+                listener(event, payload or {})
+            except Exception as e:
+                print(f"Error in database listener for {event}: {str(e)}")
+    
     def _load_data(self):
         """Load data from files or create empty dataframes"""
         try:
@@ -37,13 +81,18 @@ class MedicalDatabase:
                 'understand_instructions', 'patient_signature', 'signature_date', 'created_date', 'is_new_patient'
             ])
         
+        # Schedules live in memory as one occupancy bitmap per doctor per day;
+        # the slot-per-row Excel file is only the on-disk and human view
+        self.schedule_index = ScheduleIndex()
         try:
-            self.schedules_df = pd.read_excel(self.schedules_file)
+            self.schedule_index.build(pd.read_excel(self.schedules_file))
         except FileNotFoundError:
-            self.schedules_df = pd.DataFrame(columns=[
-                'doctor_name', 'specialty', 'location', 'date', 'day_of_week',
-                'time_slot', 'is_available', 'appointment_id'
-            ])
+            pass
+        
+        # Days past the materialized file come from weekly templates plus exceptions
+        self.schedule_templates = VirtualSchedule()
+        self.schedule_templates.load_exceptions(self.schedule_exceptions_file)
+        self.schedule_index.virtual = self.schedule_templates
         
         try:
             self.appointments_df = pd.read_excel(self.appointments_file)
@@ -54,13 +103,124 @@ class MedicalDatabase:
                 'member_id', 'group_number', 'created_date', 'reminder_sent_1',
                 'reminder_sent_2', 'reminder_sent_3', 'intake_form_sent'
             ])
+        
+        self.appointment_stats.build(self.appointments_df)
+        
+        # Archived appointments keep their IDs, so new ones must be numbered past them too
+        try:
+            archived_ids = pd.read_excel(self.appointments_archive_file, usecols=['appointment_id'])['appointment_id']
+            self._archived_appointment_number = self._last_appointment_number(archived_ids)
+        except FileNotFoundError:
+            self._archived_appointment_number = 0
+        
+        # Search-as-you-type index over names, IDs, emails and phones
+        self.patient_index = PatientSearchIndex()
+        self.patient_index.build(self.patients_df)
+        self._patient_positions = {
+            patient_id: position for position, patient_id in enumerate(self.patients_df['patient_id'])
+        }
+        
+        self._restore_bookings()
+        self._restore_slot_holds()
+    
+    def _restore_bookings(self):
+        """Book confirmed appointments the schedule file does not record, e.g. past the materialized days"""
+        confirmed = self.appointments_df[self.appointments_df['status'] == 'confirmed']
+        for appointment in confirmed.to_dict('records'):
+            if appointment['appointment_id'] not in self.schedule_index.bookings:
+                self._mark_slot_booked(appointment['doctor_name'], str(appointment['appointment_date'])[:10],
+                                       appointment['appointment_time'], appointment['appointment_id'],
+                                       appointment['duration'])
+    
+    def _restore_slot_holds(self):
+        """Re-create holds for pending appointments saved by a previous process"""
+        pending = self.appointments_df[self.appointments_df['status'] == 'pending']
+        now = datetime.now()
+        for _, appointment in pending.iterrows():
+            created = pd.to_datetime(appointment['created_date'], errors='coerce')
+            if pd.isna(created):
+                continue
+            remaining = (created + self.slot_holds.ttl - now).total_seconds() / 60
+            if remaining > 0:
+                self.slot_holds.place_hold(
+                    appointment['doctor_name'], appointment['appointment_date'],
+                    appointment['appointment_time'], appointment['appointment_id'],
+                    ttl_minutes=remaining, now=now, duration=appointment['duration']
+                )
+    
+    def sweep_expired_holds(self):
+        """Expire pending appointments whose slot hold ran out; cost is proportional to the expired holds"""
+        expired = self.slot_holds.sweep()
+        if expired:
+            self.expire_appointments([hold.appointment_id for hold in expired])
+        return len(expired)
+    
+    @property
+    def schedules_df(self):
+        """Slot-per-row view of the schedule, generated from the bitmaps"""
+        return self.schedule_index.to_dataframe()
+    
+    @property
+    def in_transaction(self):
+        """Whether a transaction is open, so its changes may still be rolled back"""
+        return self._pending_events is not None
+    
+    @contextmanager
+    def transaction(self):
+        """Group writes into one save; on an error every in-memory change is rolled back"""
+        if self._pending_events is not None:
+            # Nested transactions join the outer one
+            yield self
+            return
+        
+        snapshot = {
+            'patients_df': self.patients_df.copy(),
+            'appointments_df': self.appointments_df.copy(),
+            'schedule_index': copy.deepcopy({key: value for key, value in vars(self.schedule_index).items()
+                                             if key != 'virtual'}),
+            'schedule_templates': copy.deepcopy(vars(self.schedule_templates)),
+            'slot_holds': copy.deepcopy(vars(self.slot_holds))
+        }
+        self._pending_events = []
+        try:
+            yield self
+        except Exception:
+            self._pending_events = None
+            self.patients_df = snapshot['patients_df']
+            self.appointments_df = snapshot['appointments_df']
+            vars(self.schedule_index).update(snapshot['schedule_index'])
+            vars(self.schedule_templates).update(snapshot['schedule_templates'])
+            vars(self.slot_holds).update(snapshot['slot_holds'])
+            self.schedule_templates.exceptions_dataframe().to_csv(self.schedule_exceptions_file, index=False)
+            raise
+        
+        events, self._pending_events = self._pending_events, None
+        self.save_data()
+        # Listeners only hear about writes that were committed
+        for event, payload in events:
+            self._emit(event, payload)
     
     def save_data(self):
         """Save all data to files"""
+        if self._pending_events is not None:
+            return  # written once when the transaction commits
         self.patients_df.to_csv(self.patients_file, index=False)
         self.schedules_df.to_excel(self.schedules_file, index=False)
         self.appointments_df.to_excel(self.appointments_file, index=False)
     
+    def save_schedule(self):
+        """Save only the schedule file"""
+        if self._pending_events is not None:
+            return  # written once when the transaction commits
+        self.schedules_df.to_excel(self.schedules_file, index=False)
+    
+    def get_patient(self, patient_id):
+        """Patient record by ID as a dictionary, or None"""
+        position = self._patient_positions.get(patient_id)
+        if position is None:
+            return None
+        return self.patients_df.iloc[position].to_dict()
+    
     def find_patient(self, first_name=None, last_name=None, phone=None, email=None):
         """Find patient by various criteria"""
         if first_name and last_name:
@@ -107,6 +267,9 @@ class MedicalDatabase:
         
         self.patients_df = pd.concat([self.patients_df, pd.DataFrame([cleaned_data])], ignore_index=True)
         self.save_data()
+        self._patient_positions[patient_id] = len(self.patients_df) - 1
+        self.patient_index.add_patient(cleaned_data)
+        self._emit('patient_added', cleaned_data)
         
         return patient_id
     
@@ -118,27 +281,113 @@ class MedicalDatabase:
                 if key in self.patients_df.columns:
                     self.patients_df.loc[mask, key] = value
             self.save_data()
+            patient = self.patients_df[mask].iloc[0].to_dict()
+            self.patient_index.add_patient(patient)
+            self._emit('patient_updated', patient)
             return True
         return False
     
-    def get_available_slots(self, doctor_name, date):
-        """Get available time slots for a doctor on a specific date"""
-        mask = (self.schedules_df['doctor_name'] == doctor_name) & \
-               (self.schedules_df['date'] == date) & \
-               (self.schedules_df['is_available'] == True)
+    def search_patients(self, query, limit=20, offset=0):
+        """Search patients by name, ID, email or phone; returns a ranked page and the total match count"""
+        patient_ids, total = self.patient_index.search(query, limit=limit, offset=offset)
+        if not patient_ids:
+            return self.patients_df.iloc[0:0], total
         
-        available_slots = self.schedules_df[mask]
-        return available_slots[['time_slot', 'location']].to_dict('records')
+        # Fetch only the page's rows, in the index's ranking order
+        positions = [self._patient_positions[patient_id] for patient_id in patient_ids]
+        return self.patients_df.iloc[positions], total
+    
+    def get_available_slots(self, doctor_name, date, duration=RETURNING_PATIENT_DURATION):
+        """Get start times for a doctor on a specific date where a visit of duration minutes fits"""
+        # Slots held by other sessions' pending appointments are not offered. Reads never sweep: lapsed holds are
+        # skipped here and expired by the next write
+        held_times = self.slot_holds.held_times(doctor_name, date)
+        return self.schedule_index.available_slots(doctor_name, date, duration, held_times)
+    
+    def slot_fits(self, doctor_name, date, time_slot, duration=RETURNING_PATIENT_DURATION):
+        """Whether a visit of duration minutes can still start at time_slot"""
+        held_times = self.slot_holds.held_times(doctor_name, date)
+        return self.schedule_index.fits(doctor_name, date, time_slot, duration, held_times)
+    
+    def find_earliest_slots(self, doctor_name, duration=RETURNING_PATIENT_DURATION, days=30, start_date=None):
+        """First date within the next days with room for the visit, and its start times"""
+        start_date = start_date or datetime.now()
+        check_date = start_date.strftime('%Y-%m-%d')
+        end_date = (start_date + timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        while check_date <= end_date:
+            fit = self.schedule_index.first_fit(duration, [doctor_name], check_date, end_date)[doctor_name]
+            if fit is None:
+                break
+            slots = self.get_available_slots(doctor_name, fit['date'], duration)
+            if slots:
+                return fit['date'], slots
+            # Every fitting start that day is held by a pending appointment; look after it
+            check_date = (datetime.strptime(fit['date'], '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+        
+        # Past the materialized days the weekly templates decide
+        days = self.schedule_index.days
+        check_date = max(start_date, datetime.strptime(days[-1], '%Y-%m-%d') + timedelta(days=1)) if days else start_date
+        while check_date.strftime('%Y-%m-%d') <= end_date:
+            slots = self.get_available_slots(doctor_name, check_date.strftime('%Y-%m-%d'), duration)
+            if slots:
+                return check_date.strftime('%Y-%m-%d'), slots
+            check_date += timedelta(days=1)
+        return None, []
+    
+    def add_schedule_exception(self, doctor_name, date, kind, times=None):
+        """Record a vacation ('closed'), blocked slots ('blocked') or an extra clinic ('extra')"""
+        self.schedule_templates.add_exception(doctor_name, date, kind, times)
+        self.schedule_index.apply_exception(doctor_name, date, kind, times)
+        self.schedule_templates.exceptions_dataframe().to_csv(self.schedule_exceptions_file, index=False)
+        self.save_data()
+        self._emit('schedule_exception_added', {'doctor_name': doctor_name, 'date': date, 'kind': kind, 'times': times})
+        return True
+    
+    def get_schedule_utilization(self, days=7, start_date=None):
+        """Share of scheduled slots already booked per doctor over the next days"""
+        start_date = start_date or datetime.now()
+        return self.schedule_index.utilization(
+            start_date.strftime('%Y-%m-%d'),
+            (start_date + timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        )
+    
+    def get_occupancy(self, days=7, start_date=None):
+        """Open, booked and free slot counts per doctor per day over the next days"""
+        start_date = start_date or datetime.now()
+        return self.schedule_index.occupancy(
+            start_date.strftime('%Y-%m-%d'),
+            (start_date + timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        )
+    
+    def get_dashboard_metrics(self, days=7):
+        """Headline counts for dashboards; cost does not grow with the size of the tables"""
+        utilization = self.get_schedule_utilization(days=days)
+        metrics = self.appointment_stats.summary()
+        metrics['total_patients'] = len(self.patients_df)
+        metrics['open_slots'] = int(utilization['open_slots'].sum())
+        metrics['booked_slots'] = int(utilization['booked_slots'].sum())
+        metrics['utilization'] = metrics['booked_slots'] / max(metrics['open_slots'], 1)
+        return metrics
+    
+    @staticmethod
+    def _last_appointment_number(appointment_ids):
+        """Highest number of the "A0001" style IDs; create_appointment's "APT_..." ones do not count"""
+        numbers = appointment_ids.astype(str).str.extract(r'^A(\d+)$')[0].dropna()
+        return int(numbers.astype(int).max()) if len(numbers) else 0
     
     def book_appointment(self, appointment_data):
-        """Book an appointment"""
-        # Generate appointment ID
-        if len(self.appointments_df) == 0:
-            appointment_id = "A0001"
-        else:
-            last_id = self.appointments_df['appointment_id'].max()
-            last_num = int(last_id[1:])
-            appointment_id = f"A{str(last_num + 1).zfill(4)}"
+        """Book an appointment; None when the visit no longer fits, e.g. another patient took the slot first"""
+        # Lapsed holds give their slots back before anything is booked over them
+        self.sweep_expired_holds()
+        duration = appointment_data.get('duration', RETURNING_PATIENT_DURATION)
+        if not self.slot_fits(appointment_data['doctor_name'], appointment_data['appointment_date'],
+                              appointment_data['appointment_time'], duration):
+            return None
+        
+        # Generate appointment ID past every one in use, including those moved to the archive
+        last_num = max(self._last_appointment_number(self.appointments_df['appointment_id']),
+                       self._archived_appointment_number)
+        appointment_id = f"A{str(last_num + 1).zfill(4)}"
         
         appointment_data['appointment_id'] = appointment_id
         appointment_data['created_date'] = datetime.now().strftime('%Y-%m-%d')
@@ -151,13 +400,9 @@ class MedicalDatabase:
         # Add appointment to appointments table
         self.appointments_df = pd.concat([self.appointments_df, pd.DataFrame([appointment_data])], ignore_index=True)
         
-        # Update schedule to mark slot as unavailable
-        mask = (self.schedules_df['doctor_name'] == appointment_data['doctor_name']) & \
-               (self.schedules_df['date'] == appointment_data['appointment_date']) & \
-               (self.schedules_df['time_slot'] == appointment_data['appointment_time'])
-        
-        self.schedules_df.loc[mask, 'is_available'] = False
-        self.schedules_df.loc[mask, 'appointment_id'] = appointment_id
+        # Update schedule to mark every slot the visit covers as unavailable
+        self._mark_slot_booked(appointment_data['doctor_name'], appointment_data['appointment_date'],
+                               appointment_data['appointment_time'], appointment_id, duration)
         
         # Update patient's last visit and new patient status
         patient_mask = self.patients_df['patient_id'] == appointment_data['patient_id']
@@ -165,6 +410,7 @@ class MedicalDatabase:
         self.patients_df.loc[patient_mask, 'is_new_patient'] = False
         
         self.save_data()
+        self._emit('appointment_created', appointment_data)
         
         return appointment_id
     
@@ -174,21 +420,85 @@ class MedicalDatabase:
         if mask.any():
             appointment = self.appointments_df[mask].iloc[0]
             
-            # Update appointment status
+            # Update appointment status; the cancellation time drives archive retention
             self.appointments_df.loc[mask, 'status'] = 'cancelled'
+            self.appointments_df.loc[mask, 'cancelled_date'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             
-            # Free up the time slot
-            schedule_mask = (self.schedules_df['doctor_name'] == appointment['doctor_name']) & \
-                           (self.schedules_df['date'] == appointment['appointment_date']) & \
-                           (self.schedules_df['time_slot'] == appointment['appointment_time'])
-            
-            self.schedules_df.loc[schedule_mask, 'is_available'] = True
-            self.schedules_df.loc[schedule_mask, 'appointment_id'] = None
+            # Free up every time slot the visit covered
+            self._free_booked_slots([appointment_id])
             
+            self.slot_holds.release(appointment_id)
             self.save_data()
+            self._emit('appointment_cancelled', appointment.to_dict())
             return True
         return False
     
+    def expire_appointments(self, appointment_ids):
+        """Mark abandoned pending appointments as expired and free any slots they hold"""
+        mask = self.appointments_df['appointment_id'].isin(appointment_ids) & \
+               (self.appointments_df['status'] == 'pending')
+        expired_ids = self.appointments_df.loc[mask, 'appointment_id'].tolist()
+        if not expired_ids:
+            return 0, 0
+        
+        self.appointments_df.loc[mask, 'status'] = 'expired'
+        for appointment_id in expired_ids:
+            self.slot_holds.release(appointment_id)
+        
+        slots_freed = self._free_booked_slots(expired_ids)
+        
+        self.save_data()
+        self._emit('appointments_expired', {'appointment_ids': expired_ids})
+        return len(expired_ids), slots_freed
+    
+    def archive_appointments(self, appointment_ids):
+        """Move appointments to the archive file and rewrite the hot table without them"""
+        mask = self.appointments_df['appointment_id'].isin(appointment_ids)
+        archived = self.appointments_df[mask]
+        if len(archived) == 0:
+            return 0
+        
+        try:
+            archive_df = pd.read_excel(self.appointments_archive_file)
+            archive_df = pd.concat([archive_df, archived], ignore_index=True)
+        except FileNotFoundError:
+            archive_df = archived
+        archive_df.to_excel(self.appointments_archive_file, index=False)
+        self._archived_appointment_number = max(self._archived_appointment_number,
+                                                self._last_appointment_number(archived['appointment_id']))
+        
+        # Rebuild the hot table from the surviving rows only
+        self.appointments_df = self.appointments_df[~mask].reset_index(drop=True)
+        self.save_data()
+        self._emit('appointments_archived', {'appointment_ids': archived['appointment_id'].tolist()})
+        return len(archived)
+    
+    def extend_schedule(self, through_date):
+        """Materialize the schedule up to a date from the weekly templates; returns the dates added"""
+        added = self.schedule_index.extend_through(through_date, start_date=datetime.now().strftime('%Y-%m-%d'))
+        if added:
+            # Only the schedule changed; patients and appointments are not rewritten
+            self.save_schedule()
+            self._emit('schedule_extended', {'dates': added})
+        return added
+    
+    def archive_schedule_days(self, before_date):
+        """Move schedule days before a date to the archive file; returns the number of slot rows moved"""
+        archived = self.schedule_index.drop_days_before(before_date)
+        if len(archived) == 0:
+            return 0
+        
+        try:
+            archive_df = pd.read_excel(self.schedule_archive_file)
+            archive_df = pd.concat([archive_df, archived], ignore_index=True)
+        except FileNotFoundError:
+            archive_df = archived
+        archive_df.to_excel(self.schedule_archive_file, index=False)
+        
+        self.save_data()
+        self._emit('schedule_archived', {'before_date': before_date, 'rows': len(archived)})
+        return len(archived)
+    
     def get_patient_appointments(self, patient_id):
         """Get all appointments for a patient"""
         mask = self.appointments_df['patient_id'] == patient_id
@@ -233,14 +543,28 @@ class MedicalDatabase:
             return True
         return False
     
-    def create_appointment(self, patient_id, doctor_name, appointment_date, appointment_time, location, status='confirmed'):
+    def create_appointment(self, patient_id, doctor_name, appointment_date, appointment_time, location, status='confirmed',
+                           duration=None, hold_minutes=None):
         """Create a new appointment"""
         try:
             # Generate unique appointment ID
-            appointment_id = f"APT_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            appointment_id = f"APT_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+            
+            # A lapsed hold on the slot is expired rather than blocking the new one
+            self.sweep_expired_holds()
+            
+            # Determine duration based on patient type unless the caller knows it
+            if duration is None:
+                duration = NEW_PATIENT_DURATION if patient_id == 'NEW' else RETURNING_PATIENT_DURATION
             
-            # Determine duration based on patient type
-            duration = 60 if patient_id == 'NEW' else 30  # New patients get 60 min, returning get 30 min
+            # The whole visit must still be free and not held by another pending appointment
+            if not self.slot_fits(doctor_name, appointment_date, appointment_time, duration):
+                return None
+            
+            if status == 'pending':
+                # Reserve the slots until the intake form is completed or the hold expires
+                self.slot_holds.place_hold(doctor_name, appointment_date, appointment_time, appointment_id,
+                                           ttl_minutes=hold_minutes, duration=duration)
             
             # Create new appointment record
             new_appointment = {
@@ -264,16 +588,97 @@ class MedicalDatabase:
             # Add to appointments dataframe
             self.appointments_df = pd.concat([self.appointments_df, pd.DataFrame([new_appointment])], ignore_index=True)
             
+            if status == 'confirmed':
+                self._mark_slot_booked(doctor_name, appointment_date, appointment_time, appointment_id, duration)
+            
             # Save to file
             self.save_data()
+            self._emit('appointment_created', new_appointment)
             
-            print(f"DEBUG: Appointment created successfully with ID: {appointment_id}")
             return appointment_id
             
         except Exception as e:
-            print(f"DEBUG: Error creating appointment: {str(e)}")
+            self.slot_holds.release(appointment_id)
+            print(f"Error creating appointment: {str(e)}")
             return None
     
+    def move_appointment(self, appointment_id, doctor_name, appointment_date, appointment_time):
+        """Move a confirmed appointment to another doctor, date or time if the whole visit fits there"""
+        mask = self.appointments_df['appointment_id'] == appointment_id
+        if not mask.any():
+            return False
+        
+        appointment = self.appointments_df[mask].iloc[0]
+        if appointment['status'] != 'confirmed':
+            return False
+        
+        self.sweep_expired_holds()
+        times = self.schedule_index.bookings.get(appointment_id)
+        self._free_booked_slots([appointment_id])
+        if not self.slot_fits(doctor_name, appointment_date, appointment_time, appointment['duration']):
+            # Put the old booking back untouched
+            if times:
+                self.schedule_index.mark_booked(times[0], times[1], times[2], appointment_id)
+            return False
+        
+        self._mark_slot_booked(doctor_name, appointment_date, appointment_time, appointment_id, appointment['duration'])
+        self.appointments_df.loc[mask, 'doctor_name'] = doctor_name
+        self.appointments_df.loc[mask, 'appointment_date'] = appointment_date
+        self.appointments_df.loc[mask, 'appointment_time'] = appointment_time
+        # Reminders already sent referred to the old time
+        for column in ['reminder_sent_1', 'reminder_sent_2', 'reminder_sent_3']:
+            self.appointments_df.loc[mask, column] = False
+        
+        self.save_data()
+        self._emit('appointment_rescheduled', {
+            'appointment': self.appointments_df[mask].iloc[0].to_dict(),
+            'previous': {
+                'doctor_name': appointment['doctor_name'],
+                'appointment_date': str(appointment['appointment_date'])[:10],
+                'appointment_time': appointment['appointment_time']
+            }
+        })
+        return True
+    
+    def _mark_slot_booked(self, doctor_name, date, time_slot, appointment_id, duration=RETURNING_PATIENT_DURATION):
+        """Mark every schedule slot covered by a visit as taken by an appointment"""
+        self.schedule_index.mark_booked(doctor_name, date, covered_times(time_slot, duration), appointment_id)
+    
+    def _free_booked_slots(self, appointment_ids):
+        """Release the schedule slots booked by appointments; returns the number of slots freed"""
+        return sum(self.schedule_index.release(appointment_id) for appointment_id in appointment_ids)
+    
+    def confirm_appointment(self, appointment_id, patient_id=None):
+        """Confirm a pending appointment, promoting its slot hold to a booking"""
+        mask = self.appointments_df['appointment_id'] == appointment_id
+        if not mask.any():
+            return False
+        
+        appointment = self.appointments_df[mask].iloc[0]
+        if patient_id:
+            self.appointments_df.loc[mask, 'patient_id'] = patient_id
+        
+        if appointment['status'] == 'confirmed':
+            self.save_data()
+            return True
+        if appointment['status'] != 'pending':
+            # Expired or cancelled while the intake form was being filled in
+            return False
+        
+        hold = self.slot_holds.promote(appointment_id)
+        if hold is None:
+            # The hold lapsed; the slots can still be taken if nobody else got them
+            if not self.slot_fits(appointment['doctor_name'], appointment['appointment_date'],
+                                  appointment['appointment_time'], appointment['duration']):
+                return False
+        
+        self.appointments_df.loc[mask, 'status'] = 'confirmed'
+        self._mark_slot_booked(appointment['doctor_name'], appointment['appointment_date'],
+                               appointment['appointment_time'], appointment_id, appointment['duration'])
+        self.save_data()
+        self._emit('appointment_confirmed', self.appointments_df[mask].iloc[0].to_dict())
+        return True
+    
     def export_appointments_report(self, filename=None):
         """Export appointments report for admin review"""
         if filename is None:
@@ -0,0 +1,337 @@
+import os
+import re
+import sys
+from collections import defaultdict
+from datetime import datetime
+
+import pandas as pd
+
+from config import DATA_DIR, PATIENT_DB_FILE
+
+# Score at or above which two records are reported as a possible duplicate
+MATCH_THRESHOLD = 0.75
+
+# Blocks larger than this are too unselective to compare pairwise (e.g. a very
+# common surname code); records still meet through their other blocking keys
+MAX_BLOCK_SIZE = 500
+
+# Relative weight of each field in the match score
+FIELD_WEIGHTS = {
+    'name': 0.4,
+    'date_of_birth': 0.3,
+    'phone': 0.15,
+    'email': 0.15
+}
+
+_SOUNDEX_CODES = {}
+for _letters, _digit in (("bfpv", "1"), ("cgjkqsxz", "2"), ("dt", "3"), ("l", "4"), ("mn", "5"), ("r", "6")):
+    for _letter in _letters:
+        _SOUNDEX_CODES[_letter] = _digit
+
+_NON_DIGITS = re.compile(r"\D")
+_NON_LETTERS = re.compile(r"[^a-z]")
+
+
+def soundex(name):
+    """Return the American Soundex code of a name, e.g. 'Robert' -> 'R163'"""
+    name = _NON_LETTERS.sub('', str(name).lower())
+    if not name:
+        return ''
+
+    code = name[0].upper()
+    previous = _SOUNDEX_CODES.get(name[0], '')
+    for letter in name[1:]:
+        digit = _SOUNDEX_CODES.get(letter, '')
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # 'h' and 'w' do not separate letters with the same code
+        if letter not in "hw":
+            previous = digit
+
+    return code.ljust(4, '0')
+
+
+def edit_distance(a, b, max_distance=None):
+    """Levenshtein distance between two strings, stopping early past max_distance"""
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    if max_distance is not None and len(a) - len(b) > max_distance:
+        return max_distance + 1
+
+    previous_row = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current_row = [i]
+        for j, char_b in enumerate(b, 1):
+            current_row.append(min(
+                previous_row[j] + 1,
+                current_row[j - 1] + 1,
+                previous_row[j - 1] + (char_a != char_b)
+            ))
+        if max_distance is not None and min(current_row) > max_distance:
+            return max_distance + 1
+        previous_row = current_row
+
+    return previous_row[-1]
+
+
+def _similarity(a, b):
+    """Normalized edit-distance similarity in [0, 1]"""
+    if not a or not b:
+        return 0.0
+    longest = max(len(a), len(b))
+    return 1.0 - edit_distance(a, b) / longest
+
+
+def _clean(value):
+    """Normalize a cell value to a stripped lowercase string"""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ''
+    return str(value).strip().lower()
+
+
+def normalize_record(record):
+    """Extract the fields used for matching from a patient row or dict"""
+    phone = ''
+    for field in ('phone', 'cell_phone', 'home_phone'):
+        digits = _NON_DIGITS.sub('', _clean(record.get(field)))
+        if digits:
+            phone = digits[-10:]
+            break
+
+    email = _clean(record.get('email'))
+    return {
+        'patient_id': _clean(record.get('patient_id')).upper(),
+        'first_name': _NON_LETTERS.sub('', _clean(record.get('first_name'))),
+        'last_name': _NON_LETTERS.sub('', _clean(record.get('last_name'))),
+        'date_of_birth': _clean(record.get('date_of_birth'))[:10],
+        'phone': phone,
+        'email_local': email.split('@')[0] if '@' in email else ''
+    }
+
+
+def blocking_keys(record):
+    """Blocking keys for a normalized record; only records sharing a key are compared"""
+    keys = []
+    if record['last_name']:
+        # Surname sound plus first initial keeps common surnames selective
+        keys.append(f"name:{soundex(record['last_name'])}:{record['first_name'][:1]}")
+    if record['date_of_birth']:
+        keys.append(f"dob:{record['date_of_birth']}")
+    if len(record['phone']) >= 7:
+        keys.append(f"phone:{record['phone'][-7:]}")
+    if record['email_local']:
+        keys.append(f"email:{record['email_local']}")
+    return keys
+
+
+def score_records(a, b):
+    """Weighted similarity of two normalized records and the fields that agreed"""
+    score = 0.0
+    total_weight = 0.0
+    reasons = []
+
+    if a['last_name'] and b['last_name']:
+        name_a = f"{a['first_name']} {a['last_name']}"
+        name_b = f"{b['first_name']} {b['last_name']}"
+        # Also accept first and last name entered in swapped order
+        swapped_b = f"{b['last_name']} {b['first_name']}"
+        name_score = max(_similarity(name_a, name_b), _similarity(name_a, swapped_b))
+        score += FIELD_WEIGHTS['name'] * name_score
+        total_weight += FIELD_WEIGHTS['name']
+        if name_score >= 0.8:
+            reasons.append('name')
+
+    if a['date_of_birth'] and b['date_of_birth']:
+        # One typo in a date (e.g. a transposed digit) is still worth half
+        distance = edit_distance(a['date_of_birth'], b['date_of_birth'], max_distance=2)
+        dob_score = {0: 1.0, 1: 0.5}.get(distance, 0.0)
+        score += FIELD_WEIGHTS['date_of_birth'] * dob_score
+        total_weight += FIELD_WEIGHTS['date_of_birth']
+        if dob_score == 1.0:
+            reasons.append('date_of_birth')
+
+    if a['phone'] and b['phone']:
+        phone_score = 1.0 if a['phone'][-7:] == b['phone'][-7:] else 0.0
+        score += FIELD_WEIGHTS['phone'] * phone_score
+        total_weight += FIELD_WEIGHTS['phone']
+        if phone_score:
+            reasons.append('phone')
+
+    if a['email_local'] and b['email_local']:
+        email_score = _similarity(a['email_local'], b['email_local'])
+        score += FIELD_WEIGHTS['email'] * email_score
+        total_weight += FIELD_WEIGHTS['email']
+        if email_score >= 0.9:
+            reasons.append('email')
+
+    if total_weight == 0:
+        return 0.0, reasons
+    return round(score / total_weight, 3), reasons
+
+
+class DuplicateDetector:
+    def __init__(self, threshold=MATCH_THRESHOLD, max_block_size=MAX_BLOCK_SIZE):
+        """Initialize an empty blocking index"""
+        self.threshold = threshold
+        self.max_block_size = max_block_size
+        self.records = {}
+        self.blocks = defaultdict(set)
+
+    def build(self, patients_df):
+        """Index every patient in a dataframe, replacing the current index"""
+        self.records = {}
+        self.blocks = defaultdict(set)
+        for record in patients_df.to_dict('records'):
+            self.add_patient(record)
+
+    def add_patient(self, patient_data):
+        """Add or refresh one patient in the blocking index"""
+        record = normalize_record(patient_data)
+        patient_id = record['patient_id']
+        if not patient_id:
+            return
+
+        if patient_id in self.records:
+            self.remove_patient(patient_id)
+
+        self.records[patient_id] = record
+        for key in blocking_keys(record):
+            self.blocks[key].add(patient_id)
+
+    def remove_patient(self, patient_id):
+        """Drop a patient from the blocking index"""
+        record = self.records.pop(str(patient_id).upper(), None)
+        if record:
+            for key in blocking_keys(record):
+                self.blocks[key].discard(record['patient_id'])
+
+    def _candidates(self, record):
+        """Patient IDs sharing at least one selective block with the record"""
+        candidates = set()
+        for key in blocking_keys(record):
+            block = self.blocks.get(key)
+            if block and len(block) <= self.max_block_size:
+                candidates.update(block)
+        candidates.discard(record['patient_id'])
+        return candidates
+
+    def find_possible_matches(self, patient_info, limit=5):
+        """Return indexed patients that look like the same person, best first"""
+        record = normalize_record(patient_info)
+        matches = []
+        for patient_id in self._candidates(record):
+            score, reasons = score_records(record, self.records[patient_id])
+            if score >= self.threshold:
+                matches.append({'patient_id': patient_id, 'score': score, 'matched_on': reasons})
+
+        matches.sort(key=lambda match: (-match['score'], match['patient_id']))
+        return matches[:limit]
+
+    def find_duplicate_pairs(self):
+        """Score every pair of records that share a block, each pair once"""
+        pairs = {}
+        for block in self.blocks.values():
+            if len(block) < 2 or len(block) > self.max_block_size:
+                continue
+            members = sorted(block)
+            for i, first_id in enumerate(members):
+                for second_id in members[i + 1:]:
+                    if (first_id, second_id) in pairs:
+                        continue
+                    score, reasons = score_records(self.records[first_id], self.records[second_id])
+                    pairs[(first_id, second_id)] = (score, reasons)
+
+        return [
+            {'patient_id_1': first_id, 'patient_id_2': second_id, 'score': score, 'matched_on': ', '.join(reasons)}
+            for (first_id, second_id), (score, reasons) in pairs.items()
+            if score >= self.threshold
+        ]
+
+
+def generate_dedup_report(patients_file=PATIENT_DB_FILE, filename=None, threshold=MATCH_THRESHOLD):
+    """Write an Excel report of likely duplicate patients found in a patients CSV"""
+    patients_df = pd.read_csv(patients_file, dtype=str)
+
+    detector = DuplicateDetector(threshold=threshold)
+    detector.build(patients_df)
+    pairs = detector.find_duplicate_pairs()
+
+    columns = ['patient_id_1', 'patient_id_2', 'score', 'matched_on']
+    report_df = pd.DataFrame(pairs, columns=columns).sort_values('score', ascending=False)
+
+    # Show both records side by side for review
+    patient_info = patients_df[['patient_id', 'first_name', 'last_name', 'date_of_birth', 'email']]
+    for suffix in ('1', '2'):
+        renamed = patient_info.rename(columns=lambda column: f"{column}_{suffix}")
+        report_df = report_df.merge(renamed, on=f"patient_id_{suffix}", how='left')
+
+    if filename is None:
+        filename = f"duplicate_patients_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    os.makedirs(DATA_DIR, exist_ok=True)
+    report_path = os.path.join(DATA_DIR, filename)
+    report_df.to_excel(report_path, index=False)
+
+    print(f"Found {len(report_df)} possible duplicate pairs among {len(patients_df)} patients")
+    return report_path
+
+
+class PatientMatcher:
+    def __init__(self, database):
+        """Keep a duplicate detector in sync with the patient table"""
+        self.database = database
+        self.detector = DuplicateDetector()
+        self.detector.build(database.patients_df)
+        database.subscribe(self._on_database_event)
+
+    def _on_database_event(self, event, payload):
+        """Index patients as they are added or edited"""
+        if event in ('patient_added', 'patient_updated'):
+            self.detector.add_patient(payload)
+
+    def find_possible_matches(self, first_name, last_name, date_of_birth=None, phone=None, email=None, limit=3):
+        """Possible existing records for a patient who was not found by exact name"""
+        matches = self.detector.find_possible_matches({
+            'first_name': first_name,
+            'last_name': last_name,
+            'date_of_birth': date_of_birth,
+            'phone': phone,
+            'email': email
+        }, limit=limit)
+
+        # Attach the stored record so callers can show and link it
+        for match in matches:
+            mask = self.database.patients_df['patient_id'] == match['patient_id']
+            if mask.any():
+                match['patient'] = self.database.patients_df[mask].iloc[0].to_dict()
+        return [match for match in matches if 'patient' in match]
+
+    def confirms_identity(self, patient_id, date_of_birth=None, phone=None):
+        """Whether a date of birth or phone number the patient gave matches a stored record"""
+        mask = self.database.patients_df['patient_id'] == patient_id
+        if not mask.any():
+            return False
+        stored = normalize_record(self.database.patients_df[mask].iloc[0].to_dict())
+        given = normalize_record({'date_of_birth': date_of_birth, 'phone': phone})
+        if given['date_of_birth'] and given['date_of_birth'] == stored['date_of_birth']:
+            return True
+        return bool(given['phone']) and given['phone'] == stored['phone']
+
+
+_patient_matcher = None
+
+def get_patient_matcher():
+    """Shared matcher for the global database, built on first use"""
+    global _patient_matcher
+    if _patient_matcher is None:
+        from database import db
+        _patient_matcher = PatientMatcher(db)
+    return _patient_matcher
+
+
+if __name__ == "__main__":
+    source = sys.argv[1] if len(sys.argv) > 1 else PATIENT_DB_FILE
+    print(f"Report saved to {generate_dedup_report(source)}")
@@ -0,0 +1,270 @@
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+
+from config import INTENT_MODEL_FILE, INTENT_CONFIDENCE_THRESHOLD, LLM_ESTIMATED_LATENCY_MS, DOCTORS
+from nlu import DATE_PATTERN, WORD_PATTERN, doctor_resolver
+
+INTENTS = ['greeting', 'patient_info', 'doctor', 'date', 'earliest', 'slot_number', 'time', 'yes', 'no', 'cancel',
+           'thanks', 'other']
+
+# Steps whose answers are free text by nature, e.g. an insurance carrier, a member ID or the phone number on file;
+# their handlers take anything
+FREE_TEXT_STEPS = {'greeting', 'collecting_patient_info', 'confirm_identity', 'collect_insurance'}
+
+# Keyword and shape features; the model learns how much each says about each intent
+FEATURE_PATTERNS = {
+    'date': DATE_PATTERN,
+    'time': re.compile(r"\b\d{1,2}:\d{2}\b"),
+    'only_number': re.compile(r"^\s*(?:#|no\.?|number|option|slot)?\s*\d{1,2}\s*[.!]?\s*$"),
+    'number': re.compile(r"\d+"),
+    'email': re.compile(r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Za-z]{2,}\b"),
+    'phone': re.compile(r"\d{3}[-.]?\d{3}[-.]?\d{4}"),
+    'name_phrase': re.compile(r"\b(my name is|i'm|i am|this is)\b"),
+    'doctor_title': re.compile(r"\b(dr|doctor|doc)\b"),
+    'earliest': re.compile(r"\b(earliest|soonest|asap|first available|next available|as soon as)\b"),
+    'cancel': re.compile(r"\b(cancel|cancellation|call off|never ?mind|stop|quit)\b"),
+    'yes': re.compile(r"\b(yes|yeah|yep|yup|correct|sure|ok|okay|right|that's me|that is me|sounds good)\b"),
+    'no': re.compile(r"\b(no|nope|nah|not me|wrong|incorrect)\b"),
+    'greeting': re.compile(r"^\s*(hello|hi|hey|good (morning|afternoon|evening))\b"),
+    'thanks': re.compile(r"\b(thanks|thank you|thx|bye|goodbye|that's all|that is all)\b"),
+    'question': re.compile(r"\?|\b(what|which|how|why|where|can you|could you|do you)\b"),
+}
+
+
+def features(text):
+    """Active features of a message: keyword and shape flags, its length bucket and its words"""
+    text = text.lower().strip()
+    active = {f"has_{name}" for name, pattern in FEATURE_PATTERNS.items() if pattern.search(text)}
+    if doctor_resolver.resolve(text):
+        active.add('has_doctor_match')
+    words = WORD_PATTERN.findall(text)
+    count = len(words)
+    active.add('words:0' if count == 0 else 'words:1' if count == 1 else 'words:2-3' if count <= 3
+               else 'words:4-8' if count <= 8 else 'words:9+')
+    active.update(f"w:{word}" for word in words)
+    return active
+
+
+def training_examples(seed=5):
+    """Labelled messages for every intent, written the way patients answer each step"""
+    rng = random.Random(seed)
+    first_names = ['john', 'maria', 'wei', 'fatima', 'liam', 'sofia', 'omar', 'grace']
+    last_names = ['smith', 'garcia', 'zhang', 'khan', 'murphy', 'rossi', 'haddad', 'kim']
+    doctor_words = []
+    for doctor_name, info in DOCTORS.items():
+        first, last = doctor_name.lower().replace('dr. ', '').split()
+        doctor_words += [f"dr. {last}", f"dr {last}", f"doctor {last}", last, f"{first} {last}",
+                         f"i'd like to see dr. {last}", f"can i see doctor {last}", f"{info['specialty'].lower()}",
+                         f"a {info['specialty'].lower()} doctor please"]
+    doctor_words += ["heart doctor", "i need a bone doctor", "someone for my kid", "a neurologist",
+                     "the pediatrician", "my knee doctor", "cardiologist please"]
+
+    examples = [(text, 'greeting') for text in [
+        "hello", "hi", "hey", "hi there", "hello!", "good morning", "good afternoon", "hey there",
+        "hi, i'd like to book an appointment", "hello i need an appointment", "hi, i want to schedule a visit",
+        "good evening", "hey, can you help me book"]]
+    examples += [(text, 'doctor') for text in doctor_words]
+    examples += [(text, 'earliest') for text in [
+        "earliest available", "earliest", "the earliest please", "soonest possible", "asap", "as soon as possible",
+        "first available", "next available appointment", "whatever is soonest", "earliest available date",
+        "the soonest you have", "first available slot please"]]
+    examples += [(text, 'yes') for text in [
+        "yes", "yeah", "yep", "yes that's me", "that's me", "correct", "yes please", "sure", "ok", "okay",
+        "sounds good", "yes, book it", "yup", "that is me", "right", "yes that is correct"]]
+    examples += [(text, 'no') for text in [
+        "no", "nope", "nah", "no that's not me", "not me", "wrong person", "that's incorrect", "no, that's wrong",
+        "no thanks", "no it isn't"]]
+    examples += [(text, 'cancel') for text in [
+        "cancel", "cancel my appointment", "i want to cancel", "please cancel it", "nevermind", "never mind",
+        "stop", "i need to cancel my booking", "cancel the appointment please", "call it off", "quit"]]
+    examples += [(text, 'thanks') for text in [
+        "thanks", "thank you", "thanks!", "thank you so much", "bye", "goodbye", "that's all", "thanks, bye",
+        "thank you very much", "that is all, thanks", "great thanks", "perfect, thank you"]]
+    examples += [(text, 'other') for text in [
+        "i'm not sure which doctor i need", "what should i bring to my visit", "do you take walk ins",
+        "where do i park", "how long will the visit take", "can my wife come with me",
+        "i have had a headache for three days and i'm worried", "what are your opening hours",
+        "is there a fee if i am late", "i don't know", "maybe", "hmm let me think", "what do you mean",
+        "can you explain the options", "i'd rather talk to a person", "my insurance changed recently, is that a problem",
+        "do i need a referral", "how much does a visit cost", "what's the address",
+        "sometime next week in the afternoon would be nice", "whenever works for the doctor",
+        "i'm confused", "can you repeat that", "why do you need my email", "is the clinic open on weekends",
+        "my son is sick what do i do", "something in the morning", "later in the day if possible", "not sure",
+        "i'm not sure", "hmm not sure", "not sure yet, what do you suggest", "i guess so but what does it involve"]]
+
+    for _ in range(60):
+        first, last = rng.choice(first_names), rng.choice(last_names)
+        dob = f"{rng.randint(1, 12)}/{rng.randint(1, 28)}/{rng.randint(1940, 2010)}"
+        phone = f"555-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}"
+        email = f"{first}.{last}@example.com"
+        examples.append((rng.choice([
+            f"my name is {first} {last}, born {dob}, phone {phone}, email {email}",
+            f"i'm {first} {last} {dob} {phone} {email}",
+            f"{first} {last}", f"{first} {last}, {dob}", f"my phone is {phone}", f"my email is {email}",
+            f"i am {first} {last} and i was born on {dob}", f"{email}", f"{phone}", f"born {dob}",
+        ]), 'patient_info'))
+
+        date = f"{rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(2024, 2031)}"
+        iso = f"{rng.randint(2024, 2031)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        examples.append((rng.choice([date, iso, f"on {date}", f"can i come in on {iso}",
+                                     f"i would like {date} please", f"how about {date}"]), 'date'))
+
+        number = rng.randint(1, 12)
+        examples.append((rng.choice([str(number), f"{number}", f"option {number}", f"number {number}",
+                                     f"slot {number}", f"#{number}", f"{number}."]), 'slot_number'))
+
+        clock = f"{rng.choice([9, 10, 11, 13, 14, 15, 16])}:{rng.choice(['00', '30'])}"
+        examples.append((rng.choice([clock, f"{clock} please", f"at {clock}", f"i'll take {clock}",
+                                     f"{clock} works"]), 'time'))
+    return examples
+
+
+class IntentClassifier:
+    def __init__(self, weights=None, biases=None):
+        """Linear model over message features: intent -> feature -> weight, plus a bias per intent"""
+        self.weights = weights or {intent: {} for intent in INTENTS}
+        self.biases = biases or {intent: 0.0 for intent in INTENTS}
+
+    def probabilities(self, text):
+        """Probability of each intent for a message"""
+        active = features(text)
+        scores = {intent: self.biases[intent] + sum(weights.get(feature, 0.0) for feature in active)
+                  for intent, weights in self.weights.items()}
+        top = max(scores.values())
+        exponentials = {intent: math.exp(score - top) for intent, score in scores.items()}
+        total = sum(exponentials.values())
+        return {intent: value / total for intent, value in exponentials.items()}
+
+    def predict(self, text):
+        """Most likely intent of a message and its probability"""
+        probabilities = self.probabilities(text)
+        intent = max(probabilities, key=probabilities.get)
+        return intent, probabilities[intent]
+
+    def train(self, examples, epochs=30, learning_rate=0.3, seed=5):
+        """Fit the weights to (message, intent) pairs by stochastic gradient descent on the log loss"""
+        rng = random.Random(seed)
+        examples = list(examples)
+        for _ in range(epochs):
+            rng.shuffle(examples)
+            for text, label in examples:
+                active = features(text)
+                probabilities = self.probabilities(text)
+                for intent in INTENTS:
+                    gradient = probabilities[intent] - (intent == label)
+                    if abs(gradient) < 1e-6:
+                        continue
+                    self.biases[intent] -= learning_rate * gradient
+                    weights = self.weights[intent]
+                    for feature in active:
+                        weights[feature] = weights.get(feature, 0.0) - learning_rate * gradient
+        return self
+
+    def accuracy(self, examples):
+        """Share of (message, intent) pairs predicted right"""
+        return sum(self.predict(text)[0] == label for text, label in examples) / len(examples)
+
+    def save(self, path=INTENT_MODEL_FILE):
+        """Write the weights to a JSON file, leaving out the ones too small to matter"""
+        model = {
+            'intents': INTENTS,
+            'biases': {intent: round(bias, 4) for intent, bias in self.biases.items()},
+            'weights': {intent: {feature: round(weight, 4) for feature, weight in sorted(weights.items())
+                                 if abs(weight) >= 0.01}
+                        for intent, weights in self.weights.items()}
+        }
+        with open(path, 'w') as model_file:
+            json.dump(model, model_file, indent=1, sort_keys=True)
+            model_file.write("\n")
+
+    @classmethod
+    def load(cls, path=INTENT_MODEL_FILE):
+        """Classifier from a saved model file, trained from the built-in examples when there is none"""
+        try:
+            with open(path) as model_file:
+                model = json.load(model_file)
+            return cls(model['weights'], model['biases'])
+        except FileNotFoundError:
+            print(f"Intent model {path} not found; training one from the built-in examples")
+            return cls().train(training_examples())
+        except Exception as e:
+            print(f"Error loading intent model {path}: {str(e)}")
+            return cls().train(training_examples())
+
+
+class IntentRouter:
+    def __init__(self, classifier, threshold=INTENT_CONFIDENCE_THRESHOLD, llm_latency_ms=LLM_ESTIMATED_LATENCY_MS):
+        """Decide per turn whether the deterministic handlers can serve it or the LLM has to"""
+        self.classifier = classifier
+        self.threshold = threshold
+        self.llm_latency_ms = llm_latency_ms
+        self._lock = threading.Lock()
+        self.reset_metrics()
+
+    def route(self, step, text):
+        """The intent of a turn and whether it is served locally; only ambiguous free text goes to the LLM"""
+        started = time.perf_counter()
+        intent, confidence = self.classifier.predict(text)
+        local = step in FREE_TEXT_STEPS or (intent != 'other' and confidence >= self.threshold)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.stats['turns'] += 1
+            self.stats['local' if local else 'escalated'] += 1
+            self.stats['classify_seconds'] += elapsed
+            self.intents[intent] = self.intents.get(intent, 0) + 1
+        return intent, local
+
+    def record_llm_call(self, seconds):
+        """Time an escalated turn spent waiting for the LLM"""
+        with self._lock:
+            self.stats['llm_calls'] += 1
+            self.stats['llm_seconds'] += seconds
+
+    def reset_metrics(self):
+        """Start counting from zero"""
+        with self._lock:
+            self.stats = {'turns': 0, 'local': 0, 'escalated': 0, 'classify_seconds': 0.0,
+                          'llm_calls': 0, 'llm_seconds': 0.0}
+            self.intents = {}
+
+    def get_metrics(self):
+        """Share of turns served locally and the LLM time that saved"""
+        with self._lock:
+            stats = dict(self.stats)
+            intents = dict(self.intents)
+        turns = stats['turns']
+        # Measured LLM latency once there are escalations to time, the configured estimate until then
+        llm_ms = stats['llm_seconds'] * 1000 / stats['llm_calls'] if stats['llm_calls'] else self.llm_latency_ms
+        classify_ms = stats['classify_seconds'] * 1000 / turns if turns else 0.0
+        return {
+            'turns': turns,
+            'local': stats['local'],
+            'escalated': stats['escalated'],
+            'llm_calls': stats['llm_calls'],
+            'local_fraction': round(stats['local'] / turns, 3) if turns else 0.0,
+            'classify_ms_per_turn': round(classify_ms, 4),
+            'llm_ms_per_call': round(llm_ms, 1),
+            'latency_saved_ms': round(stats['local'] * (llm_ms - classify_ms), 1),
+            'intents': intents
+        }
+
+
+# Global intent router instance
+intent_router = IntentRouter(IntentClassifier.load())
+
+
+if __name__ == "__main__":
+    # Rebuild the shipped model file from the built-in examples
+    examples = training_examples()
+    rng = random.Random(1)
+    rng.shuffle(examples)
+    held_out, training = examples[:len(examples) // 5], examples[len(examples) // 5:]
+    print(f"Held-out accuracy: {IntentClassifier().train(training).accuracy(held_out):.3f}")
+    classifier = IntentClassifier().train(examples)
+    classifier.save(os.getenv("INTENT_MODEL_FILE", INTENT_MODEL_FILE))
+    print(f"Training accuracy: {classifier.accuracy(examples):.3f}; saved {INTENT_MODEL_FILE}")
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from langchain.schema import AIMessage
+from langchain_core.messages import AIMessageChunk
+
+from config import LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL_MINUTES, LLM_CACHE_FILE
+from streaming import fragments
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+TRAILING_PUNCTUATION_PATTERN = re.compile(r"[\s.!?]+$")
+
+
+def normalize_prompt(text):
+    """Prompt text with case, runs of whitespace and trailing punctuation ironed out"""
+    text = WHITESPACE_PATTERN.sub(" ", str(text).strip().lower())
+    return TRAILING_PUNCTUATION_PATTERN.sub("", text)
+
+
+def _prompt_text(messages):
+    """One string for a prompt given as text or as a list of chat messages"""
+    if isinstance(messages, str):
+        return normalize_prompt(messages)
+    return "\n".join(f"{getattr(message, 'type', 'human')}: {normalize_prompt(getattr(message, 'content', message))}"
+                     for message in messages)
+
+
+def cache_key(messages, model, temperature):
+    """Cache key of a prompt for one model and temperature"""
+    payload = json.dumps([_prompt_text(messages), str(model), float(temperature or 0)])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class LLMResponseCache:
+    def __init__(self, max_entries=LLM_CACHE_MAX_ENTRIES, ttl_minutes=LLM_CACHE_TTL_MINUTES, db_path=LLM_CACHE_FILE):
+        """LRU of responses in memory backed by a SQLite file"""
+        self.max_entries = max_entries
+        self.ttl = ttl_minutes * 60
+        self.db_path = db_path
+
+        # key -> (response, stored at in epoch seconds), least recently used first
+        self._memory = OrderedDict()
+        self._connection = None
+        self._lock = threading.RLock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'expired': 0}
+
+    def _disk(self):
+        """Connection to the on-disk tier, opened on first use; None when it is off or unavailable"""
+        if self._connection is None and self.db_path:
+            try:
+                directory = os.path.dirname(self.db_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, stored_at REAL)"
+                )
+                # Rows past their TTL are dropped rather than kept until someone asks for them again
+                self._connection.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - self.ttl,))
+                self._connection.commit()
+            except Exception as e:
+                print(f"Error opening LLM cache {self.db_path}: {str(e)}")
+                self.db_path = None
+        return self._connection
+
+    def get(self, key):
+        """Cached response for a key, or None when it is missing or past its TTL"""
+        with self._lock:
+            now = time.time()
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[1] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return entry[0]
+                del self._memory[key]
+                self.stats['expired'] += 1
+
+            connection = self._disk()
+            if connection is not None:
+                row = connection.execute("SELECT response, stored_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    if now - row[1] <= self.ttl:
+                        self._remember(key, row[0], row[1])
+                        self.stats['disk_hits'] += 1
+                        return row[0]
+                    connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    connection.commit()
+                    if entry is None:
+                        self.stats['expired'] += 1
+
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, key, response, persist=True):
+        """Store a response in memory and, unless persist is False, on disk"""
+        with self._lock:
+            stored_at = time.time()
+            self._remember(key, response, stored_at)
+            connection = self._disk() if persist else None
+            if connection is not None:
+                connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, response, stored_at))
+                connection.commit()
+            self.stats['stores'] += 1
+
+    def _remember(self, key, response, stored_at):
+        """Put a response at the recent end of the LRU, dropping the oldest past the cap"""
+        self._memory[key] = (response, stored_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        """Forget every cached response"""
+        with self._lock:
+            self._memory.clear()
+            connection = self._disk()
+            if connection is not None:
+                connection.execute("DELETE FROM responses")
+                connection.commit()
+
+    def get_metrics(self):
+        """Hit, miss and store counters plus the hit rate"""
+        with self._lock:
+            lookups = self.stats['memory_hits'] + self.stats['disk_hits'] + self.stats['misses']
+            hits = self.stats['memory_hits'] + self.stats['disk_hits']
+            return {**self.stats, 'memory_entries': len(self._memory),
+                    'hit_rate': round(hits / lookups, 3) if lookups else 0.0}
+
+
+class CachedChatModel:
+    # Callers pass persist=False for prompts carrying patient details, e.g. a conversation; their responses stay in the
+    # memory tier and are never written to the SQLite file
+
+    def __init__(self, model, cache=None):
+        """Chat model whose responses are looked up in the cache before the model is called"""
+        self.model = model
+        self.cache = cache if cache is not None else LLMResponseCache()
+        self.model_name = getattr(model, 'model_name', getattr(model, 'model', type(model).__name__))
+        self.temperature = getattr(model, 'temperature', 0)
+
+    def invoke(self, messages, persist=True, **kwargs):
+        """Cached AIMessage for a prompt, calling the model only on a miss"""
+        key = cache_key(messages, self.model_name, self.temperature)
+        content = self.cache.get(key)
+        if content is None:
+            content = self.model.invoke(messages, **kwargs).content
+            self.cache.put(key, content, persist)
+        return AIMessage(content=content)
+
+    def stream(self, messages, persist=True, **kwargs):
+        """Response text for a prompt as it arrives: model tokens on a miss, fragments of the cached text on a hit"""
+        key = cache_key(messages, self.model_name, self.temperature)
+        content = self.cache.get(key)
+        if content is not None:
+            yield from fragments(content)
+            return
+
+        tokens = []
+        for chunk in self.model.stream(messages, **kwargs):
+            tokens.append(chunk.content)
+            yield chunk.content
+        self.cache.put(key, "".join(tokens), persist)
+
+
+class FakeChatModel:
+    def __init__(self, model_name="fake-chat", temperature=0, latency=0.0, token_latency=0.0):
+        """Offline stand-in for ChatOpenAI whose reply depends only on the prompt"""
+        self.model_name = model_name
+        self.temperature = temperature
+        # Seconds before the first word, then per word, as a remote model would take
+        self.latency = latency
+        self.token_latency = token_latency
+        self.calls = 0
+
+    def invoke(self, messages, **kwargs):
+        """Deterministic reply naming a digest of the prompt"""
+        return AIMessage(content="".join(chunk.content for chunk in self.stream(messages, **kwargs)))
+
+    def stream(self, messages, **kwargs):
+        """The same reply word by word"""
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        for word in re.findall(r"\S+\s*", self._reply(messages)):
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            yield AIMessageChunk(content=word)
+
+    def _reply(self, messages):
+        """Reply naming a digest of the prompt"""
+        digest = hashlib.sha1(_prompt_text(messages).encode()).hexdigest()[:8]
+        return f"Fake response {digest}"
@@ -0,0 +1,266 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from replay import AGENTS, STAGES, TIMES, StageTimer, _new_agent, _percentile, stand_in_messaging
+
+# Like replay, only the standard library and replay are imported up here: the data directory is chosen before config loads
+
+DOCTOR_REQUESTS = ['dr. johnson', 'dr. chen', 'dr. rodriguez', 'dr. thompson']
+# Share of patients asking for each doctor; the popular ones are where slots run out first
+DOCTOR_WEIGHTS = [0.5, 0.25, 0.15, 0.1]
+# Share of patients picking each of the first offered times; most take the first one
+SLOT_WEIGHTS = [0.6, 0.25, 0.15]
+# The simple agent is answered with a time of day instead; mornings are the most asked for
+TIME_WEIGHTS = [len(TIMES) - index for index in range(len(TIMES))]
+
+
+def _weekday(rng, days):
+    """A weekday within the next days, as MM/DD/YYYY"""
+    date = datetime.now() + timedelta(days=rng.randint(1, days))
+    while date.weekday() >= 5:
+        date += timedelta(days=1)
+    return date.strftime('%m/%d/%Y')
+
+
+def _details(patient):
+    """The message a patient introduces themselves with"""
+    date_of_birth = datetime.strptime(str(patient['date_of_birth'])[:10], '%Y-%m-%d')
+    return (f"my name is {patient['first_name']} {patient['last_name']}, born {date_of_birth.strftime('%m/%d/%Y')}, "
+            f"phone {patient['phone'].replace('+1-', '')}, email {patient['email']}")
+
+
+def build_scripts(count, returning_patients, new_patients, agent_kind='ai', seed=11, new_share=0.4,
+                  earliest_share=0.3, cancel_share=0.1, days=14):
+    """Booking scripts for a mix of new and returning patients with skewed doctor and time preferences"""
+    rng = random.Random(seed)
+    scripts = []
+    for number in range(count):
+        if rng.random() < new_share or not returning_patients:
+            patient = dict(new_patients[number % len(new_patients)])
+            # Keep every new patient distinct from the records on file and from each other
+            patient['last_name'] = f"{patient['last_name']}{number}"
+            patient['email'] = f"{patient['first_name'].lower()}.{patient['last_name'].lower()}@email.com"
+            kind = 'new'
+        else:
+            patient = rng.choice(returning_patients)
+            kind = 'returning'
+
+        earliest = rng.random() < earliest_share
+        turns = [rng.choice(["hello", "hi", "hey"]), _details(patient),
+                 rng.choices(DOCTOR_REQUESTS, weights=DOCTOR_WEIGHTS)[0],
+                 "earliest available" if earliest else _weekday(rng, days)]
+        # Whoever asks for the earliest date takes the first time offered; it may be the only one
+        if agent_kind == 'simple':
+            turns += [TIMES[0] if earliest else rng.choices(TIMES, weights=TIME_WEIGHTS)[0]]
+        else:
+            turns += ["1" if earliest else str(rng.choices(range(1, len(SLOT_WEIGHTS) + 1), weights=SLOT_WEIGHTS)[0]),
+                      str(patient['insurance_carrier']).lower(), str(patient['member_id']), str(patient['group_number'])]
+        turns.append("thanks")
+        scripts.append({'patient': kind, 'date': 'earliest' if earliest else 'explicit',
+                        'cancel': rng.random() < cancel_share, 'turns': turns})
+    return scripts
+
+
+def arrival_offsets(count, rate, seed=11):
+    """Seconds after the start at which each conversation arrives, as a Poisson process of rate per second"""
+    rng = random.Random(seed)
+    offsets, elapsed = [], 0.0
+    for _ in range(count):
+        offsets.append(elapsed)
+        elapsed += rng.expovariate(rate)
+    return offsets
+
+
+def double_bookings(database):
+    """Confirmed appointments whose visits overlap another one with the same doctor"""
+    appointments = database.appointments_df
+    confirmed = appointments[appointments['status'] == 'confirmed']
+    overlaps = 0
+    for _, day in confirmed.groupby(['doctor_name', 'appointment_date']):
+        visits = sorted((datetime.strptime(str(row.appointment_time), '%H:%M'), int(row.duration))
+                        for row in day.itertuples())
+        for (start, duration), (next_start, _) in zip(visits, visits[1:]):
+            if start + timedelta(minutes=duration) > next_start:
+                overlaps += 1
+    return overlaps
+
+
+def _appointment_id(agent_kind, agent):
+    """ID of the appointment a conversation booked, or None"""
+    state = agent.get_state()
+    appointment_info = state['appointment_info'] if agent_kind == 'simple' else state.appointment_info
+    return appointment_info.get('appointment_id')
+
+
+def run_load(scripts, agent_kind, rate, max_in_flight, timer, seed=11):
+    """Start the scripts at a Poisson arrival rate and measure bookings, slot contention and latency"""
+    from database import db
+
+    turn_seconds, conversation_seconds, start_delays = [], [], []
+    stage_seconds = Counter()
+    outcomes = Counter()
+    attempts = Counter()
+    results_lock = threading.Lock()
+    in_flight = {'now': 0, 'peak': 0}
+
+    # Count the booking attempts the database turns away because the slot went to someone else first
+    def counted(function):
+        def booking(*args, **kwargs):
+            result = function(*args, **kwargs)
+            with results_lock:
+                attempts['attempts'] += 1
+                attempts['conflicts'] += result is None
+            return result
+        return booking
+
+    # The AI agent books outright; the simple agent creates a pending appointment
+    originals = {name: getattr(db, name) for name in ('book_appointment', 'create_appointment')}
+    for name, function in originals.items():
+        setattr(db, name, counted(function))
+
+    def run(script, due):
+        try:
+            converse(script, due)
+        except Exception as e:
+            print(f"Error in load conversation: {str(e)}")
+            with results_lock:
+                in_flight['now'] -= 1
+                outcomes['conversations'] += 1
+                outcomes['errors'] += 1
+
+    def converse(script, due):
+        with results_lock:
+            start_delays.append(max(0.0, time.perf_counter() - due))
+            in_flight['now'] += 1
+            in_flight['peak'] = max(in_flight['peak'], in_flight['now'])
+        agent = _new_agent(agent_kind)
+        started = time.perf_counter()
+        for message in script['turns']:
+            timer.start_turn()
+            turn_started = time.perf_counter()
+            agent.process_message(message)
+            elapsed = time.perf_counter() - turn_started
+            stages = timer.finish_turn()
+            with results_lock:
+                turn_seconds.append(elapsed)
+                stage_seconds.update(stages)
+
+        appointment_id = _appointment_id(agent_kind, agent)
+        cancelled = bool(appointment_id and script['cancel'] and db.cancel_appointment(appointment_id))
+        with results_lock:
+            conversation_seconds.append(time.perf_counter() - started)
+            in_flight['now'] -= 1
+            outcomes['conversations'] += 1
+            outcomes[f"{script['patient']}_patients"] += 1
+            outcomes['booked'] += bool(appointment_id)
+            outcomes[f"{script['patient']}_booked"] += bool(appointment_id)
+            outcomes['cancelled'] += cancelled
+
+    offsets = arrival_offsets(len(scripts), rate, seed)
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for script, offset in zip(scripts, offsets):
+                due = started + offset
+                time.sleep(max(0.0, due - time.perf_counter()))
+                executor.submit(run, script, due)
+    finally:
+        for name, function in originals.items():
+            setattr(db, name, function)
+    wall = time.perf_counter() - started
+
+    turns = len(turn_seconds)
+    conversations = outcomes['conversations']
+
+    def milliseconds(values):
+        return {'p50': round(_percentile(values, 50) * 1000, 3), 'p95': round(_percentile(values, 95) * 1000, 3),
+                'p99': round(_percentile(values, 99) * 1000, 3)}
+
+    return {
+        'conversations': conversations,
+        'offered_rate': rate,
+        'achieved_rate': round(conversations / offsets[-1], 2) if len(offsets) > 1 and offsets[-1] else 0.0,
+        'seconds': round(wall, 3),
+        'peak_in_flight': in_flight['peak'],
+        'booked': outcomes['booked'],
+        'booking_success_rate': round(outcomes['booked'] / conversations, 3) if conversations else 0.0,
+        'by_patient': {kind: {'conversations': outcomes[f"{kind}_patients"], 'booked': outcomes[f"{kind}_booked"]}
+                       for kind in ('new', 'returning')},
+        'cancelled': outcomes['cancelled'],
+        'errors': outcomes['errors'],
+        'contention': {
+            'booking_attempts': attempts['attempts'],
+            'slot_conflicts': attempts['conflicts'],
+            'conflict_rate': round(attempts['conflicts'] / attempts['attempts'], 3) if attempts['attempts'] else 0.0,
+            'double_bookings': double_bookings(db)
+        },
+        'turn_latency_ms': milliseconds(turn_seconds),
+        'conversation_latency_ms': milliseconds(conversation_seconds),
+        'start_delay_ms': milliseconds(start_delays),
+        'stage_ms_per_turn': {stage: round(stage_seconds[stage] * 1000 / turns, 3) if turns else 0.0
+                              for stage in STAGES}
+    }
+
+
+def main():
+    """Run synthetic patients through the booking flow at a target arrival rate and print a JSON report"""
+    parser = argparse.ArgumentParser(description="Load the booking flow with synthetic patients")
+    parser.add_argument('--conversations', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=20.0, help="conversations arriving per second")
+    parser.add_argument('--agent', choices=AGENTS, default='ai')
+    parser.add_argument('--max-in-flight', type=int, default=32, help="conversations handled at once")
+    parser.add_argument('--new-share', type=float, default=0.4, help="share of new patients")
+    parser.add_argument('--earliest-share', type=float, default=0.3, help="share asking for the earliest available date")
+    parser.add_argument('--cancel-share', type=float, default=0.1, help="share cancelling after booking")
+    parser.add_argument('--days', type=int, default=14, help="explicit dates fall within this many days")
+    parser.add_argument('--seed', type=int, default=11)
+    parser.add_argument('--comms-latency-ms', type=float, default=20.0, help="latency of the SMTP and SMS stand-ins")
+    parser.add_argument('--data-dir', help="directory to create the sample data in; a temporary one by default")
+    parser.add_argument('--output', help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="load-")
+    os.environ['DATA_DIR'] = data_dir
+
+    # The agents print progress on every turn; keep the report the only output
+    with open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):
+        random.seed(args.seed)
+        from data_generator import create_sample_data, generate_patient_data
+        create_sample_data()
+        from database import db
+
+        scripts = build_scripts(args.conversations, db.patients_df.to_dict('records'),
+                                generate_patient_data(args.conversations).to_dict('records'), args.agent, args.seed,
+                                args.new_share, args.earliest_share, args.cancel_share, args.days)
+
+        timer = StageTimer()
+        timer.instrument()
+        with stand_in_messaging(args.comms_latency_ms / 1000):
+            results = run_load(scripts, args.agent, args.rate, args.max_in_flight, timer, args.seed)
+
+    report = {
+        'agent': args.agent,
+        'mix': {'new_share': args.new_share, 'earliest_share': args.earliest_share,
+                'cancel_share': args.cancel_share, 'doctor_weights': dict(zip(DOCTOR_REQUESTS, DOCTOR_WEIGHTS))},
+        'seed': args.seed,
+        'data_dir': data_dir,
+        **results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import re
+from collections import defaultdict
+
+from config import DOCTORS, SPECIALTY_ALIASES
+
+# Patient details, scanned in one pass; alternatives are tried in this order at each position
+_NAME = r"my name is (?P<name1>\w+) (?P<last1>\w+)|i'm (?P<name2>\w+) (?P<last2>\w+)|i am (?P<name3>\w+) (?P<last3>\w+)"
+_BARE_NAME = r"^(?P<name4>\w+) (?P<last4>\w+)"
+_EMAIL = r"(?P<email>\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b)"
+_DOB = r"(?P<dob>(?P<dob_month>\d{1,2})[/-](?P<dob_day>\d{1,2})[/-](?P<dob_year>\d{4}))"
+_PHONE = r"(?P<phone>(?P<phone10>\d{10})|(?P<area>\d{3})[-.]?(?P<prefix>\d{3})[-.]?(?P<line>\d{4}))"
+
+PATIENT_INFO_PATTERN = re.compile("|".join([_EMAIL, _DOB, _PHONE, _NAME, _BARE_NAME]))
+PATIENT_INFO_PATTERN_NO_BARE_NAME = re.compile("|".join([_EMAIL, _DOB, _PHONE, _NAME]))
+
+# Appointment dates: ISO first, then MM/DD/YYYY and MM/DD/YY
+DATE_PATTERN = re.compile(
+    r"(?P<iso_year>\d{4})[/-](?P<iso_month>\d{1,2})[/-](?P<iso_day>\d{1,2})"
+    r"|(?P<month>\d{1,2})[/-](?P<day>\d{1,2})[/-](?P<year>\d{4}|\d{2})"
+)
+
+# Slot choices: "... at 15:30 - Main Campus", "15:30 - Main Campus" or just "15:30"
+SLOT_AT_PATTERN = re.compile(r"at (\d{1,2}:\d{2}) - (.+)")
+SLOT_PATTERN = re.compile(r"(\d{1,2}:\d{2}) - (.+)")
+TIME_ONLY_PATTERN = re.compile(r"^(\d{1,2}:\d{2})$")
+
+# Words of a doctor-selection message; titles are shared by every doctor and never identify one
+WORD_PATTERN = re.compile(r"[a-z]+")
+TITLE_WORDS = {'dr', 'doctor', 'doc', 'md'}
+
+# How much each matching word counts towards a doctor
+LAST_NAME_WEIGHT = 3
+FIRST_NAME_WEIGHT = 2
+SPECIALTY_WEIGHT = 1
+
+NUMBER_PATTERN = re.compile(r"(\d+)")
+AFFIRMATIVE_PATTERN = re.compile(r"\b(yes|yeah|yep|correct|that's me|that is me)\b")
+
+
+def extract_patient_info(text, bare_name=True):
+    """Name, date of birth, phone and email found in a message, in one scan; the first of each wins"""
+    pattern = PATIENT_INFO_PATTERN if bare_name else PATIENT_INFO_PATTERN_NO_BARE_NAME
+    found = {}
+    for match in pattern.finditer(text):
+        kind = match.lastgroup
+        if match.group('email'):
+            found.setdefault('email', match.group('email'))
+        elif match.group('dob'):
+            found.setdefault('date_of_birth',
+                             f"{match.group('dob_year')}-{match.group('dob_month').zfill(2)}-{match.group('dob_day').zfill(2)}")
+        elif match.group('phone'):
+            if 'phone' not in found:
+                if match.group('phone10'):
+                    digits = match.group('phone10')
+                    found['phone'] = f"+1-{digits[:3]}-{digits[3:6]}-{digits[6:]}"
+                else:
+                    found['phone'] = f"+1-{match.group('area')}-{match.group('prefix')}-{match.group('line')}"
+        elif kind and 'first_name' not in found:
+            # The last group of a name alternative is its last name
+            first_group = 'name' + kind[-1]
+            found['first_name'] = match.group(first_group)
+            found['last_name'] = match.group(kind)
+        if len(found) == 5:
+            break
+    return found
+
+
+def parse_date(text):
+    """First appointment date in a message as 'YYYY-MM-DD', or None"""
+    match = DATE_PATTERN.search(text)
+    if not match:
+        return None
+    if match.group('iso_year'):
+        year, month, day = match.group('iso_year'), match.group('iso_month'), match.group('iso_day')
+    else:
+        year, month, day = match.group('year'), match.group('month'), match.group('day')
+        if len(year) == 2:
+            year = "20" + year
+    return f"{year}-{month.zfill(2)}-{day.zfill(2)}"
+
+
+def first_number(text):
+    """First whole number in a message, or None"""
+    match = NUMBER_PATTERN.search(text)
+    return int(match.group(1)) if match else None
+
+
+def is_affirmative(text):
+    """Whether a message says yes"""
+    return AFFIRMATIVE_PATTERN.search(text) is not None
+
+
+class DoctorResolver:
+    def __init__(self, doctors=DOCTORS, specialty_aliases=SPECIALTY_ALIASES):
+        """Index doctor names, specialties and specialty aliases once"""
+        # word -> {doctor: weight}
+        self.postings = defaultdict(dict)
+        for doctor_name, doctor_info in doctors.items():
+            words = [word for word in WORD_PATTERN.findall(doctor_name.lower()) if word not in TITLE_WORDS]
+            for position, word in enumerate(words):
+                self._post(word, doctor_name, LAST_NAME_WEIGHT if position == len(words) - 1 else FIRST_NAME_WEIGHT)
+            specialty = doctor_info['specialty']
+            for alias in [specialty] + specialty_aliases.get(specialty, []):
+                for word in WORD_PATTERN.findall(alias.lower()):
+                    self._post(word, doctor_name, SPECIALTY_WEIGHT)
+
+    def _post(self, word, doctor_name, weight):
+        """Record that a word points at a doctor, keeping its strongest weight"""
+        postings = self.postings[word]
+        postings[doctor_name] = max(postings.get(doctor_name, 0), weight)
+
+    def resolve(self, text):
+        """Doctors a message refers to as (doctor, score) pairs, best first"""
+        scores = {}
+        for word in set(WORD_PATTERN.findall(text.lower())):
+            for doctor_name, weight in self.postings.get(word, {}).items():
+                scores[doctor_name] = scores.get(doctor_name, 0) + weight
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def match(self, text):
+        """The doctor a message names, or None and the equally good candidates when it is ambiguous"""
+        ranked = self.resolve(text)
+        if not ranked:
+            return None, []
+        best = [doctor_name for doctor_name, score in ranked if score == ranked[0][1]]
+        if len(best) == 1:
+            return best[0], []
+        return None, best
+
+
+# Global doctor resolver instance
+doctor_resolver = DoctorResolver()
@@ -0,0 +1,208 @@
+import heapq
+import re
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+import pandas as pd
+
+# Prefix ranges up to this many entries are scanned fully for an exact count;
+# broader ones (e.g. a single letter) stop once the requested page is filled
+EXHAUSTIVE_SCAN_LIMIT = 20000
+
+# Match quality per query term, lower ranks first
+EXACT_MATCH = 0
+PREFIX_MATCH = 1
+SUBSTRING_MATCH = 2
+
+_NON_DIGITS = re.compile(r"\D")
+_PHONE_LIKE = re.compile(r"^[\d\s().+-]+$")
+
+
+def _clean(value):
+    """Normalize a cell value to a stripped lowercase string"""
+    if value is None or (isinstance(value, float) and pd.isna(value)):
+        return ''
+    return str(value).strip().lower()
+
+
+def _trigrams(token):
+    """All distinct three-character substrings of a token"""
+    return {token[i:i + 3] for i in range(len(token) - 2)}
+
+
+def _normalize_term(term):
+    """Lowercase a query term; phone-like terms are reduced to their digits"""
+    term = term.strip().lower()
+    if _PHONE_LIKE.match(term) and any(char.isdigit() for char in term):
+        return _NON_DIGITS.sub('', term)
+    return term
+
+
+def patient_tokens(record):
+    """Searchable tokens of a patient: ID, names, email and phone digits"""
+    tokens = []
+    for field in ('patient_id', 'first_name', 'last_name', 'email'):
+        value = _clean(record.get(field))
+        if value:
+            tokens.append(value)
+
+    for field in ('phone', 'cell_phone', 'home_phone'):
+        digits = _NON_DIGITS.sub('', _clean(record.get(field)))
+        if digits:
+            # Drop the country code so local numbers match by prefix
+            tokens.append(digits[-10:])
+
+    # Keep order stable while dropping repeats (e.g. identical cell and home phone)
+    return tuple(dict.fromkeys(tokens))
+
+
+class PatientSearchIndex:
+    def __init__(self):
+        """Initialize an empty prefix and trigram index"""
+        self.doc_tokens = {}
+        # Sorted (token, patient_id) pairs: every prefix query is one contiguous range
+        self.prefix_entries = []
+        # Trigram postings for infix matches such as the middle of a phone number
+        self.trigram_postings = defaultdict(set)
+
+    def build(self, patients_df):
+        """Index every patient in a dataframe, replacing the current index"""
+        self.doc_tokens = {}
+        self.trigram_postings = defaultdict(set)
+        entries = []
+        for record in patients_df.to_dict('records'):
+            patient_id = str(record.get('patient_id', '')).strip()
+            if not patient_id:
+                continue
+            tokens = patient_tokens(record)
+            self.doc_tokens[patient_id] = tokens
+            for token in tokens:
+                entries.append((token, patient_id))
+                for trigram in _trigrams(token):
+                    self.trigram_postings[trigram].add(patient_id)
+
+        entries.sort()
+        self.prefix_entries = entries
+
+    def add_patient(self, patient_data):
+        """Add or refresh one patient in the index"""
+        patient_id = str(patient_data.get('patient_id', '')).strip()
+        if not patient_id:
+            return
+
+        if patient_id in self.doc_tokens:
+            self.remove_patient(patient_id)
+
+        tokens = patient_tokens(patient_data)
+        self.doc_tokens[patient_id] = tokens
+        for token in tokens:
+            insort(self.prefix_entries, (token, patient_id))
+            for trigram in _trigrams(token):
+                self.trigram_postings[trigram].add(patient_id)
+
+    def remove_patient(self, patient_id):
+        """Drop a patient from the index"""
+        for token in self.doc_tokens.pop(patient_id, ()):
+            position = bisect_left(self.prefix_entries, (token, patient_id))
+            if position < len(self.prefix_entries) and self.prefix_entries[position] == (token, patient_id):
+                del self.prefix_entries[position]
+            for trigram in _trigrams(token):
+                self.trigram_postings[trigram].discard(patient_id)
+
+    def _prefix_range(self, term):
+        """Start and end positions of the entries whose token starts with term"""
+        start = bisect_left(self.prefix_entries, (term,))
+        end = bisect_left(self.prefix_entries, (term + '\uffff',))
+        return start, end
+
+    def _term_rank(self, term, tokens, allow_substring=False):
+        """Best match quality of a term against a patient's tokens, or None"""
+        best = None
+        for token in tokens:
+            if token == term:
+                return EXACT_MATCH
+            if token.startswith(term):
+                best = PREFIX_MATCH
+            elif allow_substring and best is None and term in token:
+                best = SUBSTRING_MATCH
+        return best
+
+    def _prefix_search(self, terms, wanted):
+        """Patients whose tokens start with every term, scanning the narrowest term's range"""
+        ranges = {term: self._prefix_range(term) for term in terms}
+        lead = min(terms, key=lambda term: ranges[term][1] - ranges[term][0])
+        start, end = ranges[lead]
+        others = [term for term in terms if term != lead]
+        exhaustive = end - start <= EXHAUSTIVE_SCAN_LIMIT
+
+        matches = {}
+        for token, patient_id in self.prefix_entries[start:end] if exhaustive else self._iter_range(start, end):
+            if patient_id in matches:
+                continue
+            rank = EXACT_MATCH if token == lead else PREFIX_MATCH
+            tokens = self.doc_tokens[patient_id]
+            for term in others:
+                term_rank = self._term_rank(term, tokens)
+                if term_rank is None:
+                    break
+                rank += term_rank
+            else:
+                matches[patient_id] = rank
+                if not exhaustive and len(matches) >= wanted:
+                    break
+
+        # A broad scan that stopped early reports its range size as the estimated total
+        total = len(matches) if exhaustive else end - start
+        return matches, total
+
+    def _iter_range(self, start, end):
+        """Iterate a slice of the prefix entries without copying it"""
+        for position in range(start, end):
+            yield self.prefix_entries[position]
+
+    def _substring_search(self, terms):
+        """Patients containing every term anywhere in a token, via trigram intersection"""
+        candidates = None
+        for term in terms:
+            postings = sorted((self.trigram_postings.get(trigram, set()) for trigram in _trigrams(term)), key=len)
+            term_candidates = set(postings[0]) if postings else set()
+            for posting in postings[1:]:
+                term_candidates &= posting
+            candidates = term_candidates if candidates is None else candidates & term_candidates
+            if not candidates:
+                return {}
+
+        matches = {}
+        for patient_id in candidates:
+            tokens = self.doc_tokens[patient_id]
+            rank = 0
+            for term in terms:
+                term_rank = self._term_rank(term, tokens, allow_substring=True)
+                if term_rank is None:
+                    # Trigrams came from different tokens; not a real match
+                    break
+                rank += term_rank
+            else:
+                matches[patient_id] = rank
+        return matches
+
+    def search(self, query, limit=20, offset=0):
+        """Ranked page of patient IDs matching every query term, plus the total match count
+
+        Terms match token prefixes (search-as-you-type); when nothing starts with
+        the query, terms of three or more characters fall back to infix matches.
+        """
+        terms = list(dict.fromkeys(term for term in (_normalize_term(part) for part in str(query).split()) if term))
+        if not terms:
+            return [], 0
+
+        wanted = offset + limit
+        matches, total = self._prefix_search(terms, wanted)
+        if not matches and all(len(term) >= 3 for term in terms):
+            matches = self._substring_search(terms)
+            total = len(matches)
+
+        # Ties keep index order, which puts shorter and alphabetically earlier tokens first
+        order = {patient_id: position for position, patient_id in enumerate(matches)}
+        page = heapq.nsmallest(wanted, matches, key=lambda patient_id: (matches[patient_id], order[patient_id]))
+        return page[offset:], total
@@ -4,6 +4,8 @@ import threading
 from datetime import datetime, timedelta
 from database import db
 from communication import comm_manager
+from appointment_compaction import compactor
+from schedule_horizon import horizon_job
 from config import REMINDER_SCHEDULE
 
 class ReminderSystem:
@@ -33,6 +35,12 @@ class ReminderSystem:
         # Schedule daily reminder check
         schedule.every().day.at("08:00").do(self.check_and_send_reminders)
         
+        # Expire abandoned pending holds and archive old cancellations overnight
+        schedule.every().day.at("02:00").do(compactor.run)
+        
+        # Roll the materialized schedule forward by a day just after midnight
+        schedule.every().day.at("00:05").do(horizon_job.run)
+        
         while self.running:
             schedule.run_pending()
             time.sleep(60)  # Check every minute
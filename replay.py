@@ -0,0 +1,316 @@
+import argparse
+import contextlib
+import functools
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Only the standard library is imported up here: the data directory has to be chosen before config is loaded
+
+AGENTS = ('simple', 'ai')
+STAGES = ('nlu', 'db', 'comms')
+
+FIRST_NAMES = ['alex', 'jordan', 'taylor', 'morgan', 'casey', 'riley', 'jamie', 'avery']
+LAST_NAMES = ['rivera', 'nguyen', 'patel', 'okafor', 'larsen', 'moreau', 'tanaka', 'silva']
+DOCTOR_REQUESTS = ['dr. johnson', 'dr. chen', 'dr. rodriguez', 'dr. thompson']
+TIMES = ['09:00', '09:30', '10:00', '10:30', '11:00', '13:00', '14:00', '15:00', '16:00']
+CARRIERS = ['aetna', 'blue cross', 'cigna', 'united healthcare']
+
+
+class StandInSMTP:
+    """Local stand-in for smtplib.SMTP that only waits as long as a mail server would"""
+    latency = 0.02
+
+    def __init__(self, host=None, port=None):
+        pass
+
+    def starttls(self):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, from_address, to_address, message):
+        time.sleep(self.latency)
+
+    def quit(self):
+        pass
+
+
+class StandInTwilio:
+    """Local stand-in for the Twilio client that only waits as long as the API would"""
+    latency = 0.02
+
+    def __init__(self):
+        self.messages = self
+
+    def create(self, body=None, from_=None, to=None):
+        time.sleep(self.latency)
+
+
+@contextlib.contextmanager
+def stand_in_messaging(latency=0.02):
+    """Send email and SMS to the local stand-ins for the duration of the block"""
+    import communication
+
+    StandInSMTP.latency = StandInTwilio.latency = latency
+    original_smtp, original_twilio = communication.smtplib.SMTP, communication.comm_manager.twilio_client
+    communication.smtplib.SMTP = StandInSMTP
+    communication.comm_manager.twilio_client = StandInTwilio()
+    try:
+        yield
+    finally:
+        communication.smtplib.SMTP = original_smtp
+        communication.comm_manager.twilio_client = original_twilio
+
+
+def synthetic_conversations(count, seed=7):
+    """Booking conversations for both agents: a new patient picks a doctor, a weekday and a time"""
+    rng = random.Random(seed)
+    conversations = []
+    for number in range(count):
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES) + str(number)
+        date = datetime.now() + timedelta(days=rng.randint(1, 14))
+        while date.weekday() >= 5:
+            date += timedelta(days=1)
+        details = (f"my name is {first_name} {last_name}, born {rng.randint(1, 12)}/{rng.randint(1, 28)}/"
+                   f"{rng.randint(1950, 2005)}, phone 555-7{number // 10000 % 10}{number // 1000 % 10}-"
+                   f"{number % 1000:04d}, email {first_name}.{last_name}@example.com")
+        opening = [rng.choice(["hello", "hi", "hey"]), details, rng.choice(DOCTOR_REQUESTS),
+                   date.strftime('%m/%d/%Y')]
+        conversations.append({'agent': 'simple', 'turns': opening + [rng.choice(TIMES), "thanks"]})
+        conversations.append({'agent': 'ai', 'turns': opening + [
+            str(rng.randint(1, 3)), rng.choice(CARRIERS), f"m{rng.randint(100000, 999999)}",
+            f"g{rng.randint(1000, 9999)}", "thanks"
+        ]})
+    return conversations
+
+
+def load_conversations(path):
+    """Conversations from a JSONL file, one {"agent": ..., "turns": [...]} object per line; no agent means both
+
+    A record may also carry "expect", text each reply must contain (null to skip a turn), and "booked", whether the
+    conversation must end with an appointment; replies that differ are reported as mismatches
+    """
+    conversations = []
+    with open(path) as conversations_file:
+        for line in conversations_file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            for agent_kind in ([record['agent']] if record.get('agent') else AGENTS):
+                conversations.append({'agent': agent_kind, 'turns': record['turns'], 'expect': record.get('expect'),
+                                      'booked': record.get('booked')})
+    return conversations
+
+
+class StageTimer:
+    def __init__(self):
+        """Seconds spent per stage within each turn, attributed to the thread running the turn"""
+        self._local = threading.local()
+        # The pandas-backed database is not thread-safe, so concurrent conversations take turns in it
+        self.db_lock = threading.RLock()
+
+    def start_turn(self):
+        """Begin timing a turn on this thread"""
+        self._local.stages = defaultdict(float)
+        self._local.depth = defaultdict(int)
+
+    def finish_turn(self):
+        """Stage seconds of the turn on this thread"""
+        stages, self._local.stages = self._local.stages, None
+        return stages
+
+    def wrap(self, stage, function, lock=None):
+        """function timed under a stage; calls nested in the same stage count once"""
+        timer = self
+
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            stages = getattr(timer._local, 'stages', None)
+            outermost = stages is not None and not timer._local.depth[stage]
+            started = time.perf_counter()
+            if stages is not None:
+                timer._local.depth[stage] += 1
+            try:
+                if lock is None:
+                    return function(*args, **kwargs)
+                with lock:
+                    return function(*args, **kwargs)
+            finally:
+                if stages is not None:
+                    timer._local.depth[stage] -= 1
+                    if outermost:
+                        stages[stage] += time.perf_counter() - started
+
+        return timed
+
+    def instrument(self):
+        """Time the NLU helpers, database calls and message sends the agents make"""
+        import ai_agent
+        import simple_agent
+        from communication import comm_manager
+        from database import db
+        from duplicate_detector import get_patient_matcher
+        from nlu import doctor_resolver
+
+        for module in (simple_agent, ai_agent):
+            for name in ('extract_patient_info', 'parse_date', 'first_number', 'is_affirmative'):
+                setattr(module, name, self.wrap('nlu', getattr(module, name)))
+        doctor_resolver.match = self.wrap('nlu', doctor_resolver.match)
+
+        for name, member in vars(type(db)).items():
+            if callable(member) and not name.startswith('_') and name not in ('subscribe', 'unsubscribe', 'transaction'):
+                setattr(db, name, self.wrap('db', getattr(db, name), self.db_lock))
+        matcher = get_patient_matcher()
+        matcher.find_possible_matches = self.wrap('db', matcher.find_possible_matches, self.db_lock)
+
+        for name in ('send_email', 'send_emails', 'send_sms', 'send_appointment_confirmation', 'send_intake_form'):
+            setattr(comm_manager, name, self.wrap('comms', getattr(comm_manager, name)))
+
+
+def _percentile(values, percent):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def _new_agent(agent_kind):
+    """A fresh agent of a kind"""
+    if agent_kind == 'simple':
+        from simple_agent import SimpleMedicalAgent
+        return SimpleMedicalAgent()
+    from ai_agent import MedicalSchedulingAgent
+    return MedicalSchedulingAgent()
+
+
+def _booked(agent_kind, agent):
+    """Whether a replayed conversation ended with an appointment"""
+    state = agent.get_state()
+    if agent_kind == 'simple':
+        return bool(state['appointment_info'].get('appointment_id'))
+    return bool(state.confirmation_sent)
+
+
+def replay(conversations, agent_kind, concurrency, timer):
+    """Drive every conversation for one agent kind, concurrency at a time; returns the agent's report"""
+    turn_seconds = []
+    stage_seconds = defaultdict(float)
+    bookings = []
+    mismatches = []
+    results_lock = threading.Lock()
+
+    def run(number, conversation):
+        agent = _new_agent(agent_kind)
+        expected_replies = conversation.get('expect') or []
+        found = []
+        for turn, message in enumerate(conversation['turns']):
+            timer.start_turn()
+            started = time.perf_counter()
+            response = agent.process_message(message)
+            elapsed = time.perf_counter() - started
+            stages = timer.finish_turn()
+            with results_lock:
+                turn_seconds.append(elapsed)
+                for stage, seconds in stages.items():
+                    stage_seconds[stage] += seconds
+            expected = expected_replies[turn] if turn < len(expected_replies) else None
+            if expected and expected.lower() not in response.lower():
+                found.append({'conversation': number, 'turn': turn, 'message': message, 'expected': expected,
+                              'response': response})
+
+        booked = _booked(agent_kind, agent)
+        if conversation.get('booked') is not None and conversation['booked'] != booked:
+            found.append({'conversation': number, 'turn': None, 'message': None,
+                          'expected': 'booked' if conversation['booked'] else 'not booked',
+                          'response': 'booked' if booked else 'not booked'})
+        with results_lock:
+            bookings.append(booked)
+            mismatches.extend(found)
+
+    selected = [conversation for conversation in conversations if conversation['agent'] == agent_kind]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run, range(len(selected)), selected))
+    wall = time.perf_counter() - started
+
+    turns = len(turn_seconds)
+    stage_ms = {stage: round(stage_seconds[stage] * 1000 / turns, 3) if turns else 0.0 for stage in STAGES}
+    stage_ms['other'] = round(max(0.0, sum(turn_seconds) * 1000 / turns - sum(stage_ms.values())), 3) if turns else 0.0
+    return {
+        'conversations': len(selected),
+        'bookings': sum(bookings),
+        'turns': turns,
+        'seconds': round(wall, 3),
+        'turns_per_second': round(turns / wall, 1) if wall else 0.0,
+        'latency_ms': {
+            'p50': round(_percentile(turn_seconds, 50) * 1000, 3),
+            'p95': round(_percentile(turn_seconds, 95) * 1000, 3),
+            'p99': round(_percentile(turn_seconds, 99) * 1000, 3),
+            'mean': round(sum(turn_seconds) * 1000 / turns, 3) if turns else 0.0
+        },
+        'stage_ms_per_turn': stage_ms,
+        # Each conversation's mismatches arrive together and in turn order; only the conversations need sorting
+        'mismatches': sorted(mismatches, key=lambda mismatch: mismatch['conversation'])
+    }
+
+
+def main():
+    """Replay conversations against a throwaway data directory and print a JSON report"""
+    parser = argparse.ArgumentParser(description="Replay booking conversations through the agents")
+    parser.add_argument('conversations', nargs='?', help="JSONL file of conversations; synthetic ones if omitted")
+    parser.add_argument('--synthetic', type=int, default=50, help="synthetic conversations per agent")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--agents', default=','.join(AGENTS), help="comma-separated: simple,ai")
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--comms-latency-ms', type=float, default=20.0, help="latency of the SMTP and SMS stand-ins")
+    parser.add_argument('--data-dir', help="directory to copy the sample data into; a temporary one by default")
+    parser.add_argument('--output', help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="replay-")
+    os.environ['DATA_DIR'] = data_dir
+
+    conversations = (load_conversations(args.conversations) if args.conversations
+                     else synthetic_conversations(args.synthetic, args.seed))
+
+    report = {
+        'source': args.conversations or f"synthetic:{args.synthetic}:seed={args.seed}",
+        'concurrency': args.concurrency,
+        'comms_latency_ms': args.comms_latency_ms,
+        'data_dir': data_dir,
+        'agents': {}
+    }
+    # The agents print progress on every turn; keep the report the only output
+    with open(os.devnull, 'w') as quiet, contextlib.redirect_stdout(quiet):
+        from data_generator import create_sample_data
+        create_sample_data()
+
+        timer = StageTimer()
+        timer.instrument()
+        with stand_in_messaging(args.comms_latency_ms / 1000):
+            for agent_kind in args.agents.split(','):
+                report['agents'][agent_kind] = replay(conversations, agent_kind, args.concurrency, timer)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            report_file.write(output + "\n")
+    print(output)
+    # A recorded conversation that no longer gets its expected replies fails the run, e.g. in CI
+    if any(agent_report['mismatches'] for agent_report in report['agents'].values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
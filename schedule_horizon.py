@@ -0,0 +1,46 @@
+import time
+from datetime import datetime, timedelta
+
+from config import SCHEDULE_HORIZON_DAYS
+from database import db
+
+
+class ScheduleHorizonJob:
+    def __init__(self, database, horizon_days=SCHEDULE_HORIZON_DAYS):
+        """Initialize the rolling schedule extension job for a database"""
+        self.database = database
+        self.horizon_days = horizon_days
+        self.last_metrics = None
+
+    def run(self, now=None):
+        """Materialize newly in-horizon days, archive past days and return metrics"""
+        started = time.perf_counter()
+        now = now or datetime.now()
+        today = now.strftime('%Y-%m-%d')
+        horizon_end = (now + timedelta(days=self.horizon_days - 1)).strftime('%Y-%m-%d')
+
+        # Only days past the current end are built; existing bookings are untouched
+        added = self.database.extend_schedule(horizon_end)
+        archived_rows = self.database.archive_schedule_days(today)
+
+        index = self.database.schedule_index
+        metrics = {
+            'run_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'days_added': len(added),
+            'archived_rows': archived_rows,
+            'first_day': index.days[0] if index.days else None,
+            'last_day': index.days[-1] if index.days else None,
+            'duration_seconds': round(time.perf_counter() - started, 3)
+        }
+        self.last_metrics = metrics
+
+        print(f"Schedule horizon: added {len(added)} days, archived {archived_rows} past slots, "
+              f"schedule now {metrics['first_day']} to {metrics['last_day']}")
+        return metrics
+
+
+# Global schedule extension job instance
+horizon_job = ScheduleHorizonJob(db)
+
+if __name__ == "__main__":
+    print(horizon_job.run())
@@ -0,0 +1,481 @@
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from config import DOCTORS, RETURNING_PATIENT_DURATION
+
+# Schedules are stored as rows on a fixed grid of this many minutes
+SLOT_MINUTES = 30
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+
+SCHEDULE_COLUMNS = [
+    'doctor_name', 'specialty', 'location', 'date', 'day_of_week',
+    'time_slot', 'is_available', 'appointment_id'
+]
+
+# Set bits per byte value, for popcounts over uint64 arrays
+_BYTE_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+_GRID_POSITIONS = np.arange(SLOTS_PER_DAY, dtype=np.uint64)
+
+
+def time_to_slot(time_slot):
+    """Grid position of an 'HH:MM' time, e.g. '09:30' -> 19"""
+    hours, minutes = str(time_slot).strip().split(':')[:2]
+    return (int(hours) * 60 + int(minutes)) // SLOT_MINUTES
+
+
+def slot_to_time(position):
+    """'HH:MM' time of a grid position"""
+    minutes = int(position) * SLOT_MINUTES
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def slots_needed(duration):
+    """Number of grid slots a visit of duration minutes occupies"""
+    try:
+        duration = int(duration)
+    except (TypeError, ValueError):
+        duration = RETURNING_PATIENT_DURATION
+    return max(1, -(-duration // SLOT_MINUTES))
+
+
+def covered_times(time_slot, duration):
+    """All 'HH:MM' slots covered by a visit starting at time_slot"""
+    start = time_to_slot(time_slot)
+    return [slot_to_time(position) for position in range(start, start + slots_needed(duration))]
+
+
+def interval_mask(start, length):
+    """Bitmask with length bits set from grid position start"""
+    return ((1 << length) - 1) << start
+
+
+def times_mask(times):
+    """Bitmask of a collection of 'HH:MM' times"""
+    mask = 0
+    for time_slot in times:
+        mask |= 1 << time_to_slot(time_slot)
+    return mask
+
+
+def mask_times(mask):
+    """'HH:MM' times of the set bits of a mask, earliest first"""
+    times = []
+    while mask:
+        lowest = mask & -mask
+        times.append(slot_to_time(lowest.bit_length() - 1))
+        mask ^= lowest
+    return times
+
+
+def _popcount(values):
+    """Number of set bits of every element of a uint64 array"""
+    as_bytes = np.ascontiguousarray(values, dtype=np.uint64).view(np.uint8).reshape(values.shape + (8,))
+    return _BYTE_POPCOUNT[as_bytes].sum(axis=-1, dtype=np.int64)
+
+
+def _lowest_bit_position(values):
+    """Grid position of the lowest set bit of every non-zero element"""
+    lowest = values & (~values + np.uint64(1))
+    return np.log2(lowest.astype(np.float64)).astype(np.int64)
+
+
+def _start_masks(free, duration):
+    """Bits of every start slot where the full duration is free, for an array of free masks"""
+    starts = free.copy()
+    # A start is valid when it and the following slots are all free
+    for offset in range(1, slots_needed(duration)):
+        starts &= free >> np.uint64(offset)
+    return starts
+
+
+class ScheduleIndex:
+    def __init__(self):
+        """Initialize an empty schedule of one bitmap per doctor per day"""
+        self._reset()
+        # Weekly templates answering for days that are not materialized
+        self.virtual = None
+
+    def _reset(self):
+        """Drop every doctor, day and booking"""
+        self.doctors = []
+        self._doctor_ids = {}
+        # Dates kept sorted so day ranges are contiguous columns
+        self.days = []
+        self._day_ids = {}
+
+        self.open_bits = np.zeros((0, 0), dtype=np.uint64)
+        self.booked_bits = np.zeros((0, 0), dtype=np.uint64)
+        self.location_codes = np.zeros((0, 0), dtype=np.int16)
+        self.location_names = []
+        self.specialties = {}
+
+        # appointment_id -> (doctor, date, booked times), so bookings can be released by ID
+        self.bookings = {}
+
+    # The arrays may hold spare columns past the last day, so extending the schedule appends in place; the properties
+    # show only the columns of self.days
+
+    @property
+    def open_bits(self):
+        """[doctor, day] bit per grid slot the doctor works"""
+        return self._open_bits[:, :len(self.days)]
+
+    @open_bits.setter
+    def open_bits(self, value):
+        self._open_bits = value
+
+    @property
+    def booked_bits(self):
+        """[doctor, day] bit per grid slot already booked"""
+        return self._booked_bits[:, :len(self.days)]
+
+    @booked_bits.setter
+    def booked_bits(self, value):
+        self._booked_bits = value
+
+    @property
+    def location_codes(self):
+        """[doctor, day] index into location_names, -1 when the doctor is off"""
+        return self._location_codes[:, :len(self.days)]
+
+    @location_codes.setter
+    def location_codes(self, value):
+        self._location_codes = value
+
+    def _reserve_days(self, count):
+        """Make room for count more days after the last one, doubling the capacity when it runs out"""
+        needed = len(self.days) + count
+        capacity = self._open_bits.shape[1]
+        if needed <= capacity:
+            return
+        spare = max(needed, 2 * capacity) - capacity
+        rows = len(self.doctors)
+        self._open_bits = np.hstack([self._open_bits, np.zeros((rows, spare), dtype=np.uint64)])
+        self._booked_bits = np.hstack([self._booked_bits, np.zeros((rows, spare), dtype=np.uint64)])
+        self._location_codes = np.hstack([self._location_codes, np.full((rows, spare), -1, dtype=np.int16)])
+
+    def memory_bytes(self):
+        """Bytes held by the bitmap arrays"""
+        return self._open_bits.nbytes + self._booked_bits.nbytes + self._location_codes.nbytes
+
+    def build(self, schedules_df):
+        """Index every schedule row, replacing the current bitmaps"""
+        self._reset()
+        if len(schedules_df) == 0:
+            return
+
+        rows = schedules_df.dropna(subset=['doctor_name', 'date', 'time_slot'])
+        dates = rows['date'].astype(str).str[:10]
+        self.doctors = list(pd.unique(rows['doctor_name']))
+        self._doctor_ids = {doctor: position for position, doctor in enumerate(self.doctors)}
+        self.days = sorted(pd.unique(dates))
+        self._day_ids = {date: position for position, date in enumerate(self.days)}
+
+        doctor_index = rows['doctor_name'].map(self._doctor_ids).to_numpy()
+        day_index = dates.map(self._day_ids).to_numpy()
+        time_parts = rows['time_slot'].astype(str).str.strip().str.split(':', expand=True)
+        positions = (time_parts[0].astype(int) * 60 + time_parts[1].astype(int)).to_numpy() // SLOT_MINUTES
+        bits = np.left_shift(np.uint64(1), positions.astype(np.uint64))
+
+        shape = (len(self.doctors), len(self.days))
+        self.open_bits = np.zeros(shape, dtype=np.uint64)
+        self.booked_bits = np.zeros(shape, dtype=np.uint64)
+        np.bitwise_or.at(self.open_bits, (doctor_index, day_index), bits)
+        booked = (rows['is_available'] != True).to_numpy()
+        np.bitwise_or.at(self.booked_bits, (doctor_index[booked], day_index[booked]), bits[booked])
+
+        location_codes, self.location_names = pd.factorize(rows['location'].fillna(''))
+        self.location_names = list(self.location_names)
+        self.location_codes = np.full(shape, -1, dtype=np.int16)
+        self.location_codes[doctor_index, day_index] = location_codes
+
+        if 'specialty' in rows.columns:
+            self.specialties = rows.groupby('doctor_name')['specialty'].first().to_dict()
+
+        if 'appointment_id' in rows.columns:
+            owned = rows[rows['appointment_id'].notna() & (rows['appointment_id'] != '')]
+            for (appointment_id, doctor_name), slots in owned.groupby(['appointment_id', 'doctor_name']):
+                date = str(slots['date'].iloc[0])[:10]
+                self.bookings[appointment_id] = (doctor_name, date, list(slots['time_slot'].astype(str)))
+
+    def _doctor_position(self, doctor_name, create=False):
+        """Row of a doctor, appending an empty one if asked"""
+        position = self._doctor_ids.get(doctor_name)
+        if position is None and create:
+            position = len(self.doctors)
+            self.doctors.append(doctor_name)
+            self._doctor_ids[doctor_name] = position
+            self.open_bits = np.vstack([self.open_bits, np.zeros((1, len(self.days)), dtype=np.uint64)])
+            self.booked_bits = np.vstack([self.booked_bits, np.zeros((1, len(self.days)), dtype=np.uint64)])
+            self.location_codes = np.vstack([self.location_codes, np.full((1, len(self.days)), -1, dtype=np.int16)])
+        return position
+
+    def _day_position(self, date, create=False):
+        """Column of a date, inserting an empty one in date order if asked"""
+        position = self._day_ids.get(date)
+        if position is None and create:
+            position = bisect_left(self.days, date)
+            # Insert the columns before the date, while the properties still cover only the existing days
+            self.open_bits = np.insert(self.open_bits, position, np.uint64(0), axis=1)
+            self.booked_bits = np.insert(self.booked_bits, position, np.uint64(0), axis=1)
+            self.location_codes = np.insert(self.location_codes, position, -1, axis=1)
+            self.days.insert(position, date)
+            self._day_ids = {day: index for index, day in enumerate(self.days)}
+        return position
+
+    def _cell(self, doctor_name, date, create=False):
+        """(row, column) of a doctor's day, or None when it is not scheduled"""
+        doctor_position = self._doctor_position(doctor_name, create)
+        day_position = self._day_position(date, create)
+        if doctor_position is None or day_position is None:
+            return None
+        return doctor_position, day_position
+
+    def _is_virtual(self, date):
+        """Whether a date lies past the materialized days and is answered by the templates"""
+        return self.virtual is not None and (not self.days or date > self.days[-1])
+
+    def mark_booked(self, doctor_name, date, times, appointment_id=None):
+        """Record slots as taken, optionally by an appointment"""
+        if self._is_virtual(date):
+            self.virtual.mark_booked(doctor_name, date, times)
+        else:
+            cell = self._cell(doctor_name, date, create=True)
+            self.booked_bits[cell] |= np.uint64(times_mask(times))
+        if appointment_id is not None:
+            self.bookings[appointment_id] = (doctor_name, date, list(times))
+
+    def mark_free(self, doctor_name, date, times):
+        """Record slots as free again"""
+        if self._is_virtual(date):
+            self.virtual.mark_free(doctor_name, date, times)
+            return
+        cell = self._cell(doctor_name, date)
+        if cell is not None:
+            self.booked_bits[cell] &= ~np.uint64(times_mask(times))
+
+    def release(self, appointment_id):
+        """Free the slots booked by an appointment; returns the number of slots freed"""
+        booking = self.bookings.pop(appointment_id, None)
+        if booking is None:
+            return 0
+        doctor_name, date, times = booking
+        self.mark_free(doctor_name, date, times)
+        return len(times)
+
+    def apply_exception(self, doctor_name, date, kind, times=None):
+        """Close, block or open extra slots on a materialized day; returns whether the day is materialized"""
+        cell = self._cell(doctor_name, date)
+        if cell is None:
+            return False
+        mask = np.uint64(times_mask(times or []))
+        if kind == 'closed':
+            self.open_bits[cell] = 0
+        elif kind == 'blocked':
+            self.open_bits[cell] &= ~mask
+        else:
+            self.open_bits[cell] |= mask
+        return True
+
+    def _free_mask(self, doctor_name, date, blocked_times=()):
+        """Bits of the slots that are open and neither booked nor blocked"""
+        if self._is_virtual(date):
+            free = self.virtual.free_mask(doctor_name, date)
+        else:
+            cell = self._cell(doctor_name, date)
+            if cell is None:
+                return 0
+            free = int(self.open_bits[cell]) & ~int(self.booked_bits[cell])
+        if blocked_times:
+            free &= ~times_mask(blocked_times)
+        return free
+
+    def fits(self, doctor_name, date, time_slot, duration, blocked_times=()):
+        """Whether a visit of duration minutes can start at time_slot"""
+        wanted = interval_mask(time_to_slot(time_slot), slots_needed(duration))
+        return (self._free_mask(doctor_name, date, blocked_times) & wanted) == wanted
+
+    def start_mask(self, doctor_name, date, duration, blocked_times=()):
+        """Bits of every start slot where the full duration is free"""
+        free = self._free_mask(doctor_name, date, blocked_times)
+        starts = free
+        for offset in range(1, slots_needed(duration)):
+            starts &= free >> offset
+        return starts
+
+    def available_slots(self, doctor_name, date, duration=RETURNING_PATIENT_DURATION, blocked_times=()):
+        """Start times where the full duration fits, as time_slot/location records"""
+        starts = self.start_mask(doctor_name, date, duration, blocked_times)
+        if not starts:
+            return []
+        if self._is_virtual(date):
+            location = self.virtual.locations.get(doctor_name)
+        else:
+            location_code = self.location_codes[self._cell(doctor_name, date)]
+            location = self.location_names[location_code] if location_code >= 0 else None
+        return [{'time_slot': time_slot, 'location': location} for time_slot in mask_times(starts)]
+
+    def _day_range(self, start_date=None, end_date=None):
+        """Column slice of the dates between start_date and end_date inclusive"""
+        start = bisect_left(self.days, start_date) if start_date else 0
+        end = bisect_left(self.days, end_date + '\uffff') if end_date else len(self.days)
+        return slice(start, end)
+
+    def availability(self, duration=RETURNING_PATIENT_DURATION, start_date=None, end_date=None):
+        """[doctor, day] masks of every start slot where the full duration fits"""
+        days = self._day_range(start_date, end_date)
+        free = self.open_bits[:, days] & ~self.booked_bits[:, days]
+        return _start_masks(free, duration)
+
+    def first_fit(self, duration=RETURNING_PATIENT_DURATION, doctor_names=None, start_date=None, end_date=None):
+        """Earliest date and start time where the visit fits, for every doctor at once"""
+        doctor_names = self.doctors if doctor_names is None else doctor_names
+        days = self._day_range(start_date, end_date)
+        if days.start >= days.stop:
+            return {doctor_name: None for doctor_name in doctor_names}
+
+        starts = self.availability(duration, start_date, end_date)
+        has_start = starts != 0
+        first_day = has_start.argmax(axis=1)
+        first_mask = starts[np.arange(len(self.doctors)), first_day]
+        first_position = np.where(first_mask != 0, _lowest_bit_position(first_mask), -1)
+
+        results = {}
+        for doctor_name in doctor_names:
+            position = self._doctor_ids.get(doctor_name)
+            if position is None or not has_start[position].any():
+                results[doctor_name] = None
+                continue
+            results[doctor_name] = {
+                'date': self.days[days.start + int(first_day[position])],
+                'time_slot': slot_to_time(first_position[position])
+            }
+        return results
+
+    def utilization(self, start_date=None, end_date=None):
+        """Open slots, booked slots and the booked share per doctor over a date range"""
+        days = self._day_range(start_date, end_date)
+        open_counts = _popcount(self.open_bits[:, days]).sum(axis=1)
+        booked_counts = _popcount(self.open_bits[:, days] & self.booked_bits[:, days]).sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = np.where(open_counts > 0, booked_counts / np.maximum(open_counts, 1), 0.0)
+        return pd.DataFrame({
+            'doctor_name': self.doctors,
+            'open_slots': open_counts,
+            'booked_slots': booked_counts,
+            'utilization': np.round(share, 3)
+        })
+
+    def occupancy(self, start_date=None, end_date=None):
+        """Open, booked and free slot counts per doctor per day, one row per doctor and date"""
+        days = self._day_range(start_date, end_date)
+        open_counts = _popcount(self.open_bits[:, days])
+        booked_counts = _popcount(self.open_bits[:, days] & self.booked_bits[:, days])
+        dates = self.days[days]
+        return pd.DataFrame({
+            'doctor_name': np.repeat(self.doctors, len(dates)),
+            'date': np.tile(dates, len(self.doctors)),
+            'open_slots': open_counts.ravel(),
+            'booked_slots': booked_counts.ravel(),
+            'free_slots': (open_counts - booked_counts).ravel()
+        })
+
+    def to_dataframe(self, start_date=None, end_date=None):
+        """One row per scheduled slot, in the layout of the schedule Excel file"""
+        days = self._day_range(start_date, end_date)
+        if not self.doctors or days.start >= days.stop:
+            return pd.DataFrame(columns=SCHEDULE_COLUMNS)
+
+        open_grid = (self.open_bits[:, days, None] >> _GRID_POSITIONS) & np.uint64(1)
+        booked_grid = (self.booked_bits[:, days, None] >> _GRID_POSITIONS) & np.uint64(1)
+        doctor_index, day_index, positions = np.nonzero(open_grid)
+        # Same order as the generated file: by date, then doctor, then time
+        order = np.lexsort((positions, doctor_index, day_index))
+        doctor_index, day_index, positions = doctor_index[order], day_index[order], positions[order]
+
+        doctor_names = np.array(self.doctors, dtype=object)[doctor_index]
+        dates = np.array(self.days[days], dtype=object)[day_index]
+        location_names = np.array(self.location_names + [None], dtype=object)
+        times = np.array([slot_to_time(position) for position in range(SLOTS_PER_DAY)], dtype=object)
+        day_names = pd.to_datetime(pd.Series(self.days[days])).dt.day_name().to_numpy(dtype=object)
+
+        owners = {}
+        for appointment_id, (doctor_name, date, booked_times) in self.bookings.items():
+            for time_slot in booked_times:
+                owners[(doctor_name, date, time_slot)] = appointment_id
+
+        schedule = pd.DataFrame({
+            'doctor_name': doctor_names,
+            'specialty': [self.specialties.get(name, DOCTORS.get(name, {}).get('specialty')) for name in doctor_names],
+            'location': location_names[self.location_codes[:, days][doctor_index, day_index]],
+            'date': dates,
+            'day_of_week': day_names[day_index],
+            'time_slot': times[positions],
+            'is_available': booked_grid[doctor_index, day_index, positions] == 0,
+        })
+        schedule['appointment_id'] = [
+            owners.get(key) for key in zip(schedule['doctor_name'], schedule['date'], schedule['time_slot'])
+        ]
+        return schedule
+
+    def extend_through(self, end_date, start_date=None):
+        """Materialize the days after the last one up to end_date from the templates; returns the dates added"""
+        if self.virtual is None:
+            return []
+        if self.days:
+            current = datetime.strptime(self.days[-1], '%Y-%m-%d') + timedelta(days=1)
+        else:
+            current = datetime.strptime(start_date or end_date, '%Y-%m-%d')
+        last = datetime.strptime(end_date, '%Y-%m-%d')
+
+        for doctor_name in self.virtual.templates:
+            self._doctor_position(doctor_name, create=True)
+
+        added = []
+        while current <= last:
+            added.append(current.strftime('%Y-%m-%d'))
+            current += timedelta(days=1)
+        self._reserve_days(len(added))
+
+        # Days only ever grow at the end, so each one fills the next spare column and the columns stay in date order
+        for date in added:
+            column = len(self.days)
+            for position, doctor_name in enumerate(self.doctors):
+                open_mask = self.virtual.open_mask(doctor_name, date)
+                if not open_mask:
+                    continue
+                self._open_bits[position, column] = open_mask
+                # Bookings made while the day was virtual move into the bitmap
+                self._booked_bits[position, column] = self.virtual.booked.pop((doctor_name, date), 0)
+                self._location_codes[position, column] = self._location_code(self.virtual.locations.get(doctor_name))
+            self._day_ids[date] = column
+            self.days.append(date)
+        return added
+
+    def _location_code(self, location):
+        """Index of a location name, adding it if new"""
+        if location not in self.location_names:
+            self.location_names.append(location)
+        return self.location_names.index(location)
+
+    def drop_days_before(self, date):
+        """Remove the days before date; returns their slot rows for archiving"""
+        cut = bisect_left(self.days, date)
+        if cut == 0:
+            return pd.DataFrame(columns=SCHEDULE_COLUMNS)
+
+        dropped = self.to_dataframe(end_date=self.days[cut - 1])
+        dropped_days = set(self.days[:cut])
+        self.open_bits = self.open_bits[:, cut:].copy()
+        self.booked_bits = self.booked_bits[:, cut:].copy()
+        self.location_codes = self.location_codes[:, cut:].copy()
+        self.days = self.days[cut:]
+        self._day_ids = {day: index for index, day in enumerate(self.days)}
+        self.bookings = {
+            appointment_id: booking for appointment_id, booking in self.bookings.items()
+            if booking[1] not in dropped_days
+        }
+        return dropped
@@ -0,0 +1,155 @@
+import os
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from config import DOCTORS, WORKING_HOURS, BREAK_TIME
+from schedule_index import (SLOT_MINUTES, SCHEDULE_COLUMNS, time_to_slot, interval_mask, times_mask, mask_times,
+                            slots_needed)
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Kinds of one-off changes to a doctor's weekly template
+EXCEPTION_KINDS = ('closed', 'blocked', 'extra')
+EXCEPTION_COLUMNS = ['doctor_name', 'date', 'kind', 'time_slot', 'location']
+
+
+def _hours_mask(start, end):
+    """Bits of the grid slots from start up to (not including) end"""
+    first = time_to_slot(start)
+    return interval_mask(first, time_to_slot(end) - first)
+
+
+def working_hours_mask(working_hours=WORKING_HOURS, break_time=BREAK_TIME):
+    """Bits of a working day: the working hours minus the break"""
+    mask = _hours_mask(working_hours['start'], working_hours['end'])
+    if break_time:
+        break_start, break_end = break_time.split('-')
+        mask &= ~_hours_mask(break_start, break_end)
+    return mask
+
+
+class VirtualSchedule:
+    def __init__(self, doctors=DOCTORS, working_hours=WORKING_HOURS, break_time=BREAK_TIME):
+        """Weekly templates per doctor; days are computed on demand instead of stored"""
+        day_mask = working_hours_mask(working_hours, break_time)
+        # doctor -> weekday number -> bits of the slots worked that weekday
+        self.templates = {
+            doctor_name: {WEEKDAYS.index(day): day_mask for day in doctor_info['available_days']}
+            for doctor_name, doctor_info in doctors.items()
+        }
+        self.locations = {doctor_name: doctor_info['location'] for doctor_name, doctor_info in doctors.items()}
+        self.specialties = {doctor_name: doctor_info['specialty'] for doctor_name, doctor_info in doctors.items()}
+
+        # Exceptions and bookings are sparse: (doctor, date) keys exist only for changed days
+        self.closed = set()
+        self.blocked = {}
+        self.extra = {}
+        self.booked = {}
+
+    def open_mask(self, doctor_name, date):
+        """Bits of the slots a doctor works on a date after applying exceptions"""
+        key = (doctor_name, date)
+        if key in self.closed:
+            mask = 0
+        else:
+            weekday = datetime.strptime(date, '%Y-%m-%d').weekday()
+            mask = self.templates.get(doctor_name, {}).get(weekday, 0) & ~self.blocked.get(key, 0)
+        return mask | self.extra.get(key, 0)
+
+    def free_mask(self, doctor_name, date):
+        """Bits of the open slots not yet booked"""
+        return self.open_mask(doctor_name, date) & ~self.booked.get((doctor_name, date), 0)
+
+    def mark_booked(self, doctor_name, date, times):
+        """Record slots as taken"""
+        key = (doctor_name, date)
+        self.booked[key] = self.booked.get(key, 0) | times_mask(times)
+
+    def mark_free(self, doctor_name, date, times):
+        """Record slots as free again, forgetting days with no bookings left"""
+        key = (doctor_name, date)
+        if key in self.booked:
+            self.booked[key] &= ~times_mask(times)
+            if not self.booked[key]:
+                del self.booked[key]
+
+    def add_exception(self, doctor_name, date, kind, times=None):
+        """Close a day, block some of its slots, or open extra slots"""
+        if kind not in EXCEPTION_KINDS:
+            raise ValueError(f"Unknown schedule exception: {kind}")
+        key = (doctor_name, date)
+        if kind == 'closed':
+            self.closed.add(key)
+        elif kind == 'blocked':
+            self.blocked[key] = self.blocked.get(key, 0) | times_mask(times or [])
+        else:
+            self.extra[key] = self.extra.get(key, 0) | times_mask(times or [])
+
+    def load_exceptions(self, exceptions_file):
+        """Apply the exceptions saved in a CSV file, if it exists"""
+        if not os.path.exists(exceptions_file):
+            return
+        exceptions_df = pd.read_csv(exceptions_file, dtype=str)
+        for exception in exceptions_df.to_dict('records'):
+            time_slot = exception.get('time_slot')
+            times = [time_slot] if isinstance(time_slot, str) and time_slot else None
+            self.add_exception(exception['doctor_name'], exception['date'], exception['kind'], times)
+
+    def exceptions_dataframe(self):
+        """All exceptions as rows, in the layout of the exceptions CSV"""
+        rows = [
+            {'doctor_name': doctor_name, 'date': date, 'kind': 'closed', 'time_slot': None, 'location': None}
+            for doctor_name, date in sorted(self.closed)
+        ]
+        for kind, masks in (('blocked', self.blocked), ('extra', self.extra)):
+            for (doctor_name, date), mask in sorted(masks.items()):
+                rows.extend(
+                    {'doctor_name': doctor_name, 'date': date, 'kind': kind, 'time_slot': time_slot,
+                     'location': self.locations.get(doctor_name)}
+                    for time_slot in mask_times(mask)
+                )
+        return pd.DataFrame(rows, columns=EXCEPTION_COLUMNS)
+
+    def free_slots(self, doctor_name, start_date, end_date, duration=SLOT_MINUTES):
+        """Yield (date, start time) for every start where the visit fits, lazily over the date range"""
+        needed = slots_needed(duration)
+        current = datetime.strptime(start_date, '%Y-%m-%d')
+        last = datetime.strptime(end_date, '%Y-%m-%d')
+        while current <= last:
+            date = current.strftime('%Y-%m-%d')
+            free = self.free_mask(doctor_name, date)
+            starts = free
+            for offset in range(1, needed):
+                starts &= free >> offset
+            for time_slot in mask_times(starts):
+                yield date, time_slot
+            current += timedelta(days=1)
+
+    def day_rows(self, date, doctor_names=None):
+        """Schedule rows of one date, in the layout of the schedule Excel file"""
+        day_name = datetime.strptime(date, '%Y-%m-%d').strftime('%A')
+        rows = []
+        for doctor_name in doctor_names or self.templates:
+            open_mask = self.open_mask(doctor_name, date)
+            booked = self.booked.get((doctor_name, date), 0)
+            for time_slot in mask_times(open_mask):
+                rows.append({
+                    'doctor_name': doctor_name,
+                    'specialty': self.specialties.get(doctor_name),
+                    'location': self.locations.get(doctor_name),
+                    'date': date,
+                    'day_of_week': day_name,
+                    'time_slot': time_slot,
+                    'is_available': not booked & (1 << time_to_slot(time_slot)),
+                    'appointment_id': None
+                })
+        return rows
+
+    def materialize(self, start_date, days):
+        """Schedule rows for a run of days, e.g. to seed or extend the schedule file"""
+        rows = []
+        for day_offset in range(days):
+            date = (start_date + timedelta(days=day_offset)).strftime('%Y-%m-%d')
+            rows.extend(self.day_rows(date))
+        return pd.DataFrame(rows, columns=SCHEDULE_COLUMNS)
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from config import SESSION_MAX_SESSIONS, SESSION_IDLE_TTL_MINUTES, SESSION_MAX_MEMORY_MB, SESSION_SPILL_DIR
+
+
+class SessionManager:
+    def __init__(self, state_factory, max_sessions=SESSION_MAX_SESSIONS, idle_ttl_minutes=SESSION_IDLE_TTL_MINUTES,
+                 max_memory_mb=SESSION_MAX_MEMORY_MB, spill_dir=SESSION_SPILL_DIR):
+        """Keep one conversation state per session id, least recently used first"""
+        self.state_factory = state_factory
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl_minutes * 60
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        # Sessions pushed out by the caps are pickled here and reloaded on their next message; None drops them
+        self.spill_dir = spill_dir
+
+        # session_id -> [state, last used (monotonic seconds), pickled size]
+        self._sessions = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.RLock()
+        self.stats = {'created': 0, 'expired': 0, 'spilled': 0, 'reloaded': 0, 'dropped': 0}
+
+    def _spill_path(self, session_id):
+        """File a session is spilled to; ids are hashed so any string is safe"""
+        return os.path.join(self.spill_dir, hashlib.sha1(str(session_id).encode()).hexdigest() + '.pkl')
+
+    def get(self, session_id):
+        """State of a session, reloaded from disk or newly created if it is not in memory"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                entry[1] = time.monotonic()
+                self._sessions.move_to_end(session_id)
+                return entry[0]
+
+            state = self._load_spilled(session_id)
+            if state is None:
+                state = self.state_factory()
+                self.stats['created'] += 1
+            self.put(session_id, state)
+            return state
+
+    def put(self, session_id, state):
+        """Store or refresh a session's state, then apply the TTL and the caps"""
+        with self._lock:
+            size = len(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+            previous = self._sessions.pop(session_id, None)
+            if previous is not None:
+                self._memory_bytes -= previous[2]
+            self._sessions[session_id] = [state, time.monotonic(), size]
+            self._memory_bytes += size
+            self._evict(keep=session_id)
+
+    def drop(self, session_id):
+        """Forget a session, in memory and on disk"""
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+            if entry is not None:
+                self._memory_bytes -= entry[2]
+            if self.spill_dir and os.path.exists(self._spill_path(session_id)):
+                os.remove(self._spill_path(session_id))
+
+    def _evict(self, keep=None):
+        """Drop idle sessions, then spill the least recently used while over a cap"""
+        now = time.monotonic()
+        # Entries are in last-used order, so idle ones are at the front
+        while self._sessions:
+            session_id, entry = next(iter(self._sessions.items()))
+            if session_id == keep or now - entry[1] <= self.idle_ttl:
+                break
+            self._sessions.popitem(last=False)
+            self._memory_bytes -= entry[2]
+            self.stats['expired'] += 1
+
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or
+                                           self._memory_bytes > self.max_memory_bytes):
+            session_id, entry = self._sessions.popitem(last=False)
+            if session_id == keep:
+                self._sessions[session_id] = entry
+                continue
+            self._memory_bytes -= entry[2]
+            self._spill(session_id, entry[0])
+
+    def _spill(self, session_id, state):
+        """Write an evicted session to disk, or drop it when spilling is off"""
+        if not self.spill_dir:
+            self.stats['dropped'] += 1
+            return
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(self._spill_path(session_id), 'wb') as spill_file:
+                pickle.dump(state, spill_file, protocol=pickle.HIGHEST_PROTOCOL)
+            self.stats['spilled'] += 1
+        except Exception as e:
+            print(f"Error spilling session {session_id}: {str(e)}")
+            self.stats['dropped'] += 1
+
+    def _load_spilled(self, session_id):
+        """State spilled by an earlier eviction, unless it has been idle past the TTL"""
+        if not self.spill_dir:
+            return None
+        path = self._spill_path(session_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            idle = time.time() - os.path.getmtime(path)
+            state = None
+            if idle <= self.idle_ttl:
+                with open(path, 'rb') as spill_file:
+                    state = pickle.load(spill_file)
+                self.stats['reloaded'] += 1
+            os.remove(path)
+            return state
+        except Exception as e:
+            print(f"Error reloading session {session_id}: {str(e)}")
+            return None
+
+    def __len__(self):
+        """Number of sessions held in memory"""
+        return len(self._sessions)
+
+    def get_metrics(self):
+        """Sessions and bytes held in memory, plus eviction counters"""
+        with self._lock:
+            return {'sessions': len(self._sessions), 'memory_bytes': self._memory_bytes, **self.stats}
@@ -1,24 +1,77 @@
-import re
 import json
 from datetime import datetime, timedelta
 from typing import Dict, List, Any
 
 from config import DOCTORS, NEW_PATIENT_DURATION, RETURNING_PATIENT_DURATION
 from database import db
+from duplicate_detector import get_patient_matcher
+from waitlist import waitlist
+from nlu import (extract_patient_info, parse_date, first_number, doctor_resolver, SLOT_AT_PATTERN,
+                 SLOT_PATTERN, TIME_ONLY_PATTERN)
+from session_manager import SessionManager
+from streaming import stream_in_worker
+from availability_cache import AvailabilityCache
+
+def new_conversation_state() -> Dict[str, Any]:
+    """State of a conversation that has not started yet"""
+    return {
+        "step": "greeting",
+        "patient_info": {},
+        "appointment_info": {},
+        "available_slots": [],
+        "insurance_info": {}
+    }
+
+# Conversation state per chat session, so concurrent patients never share one
+sessions = SessionManager(new_conversation_state)
 
 class SimpleMedicalAgent:
-    def __init__(self):
-        """Initialize the simple medical scheduling agent"""
-        self.conversation_state = {
-            "step": "greeting",
-            "patient_info": {},
-            "appointment_info": {},
-            "available_slots": [],
-            "insurance_info": {}
-        }
+    def __init__(self, session_id=None, availability=None):
+        """Initialize the simple medical scheduling agent, optionally bound to a chat session"""
+        self.session_id = session_id
+        # Availability lookups memoized for this conversation; pass one in to share it across agent instances
+        self.availability = availability or AvailabilityCache()
+        # Set while process_message_stream runs; handlers send fragments that are ready before slow work through it
+        self._write = None
+        if session_id is None:
+            self.conversation_state = new_conversation_state()
+        else:
+            self.conversation_state = sessions.get(session_id)
+    
+    def get_state(self) -> Dict[str, Any]:
+        """The conversation state, e.g. to store it elsewhere"""
+        return self.conversation_state
+    
+    def load_state(self, state: Dict[str, Any]):
+        """Continue a conversation from a stored state"""
+        self.conversation_state = state
     
     def process_message(self, user_message: str) -> str:
         """Process a user message and return the agent's response"""
+        try:
+            return self._process_message(user_message)
+        finally:
+            if self.session_id is not None:
+                sessions.put(self.session_id, self.conversation_state)
+    
+    def process_message_stream(self, user_message: str):
+        """Process a user message, yielding the response in fragments as soon as each is ready"""
+        def run(write):
+            self._write = write
+            try:
+                return self.process_message(user_message)
+            finally:
+                self._write = None
+        
+        yield from stream_in_worker(run)
+    
+    def _say(self, fragment: str):
+        """Stream the start of a response before the work that finishes it"""
+        if self._write is not None:
+            self._write(fragment)
+    
+    def _process_message(self, user_message: str) -> str:
+        """Route a message to the handler of the current step"""
         try:
             user_input = user_message.lower().strip()
             
@@ -30,6 +83,9 @@ class SimpleMedicalAgent:
             elif self.conversation_state["step"] == "collecting_patient_info":
                 return self._handle_patient_info(user_input)
             
+            elif self.conversation_state["step"] == "confirm_identity":
+                return self._handle_identity_confirmation(user_input)
+            
             elif self.conversation_state["step"] == "select_doctor":
                 return self._handle_doctor_selection(user_input)
             
@@ -71,40 +127,8 @@ Once I have this information, I can check if you're an existing patient or help
     
     def _handle_patient_info(self, user_input: str) -> str:
         """Handle patient information collection"""
-        # Extract patient information using regex patterns
-        name_pattern = r"my name is (\w+) (\w+)|i'm (\w+) (\w+)|i am (\w+) (\w+)|^(\w+) (\w+)"
-        dob_pattern = r"(\d{1,2})[/-](\d{1,2})[/-](\d{4})"
-        phone_pattern = r"(\d{10})|(\d{3})[-.]?(\d{3})[-.]?(\d{4})"
-        email_pattern = r"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b"
-        
-        # Extract information
-        name_match = re.search(name_pattern, user_input)
-        dob_match = re.search(dob_pattern, user_input)
-        phone_match = re.search(phone_pattern, user_input)
-        email_match = re.search(email_pattern, user_input)
-        
-        if name_match:
-            groups = name_match.groups()
-            # Find the first non-None pair of groups
-            for i in range(0, len(groups), 2):
-                if i+1 < len(groups) and groups[i] and groups[i+1]:
-                    self.conversation_state["patient_info"]['first_name'] = groups[i]
-                    self.conversation_state["patient_info"]['last_name'] = groups[i+1]
-                    break
-        
-        if dob_match:
-            month, day, year = dob_match.groups()
-            self.conversation_state["patient_info"]['date_of_birth'] = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-        
-        if phone_match:
-            if phone_match.group(1):  # 10-digit format
-                phone = phone_match.group(1)
-                self.conversation_state["patient_info"]['phone'] = f"+1-{phone[:3]}-{phone[3:6]}-{phone[6:]}"
-            else:  # 3-3-4 format
-                self.conversation_state["patient_info"]['phone'] = f"+1-{phone_match.group(2)}-{phone_match.group(3)}-{phone_match.group(4)}"
-        
-        if email_match:
-            self.conversation_state["patient_info"]['email'] = email_match.group(0)
+        # Extract patient information in one scan of the message
+        self.conversation_state["patient_info"].update(extract_patient_info(user_input))
         
         # Check if we have all required information
         required_fields = ['first_name', 'last_name', 'date_of_birth', 'phone', 'email']
@@ -142,6 +166,24 @@ Once I have this information, I can check if you're an existing patient or help
                 response += "\nWhich doctor would you prefer to see?"
                 self.conversation_state["step"] = "select_doctor"
             else:
+                # No exact match - check for a likely typo of an existing record
+                possible_matches = get_patient_matcher().find_possible_matches(
+                    first_name=self.conversation_state["patient_info"]['first_name'],
+                    last_name=self.conversation_state["patient_info"]['last_name'],
+                    date_of_birth=self.conversation_state["patient_info"]['date_of_birth'],
+                    phone=self.conversation_state["patient_info"]['phone'],
+                    email=self.conversation_state["patient_info"]['email']
+                )
+                
+                if possible_matches:
+                    # Another patient's details must not be shown, so the patient proves the match instead
+                    self.conversation_state["possible_match"] = possible_matches[0]['patient_id']
+                    self.conversation_state["step"] = "confirm_identity"
+                    
+                    return ("I couldn't find an exact match for that name, but you may already have a record with us. "
+                            "To confirm it's you, please reply with the date of birth (MM/DD/YYYY) or phone number "
+                            "we have on file for you, or say 'no' to register as a new patient.")
+                
                 # New patient
                 response = f"Thank you, {self.conversation_state['patient_info']['first_name']}! I don't see you in our system, so I'll register you as a new patient.\n\n"
                 response += "Now I need to know which doctor you'd like to see. Here are our available doctors:\n"
@@ -154,26 +196,33 @@ Once I have this information, I can check if you're an existing patient or help
             
             return response
     
+    def _handle_identity_confirmation(self, user_input: str) -> str:
+        """Handle confirmation of a possible duplicate patient record"""
+        patient_id = self.conversation_state.pop("possible_match", None)
+        # Compare what the patient gave with the stored record; the record itself is never shown
+        given = extract_patient_info(user_input, bare_name=False)
+        
+        if patient_id and get_patient_matcher().confirms_identity(patient_id, given.get('date_of_birth'), given.get('phone')):
+            # Use the existing record instead of registering a duplicate
+            self.conversation_state["patient_info"]['patient_id'] = patient_id
+            self.conversation_state["patient_info"]['is_new_patient'] = False
+            response = f"Welcome back, {self.conversation_state['patient_info']['first_name']}! I've linked you to your existing record.\n\n"
+        else:
+            response = f"Thank you, {self.conversation_state['patient_info']['first_name']}! I'll register you as a new patient.\n\n"
+        
+        response += "Now I need to know which doctor you'd like to see. Here are our available doctors:\n"
+        
+        for doctor_name, doctor_info in DOCTORS.items():
+            response += f"• {doctor_name} - {doctor_info['specialty']} ({doctor_info['location']})\n"
+        
+        response += "\nWhich doctor would you prefer to see?"
+        self.conversation_state["step"] = "select_doctor"
+        return response
+    
     def _handle_doctor_selection(self, user_input: str) -> str:
         """Handle doctor selection"""
-        # Match doctor name
-        selected_doctor = None
-        user_input_lower = user_input.lower()
-        
-        for doctor_name in DOCTORS.keys():
-            doctor_name_lower = doctor_name.lower()
-            # Check if the full doctor name is in the input
-            if doctor_name_lower in user_input_lower:
-                selected_doctor = doctor_name
-                break
-            # Check if individual words match (for partial matches)
-            elif any(word in user_input_lower for word in doctor_name_lower.split()):
-                # Make sure it's not a false positive by checking if it's a meaningful match
-                if len(doctor_name_lower.split()) > 1:  # Multi-word names
-                    words = doctor_name_lower.split()
-                    if any(word in user_input_lower for word in words):
-                        selected_doctor = doctor_name
-                        break
+        # Match doctor names, specialties and aliases like "heart doctor"
+        selected_doctor, candidates = doctor_resolver.match(user_input)
         
         if selected_doctor:
             self.conversation_state["appointment_info"]['doctor_name'] = selected_doctor
@@ -183,6 +232,10 @@ Once I have this information, I can check if you're an existing patient or help
             response += "When would you like to schedule your appointment? Please provide a date (MM/DD/YYYY format) or you can say 'earliest available'."
             
             self.conversation_state["step"] = "select_date"
+        elif candidates:
+            response = "More than one of our doctors matches that. Which one would you like to see?\n"
+            for doctor_name in candidates:
+                response += f"• {doctor_name} - {DOCTORS[doctor_name]['specialty']}\n"
         else:
             response = "I didn't recognize that doctor's name. Please choose from our available doctors:\n"
             for doctor_name, doctor_info in DOCTORS.items():
@@ -190,18 +243,23 @@ Once I have this information, I can check if you're an existing patient or help
         
         return response
     
+    def visit_duration(self) -> int:
+        """Minutes to reserve: new patients get a longer first visit"""
+        if self.conversation_state["patient_info"].get('is_new_patient', True):
+            return NEW_PATIENT_DURATION
+        return RETURNING_PATIENT_DURATION
+    
+    def _slot_taken_response(self, selected_time: str) -> str:
+        """Reply when a slot was booked or held by someone else in the meantime"""
+        self.conversation_state["step"] = "select_date"
+        return (f"I'm sorry, the {selected_time} slot was just taken by another patient. "
+                "Please choose another time or provide a different date.")
+    
     def _handle_date_selection(self, user_input: str) -> str:
         """Handle date selection and time slot selection"""
-        # Debug: Print the actual user input to understand the format
-        print(f"DEBUG: User input in _handle_date_selection: '{user_input}'")
-        
         # Check if this is a time slot selection (contains "at" and time)
         # Pattern to match: "I want to schedule for {date} at {time} - {location}"
-        time_pattern = r"at (\d{1,2}:\d{2}) - (.+)"
-        time_match = re.search(time_pattern, user_input)
-        
-        # Debug: Print regex match result
-        print(f"DEBUG: Regex match result: {time_match}")
+        time_match = SLOT_AT_PATTERN.search(user_input)
         
         if time_match:
             # This is a time slot selection, handle it
@@ -220,12 +278,16 @@ Once I have this information, I can check if you're an existing patient or help
                     appointment_date=self.conversation_state["appointment_info"]['appointment_date'],
                     appointment_time=selected_time,
                     location=selected_location,
-                    status='pending'  # Changed to pending - not confirmed yet
+                    status='pending',  # Changed to pending - not confirmed yet
+                    duration=self.visit_duration()
                 )
                 self.conversation_state["appointment_info"]['appointment_id'] = appointment_id
-                print(f"DEBUG: Appointment created with ID: {appointment_id}")
             except Exception as e:
-                print(f"DEBUG: Error creating appointment: {str(e)}")
+                print(f"Error creating appointment: {str(e)}")
+                appointment_id = None
+            
+            if not appointment_id:
+                return self._slot_taken_response(selected_time)
             
             response = f"📅 Appointment scheduled for {self.conversation_state['appointment_info']['appointment_date']} at {selected_time}.\n\n"
             response += f"⚠️ **IMPORTANT**: Your appointment is PENDING confirmation.\n\n"
@@ -244,7 +306,7 @@ Once I have this information, I can check if you're an existing patient or help
             if len(parts) > 1:
                 time_part = parts[1].strip()
                 # Extract time and location from the time part
-                time_location_match = re.search(r"(\d{1,2}:\d{2}) - (.+)", time_part)
+                time_location_match = SLOT_PATTERN.search(time_part)
                 if time_location_match:
                     selected_time = time_location_match.group(1)
                     selected_location = time_location_match.group(2)
@@ -261,12 +323,16 @@ Once I have this information, I can check if you're an existing patient or help
                             appointment_date=self.conversation_state["appointment_info"]['appointment_date'],
                             appointment_time=selected_time,
                             location=selected_location,
-                            status='confirmed'
+                            status='confirmed',
+                            duration=self.visit_duration()
                         )
                         self.conversation_state["appointment_info"]['appointment_id'] = appointment_id
-                        print(f"DEBUG: Appointment created with ID: {appointment_id}")
                     except Exception as e:
-                        print(f"DEBUG: Error creating appointment: {str(e)}")
+                        print(f"Error creating appointment: {str(e)}")
+                        appointment_id = None
+                    
+                    if not appointment_id:
+                        return self._slot_taken_response(selected_time)
                     
                     response = f"Great! I've scheduled your appointment for {self.conversation_state['appointment_info']['appointment_date']} at {selected_time}.\n\n"
                     response += f"Your appointment has been confirmed and stored in our system.\n\n"
@@ -279,8 +345,7 @@ Once I have this information, I can check if you're an existing patient or help
                     return response
         
         # If still no match, check if this is just a time selection (e.g., "15:30")
-        time_only_pattern = r"^(\d{1,2}:\d{2})$"
-        time_only_match = re.search(time_only_pattern, user_input.strip())
+        time_only_match = TIME_ONLY_PATTERN.search(user_input.strip())
         if time_only_match:
             selected_time = time_only_match.group(1)
             
@@ -296,12 +361,16 @@ Once I have this information, I can check if you're an existing patient or help
                     appointment_date=self.conversation_state["appointment_info"]['appointment_date'],
                     appointment_time=selected_time,
                     location='Main Campus',
-                    status='confirmed'
+                    status='confirmed',
+                    duration=self.visit_duration()
                 )
                 self.conversation_state["appointment_info"]['appointment_id'] = appointment_id
-                print(f"DEBUG: Appointment created with ID: {appointment_id}")
             except Exception as e:
-                print(f"DEBUG: Error creating appointment: {str(e)}")
+                print(f"Error creating appointment: {str(e)}")
+                appointment_id = None
+            
+            if not appointment_id:
+                return self._slot_taken_response(selected_time)
             
             response = f"✅ Appointment confirmed for {self.conversation_state['appointment_info']['appointment_date']} at {selected_time}.\n\n"
             response += f"Your appointment has been saved to the system. You can view it in the 'Total Appointments' section."
@@ -311,33 +380,10 @@ Once I have this information, I can check if you're an existing patient or help
             return response
         
         # Original date selection logic
-        # Extract date - support multiple formats
-        date_patterns = [
-            r"(\d{1,2})[/-](\d{1,2})[/-](\d{4})",  # MM/DD/YYYY or MM-DD-YYYY
-            r"(\d{4})[/-](\d{1,2})[/-](\d{1,2})",  # YYYY/MM/DD or YYYY-MM-DD
-            r"(\d{1,2})[/-](\d{1,2})[/-](\d{2})",   # MM/DD/YY or MM-DD-YY
-        ]
+        # Extract date - MM/DD/YYYY, YYYY-MM-DD or MM/DD/YY
+        selected_date = parse_date(user_input)
         
-        date_match = None
-        for pattern in date_patterns:
-            date_match = re.search(pattern, user_input)
-            if date_match:
-                break
-        
-        if date_match:
-            groups = date_match.groups()
-            if len(groups) == 3:
-                if len(groups[0]) == 4:  # YYYY-MM-DD format
-                    year, month, day = groups[0], groups[1], groups[2]
-                elif len(groups[2]) == 4:  # MM-DD-YYYY format
-                    month, day, year = groups[0], groups[1], groups[2]
-                elif len(groups[2]) == 2:  # MM-DD-YY format
-                    month, day, year = groups[0], groups[1], "20" + groups[2]
-                else:
-                    return "I couldn't understand that date format. Please use MM/DD/YYYY format."
-                
-                selected_date = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
-            
+        if selected_date:
             # Check if date is valid and in the future
             try:
                 date_obj = datetime.strptime(selected_date, '%Y-%m-%d')
@@ -348,14 +394,14 @@ Once I have this information, I can check if you're an existing patient or help
                 
                 # Get available slots
                 doctor_name = self.conversation_state["appointment_info"].get('doctor_name', 'Dr. Sarah Johnson')
-                slots = db.get_available_slots(
+                slots = self.availability.get_available_slots(
                     doctor_name=doctor_name,
-                    date=selected_date
+                    date=selected_date,
+                    duration=self.visit_duration()
                 )
                 
                 if slots:
                     self.conversation_state["available_slots"] = slots
-                    print(f"DEBUG: Stored {len(slots)} slots in agent state")
                     
                     response = f"Great! I found available slots for {selected_date}.\n\n"
                     response += f"Here are the available time slots for Dr. {self.conversation_state['appointment_info']['doctor_name']}:\n\n"
@@ -369,38 +415,41 @@ Once I have this information, I can check if you're an existing patient or help
                     self.conversation_state["step"] = "select_date"
                 else:
                     response = f"I'm sorry, but Dr. {self.conversation_state['appointment_info']['doctor_name']} doesn't have any available slots on {selected_date}. "
+                    patient_id = self.conversation_state["patient_info"].get('patient_id')
+                    if patient_id:
+                        # Known patients are offered the day automatically if a slot frees up
+                        waitlist.add_entry(patient_id, selected_date, selected_date, doctor_name=doctor_name,
+                                           duration=self.visit_duration())
+                        response += "I've added you to the waitlist for that day and will contact you if a slot opens up. "
                     response += "Would you like to try a different date?"
                 
             except ValueError:
                 response = "I couldn't understand that date format. Please use MM/DD/YYYY format."
         elif "earliest" in user_input or "soonest" in user_input:
-            # Find earliest available date
-            today = datetime.now()
-            for i in range(30):  # Check next 30 days
-                check_date = (today + timedelta(days=i)).strftime('%Y-%m-%d')
-                slots = db.get_available_slots(
-                    doctor_name=self.conversation_state["appointment_info"]['doctor_name'],
-                    date=check_date
-                )
-                if slots:
-                    self.conversation_state["appointment_info"]['appointment_date'] = check_date
-                    self.conversation_state["available_slots"] = slots
-                    
-                    response = f"Great! I've scheduled your appointment for {check_date}.\n\n"
-                    response += "Now I need to collect your complete patient information. This will help us provide you with the best care possible.\n\n"
-                    response += "I'll guide you through a comprehensive patient intake form step by step. This includes:\n"
-                    response += "• Personal Information\n"
-                    response += "• Contact Information\n"
-                    response += "• Address Information\n"
-                    response += "• Medical Information\n"
-                    response += "• Insurance Information\n"
-                    response += "• Employment & Lifestyle\n"
-                    response += "• Emergency & Legal Information\n"
-                    response += "• Review & Consent\n\n"
-                    response += "Please proceed with the patient intake form below."
-                    
-                    self.conversation_state["step"] = "patient_intake_form"
-                    break
+            # Find the earliest date where the whole visit fits
+            check_date, slots = db.find_earliest_slots(
+                doctor_name=self.conversation_state["appointment_info"]['doctor_name'],
+                duration=self.visit_duration(),
+                days=30  # Check next 30 days
+            )
+            if slots:
+                self.conversation_state["appointment_info"]['appointment_date'] = check_date
+                self.conversation_state["available_slots"] = slots
+                
+                response = f"Great! I've scheduled your appointment for {check_date}.\n\n"
+                response += "Now I need to collect your complete patient information. This will help us provide you with the best care possible.\n\n"
+                response += "I'll guide you through a comprehensive patient intake form step by step. This includes:\n"
+                response += "• Personal Information\n"
+                response += "• Contact Information\n"
+                response += "• Address Information\n"
+                response += "• Medical Information\n"
+                response += "• Insurance Information\n"
+                response += "• Employment & Lifestyle\n"
+                response += "• Emergency & Legal Information\n"
+                response += "• Review & Consent\n\n"
+                response += "Please proceed with the patient intake form below."
+                
+                self.conversation_state["step"] = "patient_intake_form"
             else:
                 response = f"I'm sorry, but Dr. {self.conversation_state['appointment_info']['doctor_name']} doesn't have any available appointments in the next 30 days."
         else:
@@ -414,9 +463,9 @@ Once I have this information, I can check if you're an existing patient or help
         selected_slot = None
         
         # Check for number selection
-        number_match = re.search(r"(\d+)", user_input)
-        if number_match:
-            slot_index = int(number_match.group(1)) - 1
+        number = first_number(user_input)
+        if number is not None:
+            slot_index = number - 1
             if 0 <= slot_index < len(self.conversation_state["available_slots"]):
                 selected_slot = self.conversation_state["available_slots"][slot_index]
         
@@ -498,6 +547,10 @@ Once I have this information, I can check if you're an existing patient or help
             
             # Book appointment
             appointment_id = db.book_appointment(appointment_data)
+            if appointment_id is None:
+                return self._slot_taken_response(appointment_data['appointment_time'])
+            # Only once the slot is ours, so a streamed reply never promises a booking that then fails
+            self._say(response)
             
             response += f"✅ Your appointment has been successfully booked!\n\n"
             response += f"Appointment ID: {appointment_id}\n"
@@ -532,14 +585,13 @@ Once I have this information, I can check if you're an existing patient or help
             response += "**Reminder:** You will receive automated reminders via email and SMS before your appointment.\n\n"
             response += "Thank you for choosing HealthFirst Medical Center. We look forward to seeing you!"
             
+            # Turn the pending hold into a confirmed booking
+            appointment_id = self.conversation_state["appointment_info"].get('appointment_id')
+            if appointment_id:
+                db.confirm_appointment(appointment_id, self.conversation_state["patient_info"].get('patient_id'))
+            
             # Reset conversation state for next patient
-            self.conversation_state = {
-                "step": "greeting",
-                "patient_info": {},
-                "appointment_info": {},
-                "available_slots": [],
-                "insurance_info": {}
-            }
+            self.conversation_state = new_conversation_state()
             
             return response
         else:
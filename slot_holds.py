@@ -0,0 +1,145 @@
+import heapq
+import itertools
+from datetime import datetime, timedelta
+
+from config import PENDING_HOLD_TTL_MINUTES
+from schedule_index import SLOT_MINUTES, covered_times
+
+
+class SlotHold:
+    def __init__(self, hold_id, doctor_name, date, time_slot, appointment_id, expires_at, duration=SLOT_MINUTES):
+        """A temporary reservation of the schedule slots of one visit"""
+        self.hold_id = hold_id
+        self.doctor_name = doctor_name
+        self.date = date
+        self.time_slot = time_slot
+        self.appointment_id = appointment_id
+        self.expires_at = expires_at
+        self.duration = duration
+        self.time_slots = covered_times(time_slot, duration)
+
+    @property
+    def slot_key(self):
+        """The (doctor, date, start time) slot this hold reserves"""
+        return (self.doctor_name, self.date, self.time_slot)
+
+    @property
+    def covered_keys(self):
+        """Every (doctor, date, time) slot the visit occupies"""
+        return [(self.doctor_name, self.date, time_slot) for time_slot in self.time_slots]
+
+    def to_dict(self):
+        """Plain dictionary view of the hold"""
+        return {
+            'hold_id': self.hold_id,
+            'doctor_name': self.doctor_name,
+            'date': self.date,
+            'time_slot': self.time_slot,
+            'duration': self.duration,
+            'appointment_id': self.appointment_id,
+            'expires_at': self.expires_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+
+class SlotHoldManager:
+    def __init__(self, ttl_minutes=PENDING_HOLD_TTL_MINUTES):
+        """Initialize an empty set of holds ordered by expiry"""
+        self.ttl = timedelta(minutes=ttl_minutes)
+        self._ids = itertools.count(1)
+        self._by_slot = {}
+        self._by_appointment = {}
+        # (doctor, date) -> {hold_id: hold}, so slot queries only look at the holds of one day
+        self._by_day = {}
+        # Min-heap of (expires_at, hold_id, slot_key); released holds are skipped lazily
+        self._expiry_heap = []
+
+    def __len__(self):
+        """Number of active holds"""
+        return len(self._by_appointment)
+
+    def place_hold(self, doctor_name, date, time_slot, appointment_id, ttl_minutes=None, now=None,
+                   duration=SLOT_MINUTES):
+        """Reserve the slots of a visit; returns the hold, or None if someone else holds any of them"""
+        # Lapsed holds keep their slots until sweep() hands them to the caller, who expires their appointments
+        now = now or datetime.now()
+
+        for time_covered in covered_times(time_slot, duration):
+            existing = self._by_slot.get((doctor_name, date, time_covered))
+            if existing and existing.appointment_id != appointment_id:
+                return None
+        self.release(appointment_id)
+
+        ttl = timedelta(minutes=ttl_minutes) if ttl_minutes is not None else self.ttl
+        hold = SlotHold(next(self._ids), doctor_name, date, time_slot, appointment_id, now + ttl, duration)
+
+        for key in hold.covered_keys:
+            self._by_slot[key] = hold
+        self._by_appointment[appointment_id] = hold
+        self._by_day.setdefault((doctor_name, date), {})[hold.hold_id] = hold
+        heapq.heappush(self._expiry_heap, (hold.expires_at, hold.hold_id, hold.slot_key))
+        return hold
+
+    def _remove(self, hold):
+        """Forget a hold; its heap entry becomes stale and is skipped on sweep"""
+        for key in hold.covered_keys:
+            if self._by_slot.get(key) is hold:
+                del self._by_slot[key]
+        self._by_appointment.pop(hold.appointment_id, None)
+        day_key = (hold.doctor_name, hold.date)
+        day_holds = self._by_day.get(day_key)
+        if day_holds is not None:
+            day_holds.pop(hold.hold_id, None)
+            if not day_holds:
+                del self._by_day[day_key]
+
+    def release(self, appointment_id):
+        """Drop the hold of an appointment, e.g. on cancellation; returns the hold or None"""
+        hold = self._by_appointment.get(appointment_id)
+        if hold:
+            self._remove(hold)
+        return hold
+
+    def promote(self, appointment_id):
+        """Hand a hold over to a confirmed booking; returns the hold or None if it lapsed"""
+        return self.release(appointment_id)
+
+    def get_hold(self, appointment_id):
+        """The active hold of an appointment, if any"""
+        return self._by_appointment.get(appointment_id)
+
+    def sweep(self, now=None):
+        """Remove and return holds that have expired, touching only expired heap entries"""
+        now = now or datetime.now()
+        expired = []
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            _, hold_id, slot_key = heapq.heappop(self._expiry_heap)
+            hold = self._by_slot.get(slot_key)
+            if hold is not None and hold.hold_id == hold_id:
+                self._remove(hold)
+                expired.append(hold)
+
+        # Drop stale entries left behind by released holds so the heap stays bounded
+        if len(self._expiry_heap) > 2 * len(self._by_appointment) + 64:
+            self._expiry_heap = [
+                (hold.expires_at, hold.hold_id, hold.slot_key) for hold in self._by_appointment.values()
+            ]
+            heapq.heapify(self._expiry_heap)
+        return expired
+
+    def held_times(self, doctor_name, date, now=None):
+        """Times held for a doctor on a date; lapsed holds no longer count even before they are swept"""
+        now = now or datetime.now()
+        held = set()
+        for hold in self._by_day.get((doctor_name, date), {}).values():
+            if hold.expires_at > now:
+                held.update(hold.time_slots)
+        return held
+
+    def next_expiry(self, doctor_name, date):
+        """When the first hold on a doctor's day lapses, or None without holds"""
+        day_holds = self._by_day.get((doctor_name, date))
+        return min(hold.expires_at for hold in day_holds.values()) if day_holds else None
+
+    def is_held(self, doctor_name, date, time_slot):
+        """Whether a slot is currently held, including by a longer visit starting earlier"""
+        return (doctor_name, date, time_slot) in self._by_slot
@@ -0,0 +1,48 @@
+import queue
+import re
+import threading
+
+# A sentence or a line, with the punctuation, spaces or newlines that end it
+FRAGMENT_PATTERN = re.compile(r"[^\n.!?]*(?:[.!?]+[ \t]*|\n+|$)")
+
+
+def fragments(text):
+    """Text cut into the sentence and line fragments it is streamed in"""
+    return [fragment for fragment in FRAGMENT_PATTERN.findall(text) if fragment]
+
+
+def unsent(text, sent):
+    """Fragments of a full response that the chunks streamed so far do not cover"""
+    if text.startswith(sent):
+        return fragments(text[len(sent):])
+    # The response changed course after its first chunks went out, e.g. an error; send it whole
+    return fragments(("\n\n" if sent else "") + text)
+
+
+def stream_in_worker(run):
+    """Call run(write) on a worker thread, yielding what it writes as soon as it is written, then the rest of its reply"""
+    chunks = queue.Queue()
+    finished = object()
+    outcome = {}
+
+    def work():
+        try:
+            outcome['text'] = run(chunks.put)
+        except Exception as e:
+            outcome['error'] = e
+        finally:
+            chunks.put(finished)
+
+    threading.Thread(target=work, daemon=True).start()
+
+    sent = ""
+    while True:
+        chunk = chunks.get()
+        if chunk is finished:
+            break
+        sent += chunk
+        yield chunk
+
+    if 'error' in outcome:
+        raise outcome['error']
+    yield from unsent(outcome['text'], sent)
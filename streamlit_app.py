@@ -3,15 +3,19 @@ import pandas as pd
 from datetime import datetime, timedelta
 import os
 import sys
+import uuid
 
 # Add the current directory to the path so we can import our modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from simple_agent import agent
+from simple_agent import SimpleMedicalAgent
 from database import db
 from data_generator import create_sample_data
 from communication import comm_manager
+from waitlist import waitlist
 from config import DOCTORS
+from conversation_memory import recent_turns
+from availability_cache import AvailabilityCache
 
 # Page configuration
 st.set_page_config(
@@ -21,6 +25,18 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Each browser session gets its own conversation state, so concurrent patients never share one
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if 'availability' not in st.session_state:
+    st.session_state.availability = AvailabilityCache()
+agent = SimpleMedicalAgent(session_id=st.session_state.session_id, availability=st.session_state.availability)
+
+def stream_response(user_input):
+    """Render the agent's reply fragment by fragment as it is produced and return the whole text"""
+    with st.chat_message("assistant"):
+        return st.write_stream(agent.process_message_stream(user_input))
+
 # Custom CSS for better styling
 st.markdown("""
 <style>
@@ -152,10 +168,12 @@ def main():
         
         # System metrics
         try:
-            total_patients = len(db.patients_df)
-            total_appointments = len(db.appointments_df)
-            confirmed_appointments = len(db.appointments_df[db.appointments_df['status'] == 'confirmed'])
-            pending_appointments = len(db.appointments_df[db.appointments_df['status'] == 'pending'])
+            # Counters maintained by the database, so reruns do not rescan the tables
+            metrics = db.get_dashboard_metrics(days=7)
+            total_patients = metrics['total_patients']
+            total_appointments = metrics['total_appointments']
+            confirmed_appointments = metrics['status_counts'].get('confirmed', 0)
+            pending_appointments = metrics['status_counts'].get('pending', 0)
             
             st.markdown("""
             <div class="metric-card">
@@ -185,6 +203,27 @@ def main():
             </div>
             """.format(confirmed_appointments), unsafe_allow_html=True)
             
+            st.markdown("""
+            <div class="metric-card">
+                <h5>📈 Schedule Utilization (7 days)</h5>
+                <h3>{:.0%}</h3>
+            </div>
+            """.format(metrics['utilization']), unsafe_allow_html=True)
+            
+            st.markdown("""
+            <div class="metric-card">
+                <h5>🆕 New / Returning Visits</h5>
+                <h3>{} / {}</h3>
+            </div>
+            """.format(metrics['new_patient_appointments'], metrics['returning_patient_appointments']), unsafe_allow_html=True)
+            
+            st.markdown("""
+            <div class="metric-card">
+                <h5>⏳ Waitlist</h5>
+                <h3>{}</h3>
+            </div>
+            """.format(len(waitlist.get_waiting())), unsafe_allow_html=True)
+            
         except Exception as e:
             st.error(f"Error loading metrics: {str(e)}")
         
@@ -206,7 +245,7 @@ def main():
             st.session_state.show_appointments = False
             st.session_state.show_patients = False
             if 'messages' not in st.session_state:
-                st.session_state.messages = []
+                st.session_state.messages = recent_turns()
         
         # Patient Intake Forms
         st.markdown("### 📋 Patient Intake Forms")
@@ -787,13 +826,12 @@ def main():
                                     appointment_id = verified_appointment.get('appointment_id')
                                     
                                     if appointment_id:
-                                        # Update the specific appointment with patient ID and confirm it
-                                        db.appointments_df.loc[db.appointments_df['appointment_id'] == appointment_id, 'patient_id'] = patient_id
-                                        db.appointments_df.loc[db.appointments_df['appointment_id'] == appointment_id, 'status'] = 'confirmed'
-                                        db.mark_intake_form_sent(appointment_id)
-                                        db.save_data()
-                                        
-                                        st.success(f"🔗 Appointment {appointment_id} linked to Patient {patient_id}")
+                                        # Link the patient and promote the pending hold to a confirmed booking
+                                        if db.confirm_appointment(appointment_id, patient_id):
+                                            db.mark_intake_form_sent(appointment_id)
+                                            st.success(f"🔗 Appointment {appointment_id} linked to Patient {patient_id}")
+                                        else:
+                                            st.error("❌ Your appointment hold expired and the slot is no longer available. Please book a new time.")
                                         
                                         # Clear verification state after successful submission
                                         st.session_state['appointment_verified'] = False
@@ -834,7 +872,7 @@ def main():
             
             # Initialize chat history
             if 'messages' not in st.session_state:
-                st.session_state.messages = []
+                st.session_state.messages = recent_turns()
                 # Add initial greeting
                 st.session_state.messages.append({
                     "role": "assistant",
@@ -908,7 +946,7 @@ def main():
                             # Get AI response
                             with st.spinner("Processing..."):
                                 try:
-                                    ai_response = agent.process_message(user_input)
+                                    ai_response = stream_response(user_input)
                                     st.session_state.messages.append({"role": "assistant", "content": ai_response})
                                     st.success("Information submitted successfully!")
                                     
@@ -929,6 +967,38 @@ def main():
                             # Clear form and rerun
                             st.rerun()
             
+            elif current_step == "confirm_identity":
+                # Possible duplicate record found - ask the patient to confirm
+                st.markdown("""
+                <div class="form-container">
+                    <div class="form-title">🔎 Confirm Your Record</div>
+                    <p>You may already have a record with us. Enter the date of birth or phone number on file to confirm it.</p>
+                </div>
+                """, unsafe_allow_html=True)
+                
+                with st.form(key="confirm_identity_form"):
+                    answer = st.text_input("Date of birth (MM/DD/YYYY) or phone number on file", key="confirm_identity_input")
+                    
+                    submit_button = st.form_submit_button("✅ Confirm")
+                    new_patient_button = st.form_submit_button("🆕 Register me as a new patient")
+                    
+                    if submit_button or new_patient_button:
+                        user_input = answer if submit_button else "no"
+                        
+                        # Add user message to chat
+                        st.session_state.messages.append({"role": "user", "content": user_input})
+                        
+                        with st.spinner("Processing..."):
+                            try:
+                                ai_response = stream_response(user_input)
+                                st.session_state.messages.append({"role": "assistant", "content": ai_response})
+                            except Exception as e:
+                                error_response = f"I encountered an error: {str(e)}. Please try again."
+                                st.session_state.messages.append({"role": "assistant", "content": error_response})
+                                st.error(f"Error: {str(e)}")
+                        
+                        st.rerun()
+            
             elif current_step == "select_doctor":
                 # Doctor selection form
                 st.markdown("""
@@ -953,7 +1023,7 @@ def main():
                         # Get AI response
                         with st.spinner("Processing..."):
                             try:
-                                ai_response = agent.process_message(user_input)
+                                ai_response = stream_response(user_input)
                                 st.session_state.messages.append({"role": "assistant", "content": ai_response})
                                 st.success("Doctor selected successfully!")
                             except Exception as e:
@@ -991,14 +1061,22 @@ def main():
                         max_value=max_date,
                         key="calendar_date_picker"
                     )
-                    
+
+                    # Free slots per day for the chosen doctor, read from the occupancy counts
+                    calendar_doctor = agent.conversation_state.get("appointment_info", {}).get("doctor_name", "Dr. Sarah Johnson")
+                    occupancy = db.get_occupancy(days=14)
+                    occupancy = occupancy[(occupancy['doctor_name'] == calendar_doctor) & (occupancy['open_slots'] > 0)]
+                    if len(occupancy) > 0:
+                        st.caption("Free slots over the next two weeks:")
+                        st.dataframe(occupancy[['date', 'free_slots']], hide_index=True, use_container_width=True)
+
                     # When date is selected, update agent state
                     if 'last_selected_date' not in st.session_state or st.session_state.last_selected_date != selected_date:
                         st.session_state.last_selected_date = selected_date
                         # Call agent to populate available slots
                         date_input = selected_date.strftime('%Y-%m-%d')
                         try:
-                            agent_response = agent.process_message(date_input)
+                            agent_response = stream_response(date_input)
                             st.session_state.messages.append({"role": "assistant", "content": agent_response})
                         except Exception as e:
                             st.error(f"Error processing date: {str(e)}")
@@ -1009,7 +1087,7 @@ def main():
                     # Get available slots for selected date
                     try:
                         doctor_name = agent.conversation_state.get("appointment_info", {}).get("doctor_name", "Dr. Sarah Johnson")
-                        slots = db.get_available_slots(doctor_name=doctor_name, date=selected_date.strftime('%Y-%m-%d'))
+                        slots = st.session_state.availability.get_available_slots(doctor_name=doctor_name, date=selected_date.strftime('%Y-%m-%d'), duration=agent.visit_duration())
                         
                         if slots:
                             st.markdown(f"**Available slots for {selected_date.strftime('%B %d, %Y')}:**")
@@ -1039,7 +1117,7 @@ def main():
                                     # Get AI response
                                     with st.spinner("Processing..."):
                                         try:
-                                            ai_response = agent.process_message(user_input)
+                                            ai_response = stream_response(user_input)
                                             st.session_state.messages.append({"role": "assistant", "content": ai_response})
                                             st.success("✅ Appointment scheduled successfully!")
                                             
@@ -1336,7 +1414,7 @@ def main():
                                     # Get AI response
                                     with st.spinner("Processing intake form..."):
                                         try:
-                                            ai_response = agent.process_message(user_input)
+                                            ai_response = stream_response(user_input)
                                             st.session_state.messages.append({"role": "assistant", "content": ai_response})
                                             st.success("Patient intake form completed successfully!")
                                             
@@ -1389,22 +1467,39 @@ def main():
             st.markdown("### 👥 Patient Management")
             
             # Search functionality
-            search_term = st.text_input("Search patients by name or ID:", placeholder="Enter patient name or ID...")
+            search_term = st.text_input("Search patients by name, ID, email or phone:", placeholder="Enter patient name, ID, email or phone...")
+            
+            page_size = 50
+            
+            # Start from the first page whenever the search text changes
+            if st.session_state.get('patient_search_term') != search_term:
+                st.session_state.patient_search_term = search_term
+                st.session_state.patient_search_page = 1
+            page_number = st.session_state.get('patient_search_page', 1)
             
             try:
-                patients_df = db.patients_df.copy()
-                
                 if search_term:
-                    mask = (
-                        patients_df['first_name'].str.contains(search_term, case=False, na=False) |
-                        patients_df['last_name'].str.contains(search_term, case=False, na=False) |
-                        patients_df['patient_id'].str.contains(search_term, case=False, na=False)
+                    # Ranked lookup from the database's search index instead of scanning every row
+                    patients_df, total_matches = db.search_patients(
+                        search_term, limit=page_size, offset=(page_number - 1) * page_size
                     )
-                    patients_df = patients_df[mask]
+                else:
+                    total_matches = len(db.patients_df)
+                    patients_df = db.patients_df.iloc[(page_number - 1) * page_size:page_number * page_size]
+                
+                total_pages = max(1, (total_matches + page_size - 1) // page_size)
+                if total_pages > 1:
+                    page_number = st.number_input(
+                        f"Page (of {total_pages})", min_value=1, max_value=total_pages,
+                        value=min(page_number, total_pages), step=1
+                    )
+                    if page_number != st.session_state.get('patient_search_page', 1):
+                        st.session_state.patient_search_page = page_number
+                        st.rerun()
                 
                 if len(patients_df) > 0:
                     # Display patient count
-                    st.info(f"📊 Found {len(patients_df)} patient(s)")
+                    st.info(f"📊 Found {total_matches} patient(s)")
                     
                     # Show comprehensive patient info with all intake form fields
                     st.markdown("#### 📋 Complete Patient Database")
@@ -133,6 +133,22 @@ def test_database_operations():
         else:
             print("⚠️  No schedules in database to test slot lookup")
         
+        # IDs of archived appointments are not handed out again
+        if db.patients_df.empty:
+            db._load_data()
+        date, slots = db.find_earliest_slots('Dr. Michael Chen', 30)
+        booking = {'patient_id': db.patients_df.iloc[0]['patient_id'], 'doctor_name': 'Dr. Michael Chen',
+                   'appointment_date': date, 'duration': 30}
+        archived_id = db.book_appointment({**booking, 'appointment_time': slots[0]['time_slot']})
+        db.cancel_appointment(archived_id)
+        db.archive_appointments([archived_id])
+        appointment_id = db.book_appointment({**booking, 'appointment_time': slots[0]['time_slot']})
+        db.cancel_appointment(appointment_id)
+        if int(appointment_id[1:]) <= int(archived_id[1:]):
+            print(f"❌ Appointment ID {appointment_id} reuses the number of archived {archived_id}")
+            return False
+        print("✅ Appointment IDs stay unique after archiving")
+        
         return True
         
     except Exception as e:
@@ -157,12 +173,1311 @@ def test_ai_agent():
             print("❌ AI agent not responding")
             return False
         
+        # "Earliest available" offers the first day with room, and names the doctor when there is none
+        from ai_agent import AgentState, MedicalSchedulingAgent
+        from database import db
+        if db.patients_df.empty:
+            db._load_data()
+        for doctor_name, expected in (('Dr. Michael Chen', db.find_earliest_slots('Dr. Michael Chen', 30)[0]),
+                                      ('Dr. Nobody', 'Nobody')):
+            earliest_agent = MedicalSchedulingAgent()
+            earliest_agent.load_state(AgentState(current_step='select_date', patient_info={'patient_id': 'P0001'},
+                                                 appointment_info={'doctor_name': doctor_name}))
+            response = earliest_agent.process_message("earliest available")
+            if expected not in response or '{' in response:
+                print(f"❌ Wrong earliest-date reply for {doctor_name}: {response}")
+                return False
+        
         return True
         
     except Exception as e:
         print(f"❌ AI agent test failed: {e}")
         return False
 
+def _scratch_database():
+    """A database over a temporary copy of the data files, for tests that write; the live data/ is left alone"""
+    import shutil
+    import tempfile
+    from database import MedicalDatabase
+    
+    database = MedicalDatabase()
+    scratch_dir = tempfile.mkdtemp(prefix="test-data-")
+    for name, path in list(vars(database).items()):
+        if name.endswith('_file'):
+            if os.path.exists(path):
+                shutil.copy(path, scratch_dir)
+            setattr(database, name, os.path.join(scratch_dir, os.path.basename(path)))
+    database._load_data()
+    return database
+
+def _booking_turn_agent():
+    """AI agent whose next message books the earliest open slot with Dr. Michael Chen"""
+    from database import db
+    from ai_agent import AgentState, MedicalSchedulingAgent
+    
+    if db.patients_df.empty:
+        # The database was first imported before the sample data was generated
+        db._load_data()
+    date, slots = db.find_earliest_slots('Dr. Michael Chen', 30)
+    agent = MedicalSchedulingAgent()
+    agent.load_state(AgentState(
+        current_step='collect_insurance',
+        patient_info={'patient_id': 'P0001', 'first_name': 'Test', 'last_name': 'Patient',
+                      'phone': '+1-555-000-0000', 'email': 'test.patient@example.com'},
+        appointment_info={'doctor_name': 'Dr. Michael Chen', 'appointment_date': date,
+                          'appointment_time': slots[0]['time_slot'], 'duration': 30, 'location': 'Main Campus'},
+        insurance_info={'insurance_carrier': 'aetna', 'member_id': 'm1'}
+    ))
+    return agent
+
+def test_agent_tools():
+    """Test the typed in-process tools and their JSON adapters for LLM tool calling"""
+    print("\n🔍 Testing agent tools...")
+    
+    try:
+        import json
+        from dataclasses import asdict
+        from database import db
+        from agent_tools import (PatientQuery, SlotQuery, PatientSearchResult, SlotsResult, search_patient,
+                                 get_available_slots, json_tool, langchain_tools)
+        
+        if db.patients_df.empty:
+            db._load_data()
+        patient = db.patients_df.iloc[0]
+        
+        # Nodes get dataclasses back, with no JSON in between
+        result = search_patient(PatientQuery(first_name=patient['first_name'], last_name=patient['last_name']))
+        if not isinstance(result, PatientSearchResult) or not result.found or result.patient_id != patient['patient_id']:
+            print(f"❌ Wrong patient search result: {result}")
+            return False
+        
+        # Failures are reported in the result instead of raised
+        class BrokenAvailability:
+            def get_available_slots(self, doctor_name, date, duration):
+                raise RuntimeError("schedule unavailable")
+        
+        result = get_available_slots(SlotQuery(doctor_name='Dr. Sarah Johnson', date='2030-01-07'), BrokenAvailability())
+        if not isinstance(result, SlotsResult) or result.error != "schedule unavailable" or result.slots:
+            print(f"❌ Tool error not reported in the result: {result}")
+            return False
+        
+        # The JSON adapter takes a JSON string or keyword arguments and answers with the same fields
+        query = {'first_name': patient['first_name'], 'last_name': patient['last_name']}
+        adapter = json_tool(search_patient, PatientQuery)
+        expected = json.loads(json.dumps(asdict(search_patient(PatientQuery(**query))), default=str))
+        if json.loads(adapter(json.dumps(query))) != expected or json.loads(adapter(**query)) != expected:
+            print("❌ JSON adapter does not match the typed tool")
+            return False
+        
+        tools = {tool.name: tool for tool in langchain_tools()}
+        if 'book_appointment' not in tools or json.loads(tools['search_patient'].invoke(query)) != expected:
+            print(f"❌ Wrong LangChain tools: {sorted(tools)}")
+            return False
+        
+        print("✅ Agent tools working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Agent tools test failed: {e}")
+        return False
+
+def test_booking_confirmation():
+    """Test that the confirmation and intake form go out on the booking turn itself"""
+    print("\n🔍 Testing booking confirmation...")
+    
+    import asyncio
+    from communication import comm_manager
+    from database import db
+    
+    sent = []
+    originals = {name: getattr(comm_manager, name) for name in
+                 ('send_appointment_confirmation', 'send_intake_form', 'asend_appointment_confirmation', 'asend_intake_form')}
+    
+    async def asent(name):
+        sent.append(name)
+        return (True, True) if 'confirmation' in name else True
+    
+    comm_manager.send_appointment_confirmation = lambda *args: sent.append('confirmation') or (True, True)
+    comm_manager.send_intake_form = lambda *args: sent.append('intake_form') or True
+    comm_manager.asend_appointment_confirmation = lambda *args: asent('confirmation')
+    comm_manager.asend_intake_form = lambda *args: asent('intake_form')
+    try:
+        for label in ('sync', 'async'):
+            sent.clear()
+            agent = _booking_turn_agent()
+            if label == 'sync':
+                response = agent.process_message("g1")
+            else:
+                response = asyncio.run(agent.aprocess_message("g1"))
+            state = agent.get_state()
+            db.cancel_appointment(state.appointment_info.get('appointment_id'))
+            
+            if sorted(sent) != ['confirmation', 'intake_form'] or not state.intake_form_sent:
+                print(f"❌ {label}: booking turn sent {sent}")
+                return False
+            if "Appointment ID" not in response or "Confirmation sent" not in response:
+                print(f"❌ {label}: booking turn reply missing details or confirmation: {response}")
+                return False
+            
+            # The next message is answered, not met with "didn't understand", and nothing is sent twice
+            response = agent.process_message("thanks")
+            if "didn't understand" in response or len(sent) != 2:
+                print(f"❌ {label}: follow-up turn answered {response!r} after sending {sent}")
+                return False
+        
+        # When SMTP and Twilio both fail the patient is not told the confirmation went out
+        comm_manager.send_appointment_confirmation = lambda *args: (False, False)
+        comm_manager.send_intake_form = lambda *args: False
+        agent = _booking_turn_agent()
+        response = agent.process_message("g1")
+        state = agent.get_state()
+        db.cancel_appointment(state.appointment_info.get('appointment_id'))
+        if "Confirmation sent" in response or "couldn't send" not in response or state.intake_form_sent:
+            print(f"❌ Failed delivery reported as sent: {response}")
+            return False
+        
+        print("✅ Confirmation sent on the booking turn")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Booking confirmation test failed: {e}")
+        return False
+    finally:
+        for name, method in originals.items():
+            setattr(comm_manager, name, method)
+
+def test_async_agent():
+    """Test concurrent conversations end to end through aprocess_message"""
+    print("\n🔍 Testing async agent...")
+    
+    import asyncio
+    from communication import comm_manager
+    from database import db
+    from ai_agent import MedicalSchedulingAgent
+    from load_generator import DOCTOR_REQUESTS, build_scripts
+    
+    if db.patients_df.empty:
+        db._load_data()
+    # One returning patient per doctor, each taking the earliest slot, so the conversations never compete
+    scripts = build_scripts(len(DOCTOR_REQUESTS), db.patients_df.to_dict('records'), [], new_share=0, earliest_share=1)
+    for script, doctor in zip(scripts, DOCTOR_REQUESTS):
+        script['turns'][2] = doctor
+    
+    sending = {'now': 0, 'peak': 0}
+    originals = {name: getattr(comm_manager, name) for name in ('asend_appointment_confirmation', 'asend_intake_form')}
+    
+    async def send(result, *args):
+        sending['now'] += 1
+        sending['peak'] = max(sending['peak'], sending['now'])
+        await asyncio.sleep(0.05)
+        sending['now'] -= 1
+        return result
+    
+    async def converse(script):
+        agent = MedicalSchedulingAgent(session_id=f"async-test-{id(script)}")
+        for message in script['turns']:
+            await agent.aprocess_message(message)
+        return agent.get_state()
+    
+    async def run_all():
+        return await asyncio.gather(*(converse(script) for script in scripts))
+    
+    comm_manager.asend_appointment_confirmation = lambda *args: send((True, True), *args)
+    comm_manager.asend_intake_form = lambda *args: send(True, *args)
+    try:
+        states = asyncio.run(run_all())
+        booked = [state.appointment_info.get('appointment_id') for state in states]
+        for appointment_id in booked:
+            db.cancel_appointment(appointment_id)
+        
+        if not all(booked) or not all(state.intake_form_sent for state in states):
+            print(f"❌ Not every conversation booked and sent its confirmation: {booked}")
+            return False
+        # Sends of one booking run together, and other conversations go on while they wait
+        if sending['peak'] <= 2:
+            print(f"❌ Notifications were not sent concurrently (peak {sending['peak']})")
+            return False
+        
+        print(f"✅ Async agent booked {len(booked)} concurrent conversations")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Async agent test failed: {e}")
+        return False
+    finally:
+        for name, method in originals.items():
+            setattr(comm_manager, name, method)
+
+def test_streaming():
+    """Test that both agents stream their replies in fragments, the first before slow work finishes"""
+    print("\n🔍 Testing streaming responses...")
+    
+    import time
+    from communication import comm_manager
+    from database import db
+    from simple_agent import SimpleMedicalAgent
+    from streaming import fragments, unsent
+    
+    originals = {name: getattr(comm_manager, name) for name in ('send_appointment_confirmation', 'send_intake_form')}
+    try:
+        if fragments("Hi there. How are you?\nOk") != ["Hi there. ", "How are you?", "\n", "Ok"] or \
+                unsent("Hello. World", "Hello. ") != ["World"] or unsent("Error!", "Hello. ") != ["\n\n", "Error!"]:
+            print("❌ Wrong response fragments")
+            return False
+        
+        # A streamed reply adds up to the same text as the whole one
+        chunks = list(SimpleMedicalAgent().process_message_stream("hello"))
+        if len(chunks) < 2 or "".join(chunks) != SimpleMedicalAgent().process_message("hello"):
+            print(f"❌ Simple agent stream differs from its reply: {chunks}")
+            return False
+        
+        # On the booking turn the first fragment goes out before the slow confirmation is sent
+        def slow_confirmation(*args):
+            time.sleep(0.3)
+            return True, True
+        
+        comm_manager.send_appointment_confirmation = slow_confirmation
+        comm_manager.send_intake_form = lambda *args: True
+        agent = _booking_turn_agent()
+        started = time.perf_counter()
+        first_chunk_seconds, chunks = None, []
+        for chunk in agent.process_message_stream("g1"):
+            if first_chunk_seconds is None:
+                first_chunk_seconds = time.perf_counter() - started
+            chunks.append(chunk)
+        total_seconds = time.perf_counter() - started
+        db.cancel_appointment(agent.get_state().appointment_info.get('appointment_id'))
+        
+        response = "".join(chunks)
+        if not chunks[0].startswith("Excellent!") or "Appointment ID" not in response or "Confirmation sent" not in response:
+            print(f"❌ Wrong streamed booking reply: {chunks}")
+            return False
+        if first_chunk_seconds >= 0.3 or total_seconds < 0.3:
+            print(f"❌ First fragment after {first_chunk_seconds:.2f}s of {total_seconds:.2f}s")
+            return False
+        
+        print(f"✅ Streaming working (first fragment after {first_chunk_seconds * 1000:.0f} ms of {total_seconds * 1000:.0f} ms)")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Streaming test failed: {e}")
+        return False
+    finally:
+        for name, method in originals.items():
+            setattr(comm_manager, name, method)
+
+def test_duplicate_detection():
+    """Test fuzzy duplicate patient detection"""
+    print("\n🔍 Testing duplicate patient detection...")
+    
+    try:
+        from duplicate_detector import DuplicateDetector, soundex
+        
+        patients_df = pd.DataFrame([
+            {'patient_id': 'P0001', 'first_name': 'Jason', 'last_name': 'Walker', 'date_of_birth': '1954-04-01',
+             'phone': '+1-555-445-1662', 'email': 'jason.walker@email.com'},
+            {'patient_id': 'P0002', 'first_name': 'Linda', 'last_name': 'White', 'date_of_birth': '1984-01-04',
+             'phone': '+1-555-584-9156', 'email': 'linda.white@email.com'}
+        ])
+        
+        detector = DuplicateDetector()
+        detector.build(patients_df)
+        
+        if soundex('Robert') != 'R163' or soundex('Rupert') != 'R163':
+            print("❌ Soundex codes incorrect")
+            return False
+        
+        # A misspelled surname with the same DOB should match the existing record
+        matches = detector.find_possible_matches({
+            'first_name': 'Jason', 'last_name': 'Walkr', 'date_of_birth': '1954-04-01',
+            'phone': '555-445-1662', 'email': 'jason.walker@email.com'
+        })
+        if not matches or matches[0]['patient_id'] != 'P0001':
+            print("❌ Typo duplicate not detected")
+            return False
+        print("✅ Typo duplicate detected")
+        
+        # A different person must not be flagged
+        matches = detector.find_possible_matches({
+            'first_name': 'Maria', 'last_name': 'Lopez', 'date_of_birth': '1990-07-12',
+            'phone': '555-111-2222', 'email': 'maria.lopez@email.com'
+        })
+        if matches:
+            print("❌ False duplicate reported")
+            return False
+        print("✅ No false duplicates")
+        
+        # A possible match is confirmed with details only the patient knows; the stored record is never shown
+        from ai_agent import MedicalSchedulingAgent
+        from database import db
+        if db.patients_df.empty:
+            db._load_data()
+        patient = db.patients_df.iloc[0]
+        date_of_birth = pd.to_datetime(patient['date_of_birth'])
+        details = (f"my name is {patient['first_name']} {patient['last_name']}x, born {date_of_birth.strftime('%m/%d/%Y')}, "
+                   f"phone {patient['phone'].replace('+1-', '')}, email {patient['email']}")
+        for reply, linked in ((date_of_birth.strftime('%m/%d/%Y'), True), (patient['phone'], True), ("01/01/1900", False)):
+            agent = MedicalSchedulingAgent()
+            agent.state.current_step = "collecting_patient_info"
+            response = agent.process_message(details)
+            if agent.get_state().current_step != "confirm_identity":
+                print(f"❌ Possible match not offered: {response}")
+                return False
+            if patient['last_name'] in response or date_of_birth.strftime('%Y-%m-%d') in response:
+                print(f"❌ Possible match reply shows the stored record: {response}")
+                return False
+            agent.process_message(reply)
+            if (agent.get_state().patient_info.get('patient_id') == patient['patient_id']) != linked:
+                print(f"❌ Reply {reply!r} should {'' if linked else 'not '}link the existing record")
+                return False
+        print("✅ Possible match confirmed without showing the record")
+        
+        return True
+        
+    except Exception as e:
+        print(f"❌ Duplicate detection test failed: {e}")
+        return False
+
+def test_patient_search():
+    """Test the patient search index"""
+    print("\n🔍 Testing patient search index...")
+    
+    try:
+        from patient_search import PatientSearchIndex
+        
+        index = PatientSearchIndex()
+        index.build(pd.DataFrame([
+            {'patient_id': 'P0001', 'first_name': 'Jason', 'last_name': 'Walker',
+             'phone': '+1-555-445-1662', 'email': 'jason.walker@email.com'},
+            {'patient_id': 'P0002', 'first_name': 'Linda', 'last_name': 'White',
+             'phone': '+1-555-584-9156', 'email': 'linda.white@email.com'}
+        ]))
+        
+        # Prefix, multi-term, ID and infix phone lookups
+        checks = [("wal", ["P0001"]), ("linda wh", ["P0002"]), ("p0002", ["P0002"]), ("445-1662", ["P0001"]), ("zzz", [])]
+        for query, expected in checks:
+            patient_ids, total = index.search(query)
+            if patient_ids != expected or total != len(expected):
+                print(f"❌ Search for '{query}' returned {patient_ids}")
+                return False
+        
+        # Newly added patients are searchable without a rebuild
+        index.add_patient({'patient_id': 'P0003', 'first_name': 'Walter', 'last_name': 'Green'})
+        patient_ids, total = index.search("wal")
+        if patient_ids != ["P0001", "P0003"] or total != 2:
+            print(f"❌ Incremental update not searchable: {patient_ids}")
+            return False
+        
+        print("✅ Patient search index working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Patient search test failed: {e}")
+        return False
+
+def test_slot_holds():
+    """Test TTL slot holds for pending appointments"""
+    print("\n🔍 Testing slot holds...")
+    
+    try:
+        from slot_holds import SlotHoldManager
+        
+        holds = SlotHoldManager(ttl_minutes=60)
+        now = datetime(2025, 1, 6, 9, 0)
+        holds.place_hold('Dr. Sarah Johnson', '2025-01-10', '10:00', 'APT_1', now=now)
+        
+        # A held slot cannot be taken by another appointment
+        if holds.place_hold('Dr. Sarah Johnson', '2025-01-10', '10:00', 'APT_2', now=now) is not None:
+            print("❌ Held slot was given to a second appointment")
+            return False
+        if holds.held_times('Dr. Sarah Johnson', '2025-01-10', now=now) != {'10:00'}:
+            print("❌ Held time not reported for the day")
+            return False
+        
+        # A lapsed hold is only released through a sweep, so its appointment is expired too
+        if holds.place_hold('Dr. Sarah Johnson', '2025-01-10', '10:00', 'APT_2', now=now + timedelta(minutes=61)):
+            print("❌ Placing a hold swept a lapsed one without reporting it")
+            return False
+        # Reads already treat it as free without removing it
+        if holds.held_times('Dr. Sarah Johnson', '2025-01-10', now=now + timedelta(minutes=61)) or len(holds) != 1:
+            print("❌ Lapsed hold still blocks reads, or a read removed it")
+            return False
+        
+        # Holds expire after the TTL and free the slot
+        expired = holds.sweep(now + timedelta(minutes=61))
+        if [hold.appointment_id for hold in expired] != ['APT_1'] or len(holds) != 0:
+            print("❌ Expired hold was not swept")
+            return False
+        
+        # Promoted holds no longer expire
+        holds.place_hold('Dr. Sarah Johnson', '2025-01-10', '10:00', 'APT_3', now=now)
+        holds.promote('APT_3')
+        if holds.sweep(now + timedelta(minutes=61)):
+            print("❌ Promoted hold expired")
+            return False
+        
+        # Lookups offer a lapsed hold's slot without writing; the next booking expires its appointment
+        import time
+        database = _scratch_database()
+        date, slots = database.find_earliest_slots('Dr. Michael Chen', 30)
+        time_slot = slots[0]['time_slot']
+        pending_id = database.create_appointment('P0001', 'Dr. Michael Chen', date, time_slot, 'Main Campus',
+                                                 status='pending', duration=30, hold_minutes=0.005)
+        time.sleep(0.4)
+        status = lambda: database.appointments_df.set_index('appointment_id').loc[pending_id, 'status']
+        if not database.slot_fits('Dr. Michael Chen', date, time_slot, 30) or status() != 'pending':
+            print("❌ Lookup did not offer the lapsed hold's slot, or expired its appointment")
+            return False
+        if not database.book_appointment({'patient_id': 'P0002', 'doctor_name': 'Dr. Michael Chen',
+                                          'appointment_date': date, 'appointment_time': time_slot,
+                                          'duration': 30}) or status() != 'expired':
+            print("❌ Booking over a lapsed hold did not expire its appointment")
+            return False
+        
+        print("✅ Slot holds working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Slot hold test failed: {e}")
+        return False
+
+def test_appointment_compaction():
+    """Test that compaction expires lapsed pending appointments but keeps live holds"""
+    print("\n🔍 Testing appointment compaction...")
+    
+    try:
+        from slot_holds import SlotHoldManager
+        from appointment_compaction import AppointmentCompactor
+        
+        class FakeDatabase:
+            def __init__(self):
+                self.slot_holds = SlotHoldManager(ttl_minutes=60)
+                self.appointments_df = pd.DataFrame(columns=['appointment_id', 'status', 'created_date'])
+                self.expired = []
+            
+            def sweep_expired_holds(self):
+                return 0
+            
+            def expire_appointments(self, appointment_ids):
+                self.expired.extend(appointment_ids)
+                return len(appointment_ids), len(appointment_ids)
+            
+            def archive_appointments(self, appointment_ids):
+                return 0
+        
+        fake_db = FakeDatabase()
+        now = datetime(2030, 1, 7, 9, 0)
+        created = now.strftime('%Y-%m-%d %H:%M:%S')
+        fake_db.appointments_df = pd.DataFrame({'appointment_id': ['OFFER', 'HOLD', 'ORPHAN'], 'status': 'pending',
+                                                'created_date': created})
+        # A waitlist offer is held for longer than the default pending TTL; ORPHAN lost its hold in a restart
+        fake_db.slot_holds.place_hold('Dr. Sarah Johnson', '2030-01-08', '09:00', 'OFFER', ttl_minutes=120, now=now)
+        fake_db.slot_holds.place_hold('Dr. Sarah Johnson', '2030-01-08', '10:00', 'HOLD', now=now)
+        
+        compactor = AppointmentCompactor(fake_db, pending_ttl_minutes=60)
+        compactor.run(now=now + timedelta(minutes=61))
+        if sorted(fake_db.expired) != ['HOLD', 'ORPHAN']:
+            print(f"❌ Wrong pending appointments expired: {fake_db.expired}")
+            return False
+        
+        fake_db.expired = []
+        compactor.run(now=now + timedelta(minutes=121))
+        if 'OFFER' not in fake_db.expired:
+            print("❌ Lapsed waitlist offer was not expired")
+            return False
+        
+        print("✅ Appointment compaction working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Appointment compaction test failed: {e}")
+        return False
+
+def test_appointment_stats():
+    """Test that dashboard counters follow mutations without rescanning the tables"""
+    print("\n🔍 Testing appointment stats...")
+    
+    try:
+        from appointment_stats import AppointmentStats
+        from schedule_index import ScheduleIndex
+        
+        stats = AppointmentStats()
+        stats.build(pd.DataFrame({'appointment_id': ['A1', 'A2'], 'status': ['confirmed', 'pending'],
+                                  'duration': [60, 30]}))
+        stats.on_event('appointment_created', {'appointment_id': 'A3', 'status': 'pending', 'duration': 30})
+        stats.on_event('appointment_confirmed', {'appointment_id': 'A2'})
+        stats.on_event('appointment_cancelled', {'appointment_id': 'A1'})
+        stats.on_event('appointments_expired', {'appointment_ids': ['A3']})
+        stats.on_event('appointments_archived', {'appointment_ids': ['A1']})
+        expected = {'total_appointments': 2, 'status_counts': {'confirmed': 1, 'expired': 1},
+                    'new_patient_appointments': 0, 'returning_patient_appointments': 2}
+        if stats.summary() != expected:
+            print(f"❌ Wrong counts after mutations: {stats.summary()}")
+            return False
+        
+        # Per doctor per day counts come straight from the schedule bitmaps
+        index = ScheduleIndex()
+        index.build(pd.DataFrame({
+            'doctor_name': 'Dr. Sarah Johnson', 'date': '2030-01-07', 'time_slot': ['09:00', '09:30', '10:00'],
+            'is_available': [True, False, True], 'location': 'Main Campus'
+        }))
+        index.mark_booked('Dr. Sarah Johnson', '2030-01-07', ['10:00'])
+        day = index.occupancy('2030-01-07', '2030-01-07').iloc[0]
+        if (day['open_slots'], day['booked_slots'], day['free_slots']) != (3, 2, 1):
+            print(f"❌ Wrong occupancy: {day.to_dict()}")
+            return False
+        
+        # After the bookings, cancellations and archiving of earlier tests the counters still match a full scan
+        from database import db
+        if db.patients_df.empty:
+            db._load_data()
+        if db.get_dashboard_metrics()['status_counts'] != db.appointments_df['status'].value_counts().to_dict():
+            print(f"❌ Dashboard counts drifted from the appointments table: {db.get_dashboard_metrics()}")
+            return False
+        
+        print("✅ Appointment stats working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Appointment stats test failed: {e}")
+        return False
+
+def test_schedule_index():
+    """Test duration-aware slot search"""
+    print("\n🔍 Testing schedule index...")
+    
+    try:
+        from schedule_index import ScheduleIndex
+        
+        times = ['11:00', '11:30', '13:00', '13:30', '14:00']
+        index = ScheduleIndex()
+        index.build(pd.DataFrame({
+            'doctor_name': 'Dr. Sarah Johnson', 'date': '2025-01-10', 'time_slot': times,
+            'is_available': [True, True, True, False, True], 'location': 'Main Campus'
+        }))
+        
+        # A 60-minute visit needs two consecutive free slots, so not across lunch or a booking
+        slots = [slot['time_slot'] for slot in index.available_slots('Dr. Sarah Johnson', '2025-01-10', 60)]
+        if slots != ['11:00']:
+            print(f"❌ Wrong 60-minute start times: {slots}")
+            return False
+        
+        index.mark_free('Dr. Sarah Johnson', '2025-01-10', ['13:30'])
+        if not index.fits('Dr. Sarah Johnson', '2025-01-10', '13:00', 60) or \
+                index.fits('Dr. Sarah Johnson', '2025-01-10', '13:00', 60, blocked_times={'13:30'}):
+            print("❌ Freed or blocked slots not reflected")
+            return False
+        
+        # Vectorized first fit and the Excel row view come from the same bitmaps
+        if index.first_fit(60)['Dr. Sarah Johnson'] != {'date': '2025-01-10', 'time_slot': '11:00'}:
+            print("❌ Wrong first fit")
+            return False
+        if list(index.to_dataframe()['time_slot']) != times:
+            print("❌ Row view does not match the schedule")
+            return False
+        
+        print("✅ Schedule index working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Schedule index test failed: {e}")
+        return False
+
+def test_schedule_templates():
+    """Test the template-based virtual schedule"""
+    print("\n🔍 Testing schedule templates...")
+    
+    try:
+        from schedule_templates import VirtualSchedule
+        
+        schedule = VirtualSchedule()
+        monday, saturday = '2030-01-07', '2030-01-12'
+        
+        # Weekly template: working hours minus lunch, nothing on weekends
+        free = [time_slot for date, time_slot in schedule.free_slots('Dr. Sarah Johnson', monday, monday)]
+        if len(free) != 14 or '12:00' in free or list(schedule.free_slots('Dr. Sarah Johnson', saturday, saturday)):
+            print(f"❌ Wrong template slots: {free}")
+            return False
+        
+        # Exceptions and bookings are subtracted lazily
+        schedule.add_exception('Dr. Sarah Johnson', monday, 'blocked', ['09:00'])
+        schedule.mark_booked('Dr. Sarah Johnson', monday, ['09:30', '10:00'])
+        free = [time_slot for date, time_slot in schedule.free_slots('Dr. Sarah Johnson', monday, monday, duration=60)]
+        if free[0] != '10:30':
+            print(f"❌ Exceptions or bookings not applied: {free}")
+            return False
+        
+        schedule.add_exception('Dr. Sarah Johnson', monday, 'closed')
+        if list(schedule.free_slots('Dr. Sarah Johnson', monday, monday)):
+            print("❌ Closed day still has free slots")
+            return False
+        
+        print("✅ Schedule templates working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Schedule templates test failed: {e}")
+        return False
+
+def test_schedule_horizon():
+    """Test the rolling schedule extension and archiving of past days"""
+    print("\n🔍 Testing schedule horizon...")
+    
+    try:
+        from schedule_index import ScheduleIndex
+        from schedule_templates import VirtualSchedule
+        from schedule_horizon import ScheduleHorizonJob
+        
+        class FakeDatabase:
+            def __init__(self, index):
+                self.schedule_index = index
+            
+            def extend_schedule(self, through_date):
+                return self.schedule_index.extend_through(through_date)
+            
+            def archive_schedule_days(self, before_date):
+                return len(self.schedule_index.drop_days_before(before_date))
+        
+        index = ScheduleIndex()
+        index.virtual = VirtualSchedule()
+        # Bookings made while a day was only virtual carry over when it is materialized
+        index.virtual.mark_booked('Dr. Sarah Johnson', '2030-01-08', ['09:00'])
+        if index.extend_through('2030-01-09', start_date='2030-01-07') != ['2030-01-07', '2030-01-08', '2030-01-09']:
+            print(f"❌ Wrong days materialized: {index.days}")
+            return False
+        if index.fits('Dr. Sarah Johnson', '2030-01-08', '09:00', 30) or \
+                not index.fits('Dr. Sarah Johnson', '2030-01-08', '09:30', 30):
+            print("❌ Virtual booking not carried into the materialized day")
+            return False
+        
+        # A daily run only adds the new days and archives the past ones; bookings survive
+        index.mark_booked('Dr. Sarah Johnson', '2030-01-09', ['10:00'], 'A1')
+        metrics = ScheduleHorizonJob(FakeDatabase(index), horizon_days=3).run(now=datetime(2030, 1, 9, 8, 0))
+        if metrics['days_added'] != 2 or metrics['archived_rows'] == 0 or \
+                (metrics['first_day'], metrics['last_day']) != ('2030-01-09', '2030-01-11'):
+            print(f"❌ Wrong horizon run: {metrics}")
+            return False
+        if index.fits('Dr. Sarah Johnson', '2030-01-09', '10:00', 30) or 'A1' not in index.bookings:
+            print("❌ Booking lost when the horizon moved")
+            return False
+        
+        # Daily extensions append into spare columns instead of copying the whole bitmap each day
+        index.extend_through('2030-01-20')
+        index.extend_through('2030-01-21')
+        bitmap = index._open_bits
+        index.extend_through('2030-01-22')
+        if index._open_bits is not bitmap or index.days[-1] != '2030-01-22' or \
+                index.open_bits.shape[1] != len(index.days) or not index.available_slots('Dr. Sarah Johnson', '2030-01-21'):
+            print("❌ Daily extension reallocated the bitmap or lost the new day")
+            return False
+        
+        print("✅ Schedule horizon working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Schedule horizon test failed: {e}")
+        return False
+
+def test_waitlist():
+    """Test waitlist priority ordering and auto-fill on cancellation"""
+    print("\n🔍 Testing waitlist...")
+    
+    try:
+        import tempfile
+        from waitlist import Waitlist
+        
+        class FakeDatabase:
+            def __init__(self):
+                self.listeners = []
+                self.created = []
+                self.fail = False
+            
+            def subscribe(self, listener):
+                self.listeners.append(listener)
+            
+            def slot_fits(self, doctor_name, date, time_slot, duration):
+                return duration <= 30
+            
+            def create_appointment(self, patient_id, doctor_name, date, time_slot, location, **kwargs):
+                if self.fail:
+                    return None
+                self.created.append((patient_id, doctor_name, date, time_slot))
+                return f"A{len(self.created)}"
+            
+            def get_patient(self, patient_id):
+                return None
+        
+        fake_db = FakeDatabase()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            queue = Waitlist(fake_db, waitlist_file=os.path.join(temp_dir, 'waitlist.csv'))
+            queue.add_entry('P1', '2030-01-07', '2030-01-11', doctor_name='Dr. Sarah Johnson')
+            queue.add_entry('P2', '2030-01-07', '2030-01-11', specialty='Cardiology', priority=-1, duration=60)
+            queue.add_entry('P3', '2030-01-07', '2030-01-11', specialty='Cardiology', time_of_day='afternoon')
+            
+            # P2 ranks first but needs 60 minutes, so P1 gets the 30-minute morning slot
+            for listener in fake_db.listeners:
+                listener('appointment_cancelled', {'appointment_id': 'X', 'doctor_name': 'Dr. Sarah Johnson',
+                                                   'appointment_date': '2030-01-08', 'appointment_time': '09:00'})
+            if fake_db.created != [('P1', 'Dr. Sarah Johnson', '2030-01-08', '09:00')]:
+                print(f"❌ Wrong waitlist offer: {fake_db.created}")
+                return False
+            
+            # A declined offer passes the slot on; P1 has been served, P3 wants afternoons only
+            fake_db.listeners[0]('appointment_cancelled', {'appointment_id': 'A1', 'doctor_name': 'Dr. Sarah Johnson',
+                                                           'appointment_date': '2030-01-08', 'appointment_time': '14:00'})
+            if fake_db.created[-1][0] != 'P3' or queue.entries[queue._offers['A2']]['patient_id'] != 'P3':
+                print(f"❌ Declined slot not re-offered: {fake_db.created}")
+                return False
+            
+            # Entries survive a restart
+            reloaded = Waitlist(FakeDatabase(), waitlist_file=queue.waitlist_file)
+            if len(reloaded.get_waiting()) != 1:
+                print("❌ Waitlist not persisted")
+                return False
+            
+            # Asking again widens the patient's entry instead of queueing them twice
+            entry_id = queue.get_waiting()['entry_id'].iloc[0]
+            if queue.add_entry('P2', '2030-01-10', '2030-01-14', specialty='Cardiology') != entry_id or \
+                    len(queue.entries) != 3 or queue.entries[entry_id]['end_date'] != '2030-01-14':
+                print("❌ Repeat waitlist request not merged")
+                return False
+            
+            # A patient whose offer could not be booked keeps their place
+            other_db = FakeDatabase()
+            other_queue = Waitlist(other_db, waitlist_file=os.path.join(temp_dir, 'other.csv'))
+            other_queue.add_entry('P4', '2030-01-07', '2030-01-11', doctor_name='Dr. Sarah Johnson')
+            cancellation = {'appointment_id': 'X', 'doctor_name': 'Dr. Sarah Johnson',
+                            'appointment_date': '2030-01-08', 'appointment_time': '09:00'}
+            other_db.fail = True
+            other_db.listeners[0]('appointment_cancelled', cancellation)
+            other_db.fail = False
+            other_db.listeners[0]('appointment_cancelled', cancellation)
+            if [created[0] for created in other_db.created] != ['P4']:
+                print(f"❌ Candidate lost after a failed offer: {other_db.created}")
+                return False
+            
+            # Both halves of a cancelled hour are offered; confirming an offer books the entry
+            other_queue.add_entry('P5', '2030-01-07', '2030-01-11', doctor_name='Dr. Sarah Johnson')
+            other_queue.add_entry('P6', '2030-01-07', '2030-01-11', doctor_name='Dr. Sarah Johnson')
+            other_db.listeners[0]('appointment_cancelled', dict(cancellation, appointment_time='10:00', duration=60))
+            if other_db.created[1:] != [('P5', 'Dr. Sarah Johnson', '2030-01-08', '10:00'),
+                                        ('P6', 'Dr. Sarah Johnson', '2030-01-08', '10:30')]:
+                print(f"❌ Second half of a cancelled hour not offered: {other_db.created}")
+                return False
+            other_db.listeners[0]('appointment_confirmed', {'appointment_id': 'A2'})
+            p5_entry = other_queue.entries[other_queue.add_entry('P5', '2030-01-07', '2030-01-11',
+                                                                 doctor_name='Dr. Sarah Johnson')]
+            if p5_entry['status'] != 'waiting' or \
+                    [entry['status'] for entry in other_queue.entries.values()].count('booked') != 1:
+                print("❌ Confirmed offer not booked, or a new request merged into it")
+                return False
+        
+        print("✅ Waitlist working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Waitlist test failed: {e}")
+        return False
+
+def test_batch_rescheduler():
+    """Test moving a doctor's appointments in one transaction and rolling back on failure"""
+    print("\n🔍 Testing batch rescheduler...")
+    
+    from communication import comm_manager
+    send_reschedule_notices = comm_manager.send_reschedule_notices
+    try:
+        from batch_rescheduler import BatchRescheduler
+        
+        # Closing days and moving bookings must not touch the live data
+        db = _scratch_database()
+        rescheduler = BatchRescheduler(db)
+        doctor_name = 'Dr. David Thompson'
+        patient_ids = db.patients_df['patient_id'].tolist()[:3]
+        
+        def book_day(days_ahead):
+            date, slots = db.find_earliest_slots(doctor_name, 30, start_date=datetime.now() + timedelta(days=days_ahead))
+            for patient_id, slot in zip(patient_ids, slots):
+                db.book_appointment({'patient_id': patient_id, 'doctor_name': doctor_name, 'appointment_date': date,
+                                     'appointment_time': slot['time_slot'], 'duration': 30})
+            return date
+        
+        # Every confirmed appointment of the closed day moves to a later free slot
+        date = book_day(10)
+        affected = rescheduler.affected_appointments(doctor_name, date, date)
+        metrics = rescheduler.run(doctor_name, date, date, notify=False)
+        moved_dates = [move['appointment_date'] for move in metrics['moved']]
+        if len(moved_dates) != len(affected) or len(moved_dates) < len(patient_ids) or date in moved_dates or metrics['unplaced']:
+            print(f"❌ Wrong batch reschedule: {metrics}")
+            return False
+        
+        # A pending hold on a closed day expires and its patient is asked to call
+        date, slots = db.find_earliest_slots(doctor_name, 30, start_date=datetime.now() + timedelta(days=15))
+        pending_id = db.create_appointment(patient_ids[0], doctor_name, date, slots[0]['time_slot'], 'Main Campus',
+                                           status='pending', duration=30)
+        told = []
+        comm_manager.send_reschedule_notices = lambda notices, reason=None, unplaced=(): told.extend(unplaced) or (0, 0)
+        metrics = rescheduler.run(doctor_name, date, date)
+        if metrics['expired_pending'] != 1 or [appointment['appointment_id'] for appointment, _ in told] != [pending_id]:
+            print(f"❌ Expired pending appointment not notified: {metrics}, told {told}")
+            return False
+        
+        # A failure part-way leaves every appointment and the schedule as they were
+        date = book_day(20)
+        before = rescheduler.affected_appointments(doctor_name, date, date)
+        move_appointment = db.move_appointment
+        calls = []
+        
+        def failing_move(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise RuntimeError("simulated failure")
+            return move_appointment(*args)
+        
+        db.move_appointment = failing_move
+        try:
+            rescheduler.run(doctor_name, date, date, notify=False)
+            print("❌ Failed batch reschedule did not raise")
+            return False
+        except RuntimeError:
+            pass
+        finally:
+            del db.move_appointment
+        after = rescheduler.affected_appointments(doctor_name, date, date)
+        columns = ['appointment_id', 'appointment_date', 'appointment_time', 'status']
+        if not after[columns].reset_index(drop=True).equals(before[columns].reset_index(drop=True)) or \
+                not db.get_available_slots(doctor_name, date, 30):
+            print("❌ Failed batch reschedule was not rolled back")
+            return False
+        
+        print(f"✅ Batch rescheduler moved {len(moved_dates)} appointments and rolled back a failed run")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Batch rescheduler test failed: {e}")
+        return False
+    finally:
+        comm_manager.send_reschedule_notices = send_reschedule_notices
+
+def test_nlu():
+    """Test the shared message extraction"""
+    print("\n🔍 Testing NLU extraction...")
+    
+    try:
+        from nlu import extract_patient_info, parse_date, is_affirmative
+        
+        info = extract_patient_info("my name is john smith, 01/15/1990, 5551234567, john@email.com")
+        expected = {'first_name': 'john', 'last_name': 'smith', 'date_of_birth': '1990-01-15',
+                    'phone': '+1-555-123-4567', 'email': 'john@email.com'}
+        if info != expected:
+            print(f"❌ Wrong patient details: {info}")
+            return False
+        
+        if [parse_date(text) for text in ["on 2030-01-07", "12/25/2030", "2/3/30", "tomorrow"]] != \
+                ['2030-01-07', '2030-12-25', '2030-02-03', None]:
+            print("❌ Wrong dates parsed")
+            return False
+        
+        from nlu import doctor_resolver
+        if doctor_resolver.match("dr. johnson")[0] != 'Dr. Sarah Johnson' or \
+                doctor_resolver.match("a heart doctor")[0] != 'Dr. Sarah Johnson' or doctor_resolver.match("Dr.")[0]:
+            print("❌ Wrong doctor resolved")
+            return False
+        
+        if not is_affirmative("yes that's me") or is_affirmative("no"):
+            print("❌ Wrong confirmation detection")
+            return False
+        
+        print("✅ NLU extraction working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ NLU test failed: {e}")
+        return False
+
+def test_session_manager():
+    """Test per-session conversation state with LRU spill to disk"""
+    print("\n🔍 Testing session manager...")
+    
+    try:
+        import tempfile
+        from session_manager import SessionManager
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            sessions = SessionManager(dict, max_sessions=2, spill_dir=temp_dir)
+            for session_id in ['a', 'b', 'c']:
+                sessions.get(session_id)['step'] = session_id
+            
+            # 'a' was least recently used, so it went to disk and comes back intact
+            if len(sessions) != 2 or sessions.get_metrics()['spilled'] != 1:
+                print(f"❌ LRU cap not applied: {sessions.get_metrics()}")
+                return False
+            if sessions.get('a') != {'step': 'a'}:
+                print("❌ Spilled session not reloaded")
+                return False
+        
+        print("✅ Session manager working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Session manager test failed: {e}")
+        return False
+
+def test_llm_cache():
+    """Test the LLM response cache with the offline fake model"""
+    print("\n🔍 Testing LLM response cache...")
+    
+    try:
+        import os
+        import tempfile
+        from llm_cache import LLMResponseCache, CachedChatModel, FakeChatModel
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache_file = os.path.join(temp_dir, "llm_cache.sqlite")
+            model = FakeChatModel()
+            cached = CachedChatModel(model, LLMResponseCache(db_path=cache_file))
+            
+            # Near-identical prompts share one model call
+            first = cached.invoke("Which doctors do you have?")
+            second = cached.invoke("which doctors   do you have")
+            if first.content != second.content or model.calls != 1:
+                print(f"❌ Normalized prompt not served from cache ({model.calls} model calls)")
+                return False
+            
+            # A fresh process finds the response in the SQLite tier
+            reopened = CachedChatModel(model, LLMResponseCache(db_path=cache_file))
+            if reopened.invoke("Which doctors do you have?").content != first.content or model.calls != 1:
+                print("❌ Response not reloaded from disk")
+                return False
+            if reopened.cache.get_metrics()['disk_hits'] != 1:
+                print(f"❌ Unexpected metrics: {reopened.cache.get_metrics()}")
+                return False
+            
+            # Prompts with patient details are served from memory but never written to the file
+            prompt = "Patient - first name: jane; date of birth: 1990-01-15. Can I bring my child?"
+            reopened.invoke(prompt, persist=False)
+            reopened.invoke(prompt, persist=False)
+            if model.calls != 2:
+                print(f"❌ Patient prompt not cached in memory ({model.calls} model calls)")
+                return False
+            import sqlite3
+            with sqlite3.connect(cache_file) as connection:
+                rows = connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if rows != 1:
+                print(f"❌ {rows} responses on disk, expected only the one without patient details")
+                return False
+        
+        print("✅ LLM response cache working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ LLM response cache test failed: {e}")
+        return False
+
+def test_conversation_memory():
+    """Test message windowing, the slot summary and the token-budgeted prompt"""
+    print("\n🔍 Testing conversation memory...")
+    
+    try:
+        from langchain.schema import HumanMessage
+        from conversation_memory import window, slot_summary, build_prompt, recent_turns
+        
+        messages = [HumanMessage(content=f"message {number}") for number in range(100)]
+        window(messages, max_turns=5)
+        if len(messages) != 10 or messages[-1].content != "message 99":
+            print(f"❌ Window kept {len(messages)} messages")
+            return False
+        
+        turns = recent_turns(max_turns=2)
+        turns.extend(range(10))
+        if list(turns) != [6, 7, 8, 9]:
+            print(f"❌ Ring buffer kept {list(turns)}")
+            return False
+        
+        summary = slot_summary({'first_name': 'John', 'last_name': 'Smith'}, {'doctor_name': 'Dr. Sarah Johnson'})
+        prompt = build_prompt("You schedule appointments.", summary, messages, token_budget=40)
+        if "John" not in prompt[0].content or not 1 < len(prompt) < 11 or prompt[-1].content != "message 99":
+            print(f"❌ Prompt not built within budget: {[message.content for message in prompt]}")
+            return False
+        
+        print("✅ Conversation memory working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Conversation memory test failed: {e}")
+        return False
+
+def test_availability_cache():
+    """Test memoized availability lookups and their invalidation by booking events"""
+    print("\n🔍 Testing availability cache...")
+    
+    try:
+        import time
+        from availability_cache import AvailabilityCache, AvailabilityVersions
+        from slot_holds import SlotHoldManager
+        
+        class FakeDatabase:
+            def __init__(self):
+                self.listeners = []
+                self.free = ['09:00', '09:30']
+                self.lookups = 0
+                self.slot_holds = SlotHoldManager()
+                self.in_transaction = False
+            
+            def subscribe(self, listener):
+                self.listeners.append(listener)
+            
+            def get_available_slots(self, doctor_name, date, duration):
+                self.lookups += 1
+                return [{'time_slot': time_slot, 'location': 'Main'} for time_slot in self.free]
+            
+            def book(self, time_slot):
+                self.free.remove(time_slot)
+                for listener in self.listeners:
+                    listener('appointment_created', {'doctor_name': 'Dr. A', 'appointment_date': '2030-01-07'})
+        
+        database = FakeDatabase()
+        cache = AvailabilityCache(database, AvailabilityVersions(database))
+        for _ in range(3):
+            cache.get_available_slots('Dr. A', '2030-01-07', 30)
+        if database.lookups != 1:
+            print(f"❌ Repeated lookups reached the database {database.lookups} times")
+            return False
+        
+        # Another session books 09:00; it must not be offered again
+        database.book('09:00')
+        slots = cache.get_available_slots('Dr. A', '2030-01-07', 30)
+        if [slot['time_slot'] for slot in slots] != ['09:30']:
+            print(f"❌ Booked slot still offered: {slots}")
+            return False
+        
+        # Lookups inside a transaction that may be rolled back are neither served from nor kept in the cache
+        database.in_transaction = True
+        database.free = ['09:00']
+        transaction_slots = cache.get_available_slots('Dr. A', '2030-01-07', 30)
+        database.in_transaction = False
+        database.free = ['09:30']
+        if [slot['time_slot'] for slot in transaction_slots] != ['09:00'] or \
+                [slot['time_slot'] for slot in cache.get_available_slots('Dr. A', '2030-01-07', 30)] != ['09:30']:
+            print("❌ Lookup inside a transaction was cached")
+            return False
+        cache.stats = {'hits': 0, 'misses': 0}
+        
+        # A hold that lapses reopens its slots without any event, so the lookup is redone once it has
+        database.slot_holds.place_hold('Dr. A', '2030-01-08', '09:30', 'APT_1', ttl_minutes=0.005)
+        for _ in range(2):
+            cache.get_available_slots('Dr. A', '2030-01-08', 30)
+        time.sleep(0.4)
+        cache.get_available_slots('Dr. A', '2030-01-08', 30)
+        if cache.stats != {'hits': 1, 'misses': 2}:
+            print(f"❌ Lookup cached past the lapse of a hold: {cache.stats}")
+            return False
+        
+        print("✅ Availability cache working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Availability cache test failed: {e}")
+        return False
+
+def test_intent_classifier():
+    """Test local intent classification and which turns escalate to the LLM"""
+    print("\n🔍 Testing intent classifier...")
+    
+    try:
+        from intent_classifier import IntentClassifier, IntentRouter
+        
+        classifier = IntentClassifier.load()
+        expected = {"dr. chen": 'doctor', "03/15/2030": 'date', "earliest available": 'earliest', "2": 'slot_number',
+                    "10:30": 'time', "yes that's me": 'yes', "cancel my appointment": 'cancel'}
+        for text, intent in expected.items():
+            if classifier.predict(text)[0] != intent:
+                print(f"❌ '{text}' classified as {classifier.predict(text)}")
+                return False
+        
+        router = IntentRouter(classifier)
+        if not router.route('select_date', "earliest available")[1] or not router.route('collect_insurance', "aetna")[1]:
+            print("❌ Recognized turns and free-text steps should be served locally")
+            return False
+        if router.route('select_date', "what should i bring to my visit?")[1]:
+            print("❌ Ambiguous free text should escalate")
+            return False
+        
+        metrics = router.get_metrics()
+        if metrics['local'] != 2 or metrics['escalated'] != 1 or metrics['latency_saved_ms'] <= 0:
+            print(f"❌ Unexpected metrics: {metrics}")
+            return False
+        
+        # An escalated turn of the async agent waits for the LLM without holding up the event loop
+        import asyncio
+        import time
+        import ai_agent
+        from langchain.schema import HumanMessage
+        from llm_cache import LLMResponseCache, CachedChatModel, FakeChatModel
+        
+        async def escalate():
+            state = ai_agent.AgentState(current_step='select_date',
+                                        messages=[HumanMessage(content="what should i bring to my visit?")])
+            started = time.perf_counter()
+            
+            async def other_conversation():
+                await asyncio.sleep(0.01)
+                return time.perf_counter() - started
+            
+            state, waited = await asyncio.gather(ai_agent.allm_reply_node(state), other_conversation())
+            return state, waited
+        
+        original_llm = ai_agent.llm
+        ai_agent.llm = CachedChatModel(FakeChatModel(latency=0.3), cache=LLMResponseCache(db_path=None))
+        try:
+            state, waited = asyncio.run(escalate())
+        finally:
+            ai_agent.llm = original_llm
+        if not state.messages[-1].content.startswith("Fake response") or waited > 0.2:
+            print(f"❌ Async LLM reply blocked the event loop for {waited:.2f}s")
+            return False
+        
+        print(f"✅ Intent classifier working ({metrics['local_fraction']:.0%} of turns local)")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Intent classifier test failed: {e}")
+        return False
+
+def test_booking_api():
+    """Test the booking HTTP API through an in-process test client"""
+    print("\n🔍 Testing booking API...")
+    
+    try:
+        import asyncio
+        from aiohttp.test_utils import TestClient, TestServer
+        from booking_api import create_app
+        from database import db
+        
+        if db.patients_df.empty:
+            db._load_data()
+        
+        async def exercise():
+            async with TestClient(TestServer(create_app())) as client:
+                response = await client.post('/sessions/api-test/messages', json={'message': 'hello'})
+                turn = await response.json()
+                if response.status != 200 or not turn['response'] or turn['session_id'] != 'api-test':
+                    return f"conversation turn returned {response.status} {turn}"
+                
+                response = await client.post('/sessions/api-test/messages', json={})
+                if response.status != 400:
+                    return f"empty message returned {response.status}"
+                
+                response = await client.get('/slots', params={'doctor': 'nobody'})
+                if response.status != 404:
+                    return f"unknown doctor returned {response.status}"
+                
+                response = await client.get('/slots', params={'doctor': 'johnson'})
+                slots = await response.json()
+                if response.status != 200 or slots['doctor_name'] != 'Dr. Sarah Johnson':
+                    return f"slot search returned {response.status} {slots}"
+                
+                response = await client.delete('/appointments/NO_SUCH_ID')
+                if response.status != 404:
+                    return f"unknown appointment returned {response.status}"
+                
+                booking = {'patient_id': db.patients_df['patient_id'].iloc[0], 'doctor_name': 'johnson',
+                           'appointment_date': slots['date'], 'appointment_time': '25:99'}
+                response = await client.post('/appointments', json=booking)
+                if response.status != 400:
+                    return f"impossible appointment time returned {response.status}"
+                response = await client.post('/appointments', json=dict(booking, patient_id='NO_SUCH_PATIENT'))
+                if response.status != 404:
+                    return f"unknown patient returned {response.status}"
+                
+                await client.delete('/sessions/api-test')
+            return None
+        
+        problem = asyncio.run(exercise())
+        if problem:
+            print(f"❌ Booking API: {problem}")
+            return False
+        
+        print("✅ Booking API working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Booking API test failed: {e}")
+        return False
+
+def test_load_generator():
+    """Test load scripts, arrival times and the double-booking audit"""
+    print("\n🔍 Testing load generator...")
+    
+    try:
+        import pandas as pd
+        from load_generator import arrival_offsets, build_scripts, double_bookings
+        from data_generator import generate_patient_data
+        
+        patients = generate_patient_data(20).to_dict('records')
+        scripts = build_scripts(200, patients, patients, new_share=0.5, cancel_share=0.2)
+        new_patients = sum(script['patient'] == 'new' for script in scripts)
+        if not 60 <= new_patients <= 140 or not any(script['cancel'] for script in scripts):
+            print(f"❌ Unexpected script mix: {new_patients} new patients")
+            return False
+        if any(len(script['turns']) != 9 for script in scripts):
+            print("❌ AI agent scripts should carry insurance details")
+            return False
+        
+        offsets = arrival_offsets(2000, rate=50)
+        if not 30 <= len(offsets) / offsets[-1] <= 70:
+            print(f"❌ Arrival rate {len(offsets) / offsets[-1]:.1f}/s far from 50/s")
+            return False
+        
+        class FakeDatabase:
+            appointments_df = pd.DataFrame([
+                {'doctor_name': 'Dr. A', 'appointment_date': '2030-01-07', 'appointment_time': '09:00', 'duration': 60, 'status': 'confirmed'},
+                {'doctor_name': 'Dr. A', 'appointment_date': '2030-01-07', 'appointment_time': '09:30', 'duration': 30, 'status': 'confirmed'},
+                {'doctor_name': 'Dr. A', 'appointment_date': '2030-01-07', 'appointment_time': '10:00', 'duration': 30, 'status': 'cancelled'},
+            ])
+        if double_bookings(FakeDatabase()) != 1:
+            print("❌ Overlapping visits not detected")
+            return False
+        
+        print("✅ Load generator working")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Load generator test failed: {e}")
+        return False
+
+def test_replay():
+    """Test that a replay reports replies and bookings that differ from the recorded ones"""
+    print("\n🔍 Testing replay...")
+    
+    try:
+        import json
+        import tempfile
+        from database import db
+        from replay import StageTimer, load_conversations, replay
+        
+        if db.patients_df.empty:
+            db._load_data()
+        path = os.path.join(tempfile.mkdtemp(), "conversations.jsonl")
+        with open(path, 'w') as conversations_file:
+            conversations_file.write(json.dumps({'agent': 'simple', 'turns': ["hello"], 'expect': ["I still need"]}) + "\n")
+            conversations_file.write(json.dumps({'agent': 'simple', 'turns': ["hello", "thanks"],
+                                                 'expect': [None, "this will not appear"], 'booked': True}) + "\n")
+        
+        mismatches = replay(load_conversations(path), 'simple', 2, StageTimer())['mismatches']
+        if [(mismatch['conversation'], mismatch['turn']) for mismatch in mismatches] != [(1, 1), (1, None)]:
+            print(f"❌ Unexpected mismatches: {mismatches}")
+            return False
+        if mismatches[1]['expected'] != 'booked' or mismatches[1]['response'] != 'not booked':
+            print(f"❌ Missed booking not reported: {mismatches[1]}")
+            return False
+        
+        print("✅ Replay reporting mismatches")
+        return True
+        
+    except Exception as e:
+        print(f"❌ Replay test failed: {e}")
+        return False
+
 def test_communication():
     """Test communication system"""
     print("\n🔍 Testing communication system...")
@@ -182,6 +1497,26 @@ def test_communication():
         else:
             print("⚠️  Twilio SMS not configured (using email only)")
         
+        # Reschedule notices go out in one batch per channel, including to patients who must call in
+        emails, texts = [], []
+        comm_manager.send_emails = lambda messages: emails.extend(messages) or len(messages)
+        comm_manager.send_sms = lambda phone, message: texts.append((phone, message)) or True
+        try:
+            patient = {'first_name': 'Ann', 'last_name': 'Lee', 'email': 'ann.lee@email.com', 'phone': '+1-555-000-0001'}
+            previous = {'doctor_name': 'Dr. Sarah Johnson', 'appointment_date': '2030-01-07', 'appointment_time': '09:00'}
+            moved = dict(previous, doctor_name='Dr. Michael Chen')
+            sent = comm_manager.send_reschedule_notices([(moved, patient, previous)], "Doctor out sick",
+                                                        unplaced=[(previous, dict(patient, phone='+1-555-000-0002'))])
+        finally:
+            del comm_manager.send_emails, comm_manager.send_sms
+        if sent != (2, 2) or sorted(phone for phone, _ in texts) != ['+1-555-000-0001', '+1-555-000-0002']:
+            print(f"❌ Reschedule notices not batched: {sent}, {texts}")
+            return False
+        if "Call Us to Reschedule" not in emails[1][1]:
+            print("❌ Unplaced patient not asked to call in")
+            return False
+        print("✅ Reschedule notices batched")
+        
         return True
         
     except Exception as e:
@@ -298,6 +1633,29 @@ def main():
         ("Data Generation", test_data_generation),
         ("Database Operations", test_database_operations),
         ("AI Agent", test_ai_agent),
+        ("Agent Tools", test_agent_tools),
+        ("Booking Confirmation", test_booking_confirmation),
+        ("Async Agent", test_async_agent),
+        ("Streaming", test_streaming),
+        ("Duplicate Detection", test_duplicate_detection),
+        ("Patient Search", test_patient_search),
+        ("Slot Holds", test_slot_holds),
+        ("Appointment Compaction", test_appointment_compaction),
+        ("Appointment Stats", test_appointment_stats),
+        ("Schedule Index", test_schedule_index),
+        ("Schedule Templates", test_schedule_templates),
+        ("Schedule Horizon", test_schedule_horizon),
+        ("Waitlist", test_waitlist),
+        ("Batch Rescheduler", test_batch_rescheduler),
+        ("NLU", test_nlu),
+        ("Session Manager", test_session_manager),
+        ("LLM Cache", test_llm_cache),
+        ("Conversation Memory", test_conversation_memory),
+        ("Availability Cache", test_availability_cache),
+        ("Intent Classifier", test_intent_classifier),
+        ("Load Generator", test_load_generator),
+        ("Replay", test_replay),
+        ("Booking API", test_booking_api),
         ("Communication", test_communication),
         ("Reminder System", test_reminder_system),
     ]
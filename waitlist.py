@@ -0,0 +1,299 @@
+import heapq
+import itertools
+import os
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from config import DOCTORS, WAITLIST_FILE, WAITLIST_OFFER_TTL_MINUTES, RETURNING_PATIENT_DURATION
+from communication import comm_manager
+from database import db
+from schedule_index import covered_times
+
+TIMES_OF_DAY = ('morning', 'afternoon')
+
+# Candidates examined per freed slot when the best ones need a longer visit than fits
+MAX_CANDIDATES_PER_SLOT = 20
+
+WAITLIST_COLUMNS = [
+    'entry_id', 'patient_id', 'doctor_name', 'specialty', 'start_date', 'end_date',
+    'time_of_day', 'duration', 'priority', 'status', 'offered_appointment_id', 'created_date'
+]
+
+
+def time_of_day(time_slot):
+    """'morning' before noon, 'afternoon' after"""
+    return 'morning' if str(time_slot) < '12:00' else 'afternoon'
+
+
+def _date_range(start_date, end_date):
+    """Every 'YYYY-MM-DD' date from start_date to end_date inclusive"""
+    current = datetime.strptime(start_date, '%Y-%m-%d')
+    last = datetime.strptime(end_date, '%Y-%m-%d')
+    while current <= last:
+        yield current.strftime('%Y-%m-%d')
+        current += timedelta(days=1)
+
+
+class Waitlist:
+    def __init__(self, database, waitlist_file=WAITLIST_FILE, offer_ttl_minutes=WAITLIST_OFFER_TTL_MINUTES):
+        """Load waiting patients and start filling cancelled slots from them"""
+        self.database = database
+        self.waitlist_file = waitlist_file
+        self.offer_ttl_minutes = offer_ttl_minutes
+        self.entries = {}
+        self._sequence = itertools.count(1)
+        # (doctor, date, time of day) -> min-heap of (priority, sequence, entry_id);
+        # entries leave the heaps lazily once they are no longer waiting
+        self._queues = {}
+        self._offers = {}
+        # (patient, doctor, specialty when no doctor) -> entry_id of the patient's waiting entry
+        self._waiting = {}
+
+        self._load()
+        database.subscribe(self._on_database_event)
+
+    def _load(self):
+        """Rebuild entries and queues from the waitlist file"""
+        if not os.path.exists(self.waitlist_file):
+            return
+        for entry in pd.read_csv(self.waitlist_file, dtype=str).to_dict('records'):
+            entry = {key: (None if pd.isna(value) else value) for key, value in entry.items()}
+            entry['duration'] = int(entry['duration'] or RETURNING_PATIENT_DURATION)
+            entry['priority'] = int(entry['priority'] or 0)
+            self.entries[entry['entry_id']] = entry
+            if entry['status'] == 'waiting':
+                self._waiting[self._waiting_key(entry['patient_id'], entry['doctor_name'], entry['specialty'])] = \
+                    entry['entry_id']
+                self._enqueue(entry)
+            elif entry['status'] == 'offered':
+                self._offers[entry['offered_appointment_id']] = entry['entry_id']
+
+    def save(self):
+        """Write all entries to the waitlist file"""
+        pd.DataFrame(list(self.entries.values()), columns=WAITLIST_COLUMNS).to_csv(self.waitlist_file, index=False)
+
+    def _doctors_for(self, entry):
+        """Doctors an entry would accept: the named doctor or everyone in the specialty"""
+        if entry.get('doctor_name'):
+            return [entry['doctor_name']]
+        return [name for name, info in DOCTORS.items() if info['specialty'] == entry.get('specialty')]
+
+    def _queue_keys(self, entry):
+        """Every (doctor, date, time of day) queue an entry belongs on"""
+        buckets = TIMES_OF_DAY if entry['time_of_day'] in (None, 'any') else (entry['time_of_day'],)
+        return [(doctor_name, date, bucket) for doctor_name in self._doctors_for(entry)
+                for date in _date_range(entry['start_date'], entry['end_date']) for bucket in buckets]
+
+    def _enqueue(self, entry, keys=None):
+        """Push an entry onto the given queues, by default every doctor, date and time of day it accepts"""
+        rank = (entry['priority'], next(self._sequence), entry['entry_id'])
+        for key in self._queue_keys(entry) if keys is None else keys:
+            heapq.heappush(self._queues.setdefault(key, []), rank)
+
+    @staticmethod
+    def _waiting_key(patient_id, doctor_name, specialty):
+        """Key of a patient's request for a doctor, or for a specialty when no doctor was named"""
+        return (patient_id, doctor_name or None, None if doctor_name else specialty)
+
+    def _waiting_entry(self, patient_id, doctor_name, specialty):
+        """The patient's waiting entry for the same doctor, or for the same specialty without a doctor, if any"""
+        entry_id = self._waiting.get(self._waiting_key(patient_id, doctor_name, specialty))
+        return self.entries.get(entry_id) if entry_id else None
+
+    def _set_status(self, entry, status):
+        """Move an entry to a new status, keeping the index of waiting entries current"""
+        if entry['status'] == 'waiting':
+            self._waiting.pop(self._waiting_key(entry['patient_id'], entry['doctor_name'], entry['specialty']), None)
+        entry['status'] = status
+
+    def _merge(self, entry, start_date, end_date, time_of_day, duration, priority):
+        """Widen a waiting entry to cover a repeat request; only queues it was not on yet get a copy"""
+        queued = set(self._queue_keys(entry))
+        entry['start_date'] = min(entry['start_date'], start_date)
+        entry['end_date'] = max(entry['end_date'], end_date)
+        if entry['time_of_day'] != time_of_day:
+            entry['time_of_day'] = 'any'
+        entry['duration'] = max(entry['duration'], duration)
+        if priority < entry['priority']:
+            # A better priority has to reach every queue
+            entry['priority'] = priority
+            queued = set()
+        self._enqueue(entry, [key for key in self._queue_keys(entry) if key not in queued])
+
+    def add_entry(self, patient_id, start_date, end_date, doctor_name=None, specialty=None,
+                  time_of_day='any', duration=RETURNING_PATIENT_DURATION, priority=0):
+        """Put a patient on the waitlist for a doctor or specialty; lower priority numbers are served first"""
+        if not doctor_name and not specialty:
+            raise ValueError("A waitlist entry needs a doctor or a specialty")
+
+        # Asking again for the same doctor or specialty widens the patient's entry instead of queueing them twice
+        existing = self._waiting_entry(patient_id, doctor_name, specialty)
+        if existing is not None:
+            self._merge(existing, start_date, end_date, time_of_day or 'any', int(duration), int(priority))
+            self.save()
+            return existing['entry_id']
+
+        entry_id = f"W{datetime.now().strftime('%Y%m%d%H%M%S%f')}"
+        entry = {
+            'entry_id': entry_id,
+            'patient_id': patient_id,
+            'doctor_name': doctor_name,
+            'specialty': specialty if not doctor_name else DOCTORS.get(doctor_name, {}).get('specialty'),
+            'start_date': start_date,
+            'end_date': end_date,
+            'time_of_day': time_of_day or 'any',
+            'duration': int(duration),
+            'priority': int(priority),
+            'status': 'waiting',
+            'offered_appointment_id': None,
+            'created_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        }
+        self.entries[entry_id] = entry
+        self._waiting[self._waiting_key(patient_id, doctor_name, specialty)] = entry_id
+        self._enqueue(entry)
+        self.save()
+        return entry_id
+
+    def remove_entry(self, entry_id):
+        """Take a patient off the waitlist; queued copies are skipped lazily"""
+        entry = self.entries.get(entry_id)
+        if not entry or entry['status'] not in ('waiting', 'offered'):
+            return False
+        self._set_status(entry, 'removed')
+        self.save()
+        return True
+
+    def get_waiting(self):
+        """Entries still waiting for a slot, as a dataframe"""
+        waiting = [entry for entry in self.entries.values() if entry['status'] == 'waiting']
+        return pd.DataFrame(waiting, columns=WAITLIST_COLUMNS)
+
+    def drop_past(self, before_date):
+        """Forget queues for past dates and close entries whose window has passed"""
+        for key in [key for key in self._queues if key[1] < before_date]:
+            del self._queues[key]
+        lapsed = [
+            entry for entry in self.entries.values()
+            if entry['status'] == 'waiting' and entry['end_date'] < before_date
+        ]
+        for entry in lapsed:
+            self._set_status(entry, 'lapsed')
+        if lapsed:
+            self.save()
+        return len(lapsed)
+
+    def fill_slot(self, doctor_name, date, time_slot):
+        """Offer a freed slot to the best waiting patient; returns the entry ID offered, or None"""
+        queue = self._queues.get((doctor_name, date, time_of_day(time_slot)))
+        if not queue:
+            return None
+
+        skipped = []
+        offered = None
+        while queue and len(skipped) < MAX_CANDIDATES_PER_SLOT:
+            rank = heapq.heappop(queue)
+            entry = self.entries.get(rank[2])
+            if entry is None or entry['status'] != 'waiting':
+                continue  # stale copy of an entry that was served or removed
+            if not self.database.slot_fits(doctor_name, date, time_slot, entry['duration']):
+                skipped.append(rank)
+                continue
+            if self._offer(entry, doctor_name, date, time_slot):
+                offered = entry['entry_id']
+                break
+            # The booking failed, so the slot is gone; the patient keeps their place in the queue
+            skipped.append(rank)
+            break
+
+        # Candidates needing a longer visit stay queued for later cancellations
+        for rank in skipped:
+            heapq.heappush(queue, rank)
+        return offered
+
+    def fill_slots(self, doctor_name, date, time_slot, duration=RETURNING_PATIENT_DURATION):
+        """Offer every start inside a freed visit, e.g. both halves of a cancelled hour; returns the entry IDs offered"""
+        offered = []
+        for start in covered_times(time_slot, duration):
+            # Starts already taken by an earlier offer in the range no longer fit anyone
+            entry_id = self.fill_slot(doctor_name, date, start)
+            if entry_id:
+                offered.append(entry_id)
+        return offered
+
+    def _offer(self, entry, doctor_name, date, time_slot):
+        """Hold the slot for a waiting patient and notify them"""
+        location = DOCTORS.get(doctor_name, {}).get('location', '')
+        appointment_id = self.database.create_appointment(
+            entry['patient_id'], doctor_name, date, time_slot, location,
+            status='pending', duration=entry['duration'], hold_minutes=self.offer_ttl_minutes
+        )
+        if not appointment_id:
+            return False
+
+        self._set_status(entry, 'offered')
+        entry['offered_appointment_id'] = appointment_id
+        self._offers[appointment_id] = entry['entry_id']
+        self.save()
+
+        patient = self.database.get_patient(entry['patient_id'])
+        if patient:
+            hold = self.database.slot_holds.get_hold(appointment_id)
+            appointment_data = {
+                'appointment_id': appointment_id,
+                'doctor_name': doctor_name,
+                'appointment_date': date,
+                'appointment_time': time_slot,
+                'duration': entry['duration']
+            }
+            comm_manager.send_waitlist_offer(appointment_data, patient, hold.expires_at if hold else None)
+        print(f"Waitlist: offered {doctor_name} {date} {time_slot} to patient {entry['patient_id']}")
+        return True
+
+    def accept_offer(self, appointment_id):
+        """Confirm the held appointment of a waitlisted patient"""
+        if appointment_id not in self._offers:
+            return False
+        # The appointment_confirmed event marks the entry booked
+        return self.database.confirm_appointment(appointment_id)
+
+    def _on_database_event(self, event, payload):
+        """Offer cancelled slots to the waitlist; lapsed offers pass the slot to the next patient"""
+        if event == 'appointment_confirmed':
+            # However the offer was taken up: accept_offer, the intake form or the agent
+            entry_id = self._offers.pop(payload.get('appointment_id'), None)
+            if entry_id:
+                self.entries[entry_id]['status'] = 'booked'
+                self.save()
+
+        elif event == 'appointment_cancelled':
+            entry_id = self._offers.pop(payload.get('appointment_id'), None)
+            if entry_id:
+                # The patient turned the offer down
+                self.entries[entry_id]['status'] = 'declined'
+                self.save()
+            self.fill_slots(payload['doctor_name'], str(payload['appointment_date'])[:10], payload['appointment_time'],
+                            payload.get('duration'))
+
+        elif event == 'schedule_archived':
+            self.drop_past(payload['before_date'])
+
+        elif event == 'appointments_expired':
+            for appointment_id in payload.get('appointment_ids', []):
+                entry_id = self._offers.pop(appointment_id, None)
+                if entry_id is None:
+                    continue
+                entry = self.entries[entry_id]
+                entry['status'] = 'offer_expired'
+                self.save()
+                appointment = self.database.appointments_df[
+                    self.database.appointments_df['appointment_id'] == appointment_id
+                ]
+                if len(appointment):
+                    appointment = appointment.iloc[0]
+                    self.fill_slots(appointment['doctor_name'], str(appointment['appointment_date'])[:10],
+                                    appointment['appointment_time'], appointment['duration'])
+
+
+# Global waitlist instance
+waitlist = Waitlist(db)